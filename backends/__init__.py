@@ -1,11 +1,15 @@
 import abc
+import contextlib
 import importlib
 import inspect
 import json
 import os
-import nltk
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
+import threading
 from types import SimpleNamespace
 from dataclasses import dataclass
 
@@ -15,13 +19,36 @@ import yaml
 
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+
+def _enqueue_handlers(loggers: List[logging.Logger]):
+    """
+    Put the handlers of the loggers behind queues: A logger only puts its records into the queue of a handler
+    (QueueHandler) and a background thread per handler (QueueListener) writes them to the file or the console, so that
+    the game loop does not wait for the I/O and the lock of the handler. The queues are drained at exit.
+    """
+    queue_handlers = {}
+    for logger_ in loggers:
+        for handler in list(logger_.handlers):
+            if handler not in queue_handlers:
+                log_queue = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+                listener.start()
+                atexit.register(listener.stop)  # runs before the handlers are flushed and closed by logging
+                queue_handlers[handler] = logging.handlers.QueueHandler(log_queue)
+            logger_.removeHandler(handler)
+            logger_.addHandler(queue_handlers[handler])
+
+
 # Configure logging
 with open(os.path.join(project_root, "logging.yaml")) as f:
     conf = yaml.safe_load(f)
     log_fn = conf["handlers"]["file_handler"]["filename"]
     log_fn = os.path.join(project_root, log_fn)
     conf["handlers"]["file_handler"]["filename"] = log_fn
+    use_queue_handlers = conf.pop("queue_handlers", False)
     logging.config.dictConfig(conf)
+    if use_queue_handlers:
+        _enqueue_handlers([logging.getLogger()] + [logging.getLogger(name) for name in conf.get("loggers", {})])
 
 
 def get_logger(name):
@@ -60,6 +87,7 @@ class ModelSpec(SimpleNamespace):
 
     def unify(self, other: "ModelSpec") -> "ModelSpec":
         """ Return whether the other ModelSpec is fully contained within this ModelSpec """
+        import nltk  # only needed for partial specs; keep it out of the import path of the package
         result = nltk.featstruct.unify(self.__dict__, other.__dict__)
         if result is None:
             raise ValueError(f"{self} does not unify with {other}")
@@ -79,6 +107,14 @@ class ModelSpec(SimpleNamespace):
         """ dict-like behavior """
         return self.has_attr(item)
 
+    def is_contained_in(self, other: "ModelSpec") -> bool:
+        """ Return whether all attributes of this ModelSpec are present with equal values in the other ModelSpec """
+        return all(key in other.__dict__ and other.__dict__[key] == value for key, value in self.__dict__.items())
+
+    def to_key(self) -> str:
+        """ A canonical string representation of this ModelSpec to be used as a lookup key """
+        return json.dumps(self.__dict__, sort_keys=True, default=str)
+
     def has_attr(self, attribute):
         return hasattr(self, attribute)
 
@@ -120,6 +156,14 @@ class Model(abc.ABC):
         assert hasattr(model_spec, "model_name"), "The passed ModelSpec must have a `model_name` attribute"
         self.model_spec = model_spec
         self.__gen_args = dict()
+        self.__call_gen_args = threading.local()  # the generation arguments of a call in progress per thread
+
+    def __active_gen_args(self) -> Dict:
+        """
+        :return: the generation arguments of the call in progress in this thread (see using_gen_args) or, outside
+                 of such a call, the generation arguments set for the model
+        """
+        return getattr(self.__call_gen_args, "gen_args", self.__gen_args)
 
     def set_gen_args(self, **gen_args):
         """
@@ -134,9 +178,16 @@ class Model(abc.ABC):
         """
         self.__gen_args[arg_name] = arg_value
 
+    def get_gen_args(self) -> Dict:
+        """
+        :return: a copy of all arguments set for the generation process
+        """
+        return dict(self.__active_gen_args())
+
     def get_gen_arg(self, arg_name):
-        assert arg_name in self.__gen_args, f"No '{arg_name}' in gen_args given but is expected"
-        return self.__gen_args[arg_name]
+        gen_args = self.__active_gen_args()
+        assert arg_name in gen_args, f"No '{arg_name}' in gen_args given but is expected"
+        return gen_args[arg_name]
 
     def get_temperature(self):
         """
@@ -150,6 +201,39 @@ class Model(abc.ABC):
         """
         return self.get_gen_arg("max_tokens")
 
+    def get_top_p(self) -> Union[float, None]:
+        """
+        :return: the nucleus sampling probability mass or None, if not set (optional generation argument)
+        """
+        return self.__active_gen_args().get("top_p", None)
+
+    def get_stop(self) -> Union[List[str], None]:
+        """
+        :return: the sequences at which the generation stops or None, if not set (optional generation argument)
+        """
+        stop = self.__active_gen_args().get("stop", None)
+        if isinstance(stop, str):
+            return [stop]
+        return stop
+
+    @contextlib.contextmanager
+    def using_gen_args(self, **gen_args):
+        """
+        Use other generation arguments for the calls within the context, e.g. for the call of one of several players
+        sharing this model. The generation arguments of the model are not changed: the replacement only applies to
+        the current thread, so that calls with other generation arguments can run concurrently in other threads.
+        :param gen_args: the generation arguments to be used within the context
+        """
+        previous_gen_args = getattr(self.__call_gen_args, "gen_args", None)
+        self.__call_gen_args.gen_args = dict(gen_args)
+        try:
+            yield self
+        finally:
+            if previous_gen_args is None:
+                del self.__call_gen_args.gen_args
+            else:
+                self.__call_gen_args.gen_args = previous_gen_args
+
     def get_name(self) -> str:
         return self.model_spec.model_name
 
@@ -191,6 +275,51 @@ class Model(abc.ABC):
         """
         pass
 
+    def generate_responses(self, messages: List[Dict], n: int) -> List[Tuple[Any, Any, str]]:
+        """Get n completions for the same messages, e.g. to sample several episodes that share the messages so far.
+
+        Backends that can sample several completions in a single request (sharing the prompt processing) overwrite
+        this method; by default, the model is called n times.
+
+        Returns:
+            List[Tuple[Any, Any, str]]: n tuples as returned by generate_response().
+        """
+        return [self.generate_response(messages) for _ in range(n)]
+
+
+class ModelProxy(Model):
+    """
+    A view on a model with its own generation arguments, e.g. for one of two players sharing the same model.
+    The model is called with the generation arguments of the proxy (only for the call, see Model.using_gen_args);
+    other attributes are those of the model.
+    """
+
+    def __init__(self, model: Model, gen_args: Dict = None):
+        """
+        :param model: to be called
+        :param gen_args: that overwrite the generation arguments of the model
+        """
+        super().__init__(model.model_spec)
+        self.model = model
+        self.set_gen_args(**model.get_gen_args())
+        if gen_args:
+            for arg_name, arg_value in gen_args.items():
+                self.set_gen_arg(arg_name, arg_value)
+
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        with self.model.using_gen_args(**self.get_gen_args()):
+            return self.model.generate_response(messages)
+
+    def generate_responses(self, messages: List[Dict], n: int) -> List[Tuple[Any, Any, str]]:
+        with self.model.using_gen_args(**self.get_gen_args()):
+            return self.model.generate_responses(messages, n)
+
+    def __getattr__(self, item):
+        """ Give access to the attributes of the model (e.g. a tokenizer) """
+        if item == "model":  # not yet set
+            raise AttributeError(item)
+        return getattr(self.model, item)
+
 
 class Backend(abc.ABC):
     """ Marker class for a model provider."""
@@ -234,6 +363,8 @@ def is_backend(obj):
 
 _backend_registry: Dict[str, Backend] = dict()  # we store references to the class constructor
 _model_registry: List[ModelSpec] = list()  # we store model specs so that users might use model_name for lookup
+_model_registry_index: Dict[str, List[ModelSpec]] = dict()  # model_name -> model specs (in registry order)
+_unified_model_specs: Dict[str, ModelSpec] = dict()  # memoized registry lookups by the query model spec key
 
 
 def load_custom_model_registry(_model_registry_path: str = None, is_optional=True):
@@ -260,7 +391,56 @@ def load_model_registry(_model_registry_path: str = None, is_mandatory=True):
                     f"Missing backend definition in model spec '{_model_spec}'. "
                     f"Check or update the backends/model_registry.json and try again."
                     f"A minimal model spec is {{'model_id':<id>,'backend':<backend>}}.")
-            _model_registry.append(_model_spec)
+            _register_model_spec(_model_spec)
+
+
+def _register_model_spec(model_spec: ModelSpec):
+    _model_registry.append(model_spec)
+    model_name = model_spec.model_name if model_spec.has_attr("model_name") else None
+    _model_registry_index.setdefault(model_name, []).append(model_spec)
+    _unified_model_specs.clear()  # the registry changed, so that previous lookups might be outdated
+
+
+def _candidate_model_specs(model_spec: ModelSpec) -> List[ModelSpec]:
+    """
+    :param model_spec: the query model spec
+    :return: the registered model specs that might unify with the query (in registry order)
+    """
+    if not model_spec.has_attr("model_name"):
+        return _model_registry
+    if None in _model_registry_index:  # entries without a model_name might unify with any query
+        return [registered_spec for registered_spec in _model_registry
+                if not registered_spec.has_attr("model_name")
+                or registered_spec.model_name == model_spec.model_name]
+    return _model_registry_index.get(model_spec.model_name, [])
+
+
+def lookup_model_spec(model_spec: ModelSpec) -> ModelSpec:
+    """
+    Unify the given model spec with the first matching entry of the model registry. The registry is indexed by
+    model_name, so that only entries with the same model_name are considered. When the model spec is fully contained
+    in an entry (e.g. only the model_name is given), then the entry is returned directly. Only otherwise the (more
+    expensive) feature structure unification is applied. The successful lookups are memoized per model spec (a failed
+    lookup is not, because its result would be the given, mutable model spec object).
+    :param model_spec: the (partial) model spec to look up
+    :return: the unified model spec or the given model spec, if no registry entry unifies with it
+    """
+    spec_key = model_spec.to_key()
+    if spec_key in _unified_model_specs:
+        return _unified_model_specs[spec_key]
+    for registered_spec in _candidate_model_specs(model_spec):
+        if model_spec.is_contained_in(registered_spec):
+            unified_spec = registered_spec
+            break
+        try:
+            unified_spec = model_spec.unify(registered_spec)
+            break  # use first model spec that does unify (doesn't throw an error)
+        except ValueError:
+            continue
+    else:
+        return model_spec
+    _unified_model_specs[spec_key] = unified_spec
+    return unified_spec
 
 
 def _register_backend(backend_name: str):
@@ -313,12 +493,7 @@ def get_model_for(model_spec: Union[str, Dict, ModelSpec]) -> Model:
     if model_spec.is_programmatic():
         return CustomResponseModel(model_spec)
 
-    for registered_spec in _model_registry:
-        try:
-            model_spec = model_spec.unify(registered_spec)
-            break  # use first model spec that does unify (doesn't throw an error)
-        except ValueError:
-            continue
+    model_spec = lookup_model_spec(model_spec)
 
     if not model_spec.has_backend():
         raise ValueError(
@@ -341,6 +516,11 @@ class ContextExceededError(Exception):
                  tokens_left: int = 0, context_size: int = 0):
         info = f"{info_str} {tokens_used}/{context_size}"
         super().__init__(info)
+        self.info_str = info_str
         self.tokens_used = tokens_used
         self.tokens_left = tokens_left
         self.context_size = context_size
+
+    def __reduce__(self):
+        """ Keep the token counts when pickled (e.g. when raised in a worker process) """
+        return self.__class__, (self.info_str, self.tokens_used, self.tokens_left, self.context_size)
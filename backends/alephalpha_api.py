@@ -1,11 +1,11 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 
 import aleph_alpha_client
 import anthropic
 import backends
 from backends import ModelSpec, Model
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, optional_gen_args, normalized_usage, USAGE_KEY, retry
+from backends.context_management import api_context_window, ensure_context_limit
 
 logger = backends.get_logger(__name__)
 
@@ -27,7 +27,9 @@ class AlephAlphaModel(backends.Model):
     def __init__(self, client: aleph_alpha_client.Client, model_spec: ModelSpec):
         super().__init__(model_spec)
         self.client = client
+        self.context_window = api_context_window(model_spec)
 
+    @ensure_context_limit
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
@@ -63,13 +65,16 @@ class AlephAlphaModel(backends.Model):
         params = {
             "prompt": aleph_alpha_client.Prompt.from_text(prompt_text),
             "maximum_tokens": self.get_max_tokens(),
-            "stop_sequences": ['\n'],
+            "stop_sequences": self.get_stop() or ['\n'],
             "temperature": self.get_temperature()
         }
+        params.update(optional_gen_args(self, stop=None))
 
         request = aleph_alpha_client.CompletionRequest(**params)
         api_response = self.client.complete(request=request, model=self.model_spec.model_id)
         response = api_response.to_json()
+        response[USAGE_KEY] = normalized_usage(response.get("num_tokens_prompt_total"),
+                                               response.get("num_tokens_generated"))
         response_text = api_response.completions[0].completion.strip()
 
         prompt = params
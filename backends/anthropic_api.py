@@ -1,10 +1,10 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import anthropic
 import backends
 import json
 
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, optional_gen_args, normalized_usage, USAGE_KEY, retry
+from backends.context_management import api_context_window, ensure_context_limit
 
 logger = backends.get_logger(__name__)
 
@@ -24,7 +24,9 @@ class AnthropicModel(backends.Model):
     def __init__(self, client: anthropic.Client, model_spec: backends.ModelSpec):
         super().__init__(model_spec)
         self.client = client
+        self.context_window = api_context_window(model_spec)
 
+    @ensure_context_limit
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
@@ -61,10 +63,18 @@ class AnthropicModel(backends.Model):
             system=system_message,
             model=self.model_spec.model_id,
             temperature=self.get_temperature(),
-            max_tokens=self.get_max_tokens()
+            max_tokens=self.get_max_tokens(),
+            **optional_gen_args(self, stop="stop_sequences")
         )
 
         json_output = completion.model_dump_json()
         response_text = completion.content[0].text
+        response = json.loads(json_output)
+        # the input tokens do not include the tokens read from or written to the prompt cache
+        usage = response.get("usage") or {}
+        cache_read_tokens = usage.get("cache_read_input_tokens") or 0
+        cache_creation_tokens = usage.get("cache_creation_input_tokens") or 0
+        response[USAGE_KEY] = normalized_usage((usage.get("input_tokens") or 0) + cache_read_tokens
+                                               + cache_creation_tokens, usage.get("output_tokens"), cache_read_tokens)
 
-        return prompt, json.loads(json_output), response_text
+        return prompt, response, response_text
@@ -1,8 +1,8 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import cohere
 import backends
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, optional_gen_args, normalized_usage, USAGE_KEY, retry
+from backends.context_management import api_context_window, ensure_context_limit
 import json
 
 logger = backends.get_logger(__name__)
@@ -25,7 +25,9 @@ class CohereModel(backends.Model):
     def __init__(self, client: cohere.Client, model_spec: backends.ModelSpec):
         super().__init__(model_spec)
         self.client = client
+        self.context_window = api_context_window(model_spec)
 
+    @ensure_context_limit
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
@@ -58,7 +60,8 @@ class CohereModel(backends.Model):
             model=self.model_spec.model_id,
             chat_history=chat_history,
             temperature=self.get_temperature(),
-            max_tokens = self.get_max_tokens()
+            max_tokens = self.get_max_tokens(),
+            **optional_gen_args(self, stop="stop_sequences", top_p="p")
         )
 
         response_text = output.text
@@ -66,6 +69,7 @@ class CohereModel(backends.Model):
 
         response = output.__dict__
         response.pop('client')
-        response.pop('token_count')
+        token_count = response.pop('token_count') or {}
+        response[USAGE_KEY] = normalized_usage(token_count.get("prompt_tokens"), token_count.get("response_tokens"))
 
         return prompt, response, response_text
@@ -0,0 +1,270 @@
+"""
+    Context window management: Fit a messages history into the context window of a model before the model is called.
+
+    The strategy to apply is configured per model in the model registry, for example:
+        "context_strategy": "drop_oldest_turns"
+        "context_strategy": {"name": "keep_last_turns", "turns": 3}
+        "context_strategy": {"name": "summarize_oldest_turns", "max_chars": 80}
+    The context size of a model is taken from the registry field "context_size" or otherwise from the model itself.
+
+    For API models, the prompt tokens are counted locally with tiktoken, so that a prompt that does not fit is rejected
+    with a ContextExceededError before it is sent. The counts are only exact for OpenAI models; for the other models
+    they are estimates, so a safety margin of the context size is kept free: a prompt that exceeds the context size
+    by more than the margin is rejected as well, while a prompt that only seems not to fit is sent anyway (with a
+    warning) and left to the API to reject (which is not retried, see backends.utils.retry).
+"""
+import abc
+from functools import wraps
+from typing import List, Dict, Callable, Union, Tuple
+
+import backends
+from backends import token_counting
+from backends.utils import ensure_alternating_roles
+
+logger = backends.get_logger(__name__)
+
+TokenCounter = Callable[[List[Dict]], int]
+
+ESTIMATE_SAFETY_MARGIN = 0.1  # the share of the context size kept free when the prompt tokens are only estimated
+
+
+def _split_system_message(messages: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    if messages and messages[0]["role"] == "system":
+        return messages[:1], messages[1:]
+    return [], messages
+
+
+def _turn_starts(dialogue: List[Dict]) -> List[int]:
+    """ A turn starts with a user message; the latest turn is always kept """
+    return [msg_idx for msg_idx, message in enumerate(dialogue) if message["role"] == "user" and msg_idx > 0]
+
+
+class ContextStrategy(abc.ABC):
+    """ A strategy to shorten a messages history that exceeds the context window of a model. """
+
+    @abc.abstractmethod
+    def fit(self, messages: List[Dict], fits: Callable[[List[Dict]], bool]) -> List[Dict]:
+        """
+        :param messages: the messages history that does not fit into the context window (alternating roles)
+        :param fits: returns whether the given messages fit into the context window
+        :return: new shortened messages (the shortest possible result, if nothing fits); the given are not modified
+        """
+        pass
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class DropOldestTurns(ContextStrategy):
+    """ Drop as few of the oldest turns as necessary, but keep the system message. """
+
+    def fit(self, messages: List[Dict], fits: Callable[[List[Dict]], bool]) -> List[Dict]:
+        system, dialogue = _split_system_message(messages)
+        turn_starts = _turn_starts(dialogue)
+        if not turn_starts:
+            return list(messages)
+        # binary search for the earliest turn to start with that fits (dropping more turns never adds tokens)
+        low, high = 0, len(turn_starts) - 1
+        while low < high:
+            mid = (low + high) // 2
+            if fits(system + dialogue[turn_starts[mid]:]):
+                high = mid
+            else:
+                low = mid + 1
+        return system + dialogue[turn_starts[low]:]
+
+
+class KeepLastTurns(ContextStrategy):
+    """ Keep the system message and only the last k turns. """
+
+    def __init__(self, turns: int = 1):
+        assert turns > 0, "At least the last turn has to be kept"
+        self.turns = turns
+
+    def fit(self, messages: List[Dict], fits: Callable[[List[Dict]], bool]) -> List[Dict]:
+        system, dialogue = _split_system_message(messages)
+        turn_starts = _turn_starts(dialogue)
+        if len(turn_starts) < self.turns:
+            return list(messages)
+        return system + dialogue[turn_starts[-self.turns]:]
+
+
+class SummarizeOldestTurns(ContextStrategy):
+    """
+    Replace as few of the oldest turns as necessary with a programmatic summary, but keep the system message.
+    The summary lists the first line of each dropped message (cut to max_chars) and is prepended to the first kept
+    user message, so that the roles still alternate.
+    """
+
+    def __init__(self, max_chars: int = 80, header: str = "Summary of the earlier conversation:"):
+        self.max_chars = max_chars
+        self.header = header
+
+    def summarize(self, dropped: List[Dict]) -> str:
+        lines = [self.header]
+        for message in dropped:
+            first_line = message["content"].strip().split("\n")[0]
+            if len(first_line) > self.max_chars:
+                first_line = first_line[:self.max_chars] + "..."
+            lines.append(f"{message['role']}: {first_line}")
+        return "\n".join(lines)
+
+    def _summarized(self, system: List[Dict], dialogue: List[Dict], turn_start: int) -> List[Dict]:
+        first_kept = dialogue[turn_start]
+        summary = self.summarize(dialogue[:turn_start])
+        return system + [dict(first_kept, content=f"{summary}\n\n{first_kept['content']}")] + dialogue[turn_start + 1:]
+
+    def fit(self, messages: List[Dict], fits: Callable[[List[Dict]], bool]) -> List[Dict]:
+        system, dialogue = _split_system_message(messages)
+        turn_starts = _turn_starts(dialogue)
+        if not turn_starts:
+            return list(messages)
+        # the summary grows with the dropped turns, so that we look for the first fitting candidate in order
+        for turn_start in turn_starts:
+            candidate = self._summarized(system, dialogue, turn_start)
+            if fits(candidate):
+                return candidate
+        return system + dialogue[turn_starts[-1]:]  # even the shortest summary does not fit
+
+
+_strategy_registry: Dict[str, type] = {
+    "drop_oldest_turns": DropOldestTurns,
+    "keep_last_turns": KeepLastTurns,
+    "summarize_oldest_turns": SummarizeOldestTurns
+}
+
+
+def strategy_from_spec(model_spec: backends.ModelSpec) -> Union[ContextStrategy, None]:
+    """
+    :param model_spec: with an optional 'context_strategy' given as a name or as a dict with a 'name' and arguments
+    :return: the configured strategy or None, if no strategy is configured
+    """
+    if "context_strategy" not in model_spec:
+        return None
+    strategy_def = model_spec["context_strategy"]
+    if isinstance(strategy_def, str):
+        strategy_def = {"name": strategy_def}
+    strategy_args = {key: value for key, value in strategy_def.items() if key != "name"}
+    strategy_name = strategy_def["name"]
+    if strategy_name not in _strategy_registry:
+        raise ValueError(f"Unknown context_strategy '{strategy_name}' for {model_spec.model_name}. "
+                         f"Choose one of {list(_strategy_registry.keys())}.")
+    return _strategy_registry[strategy_name](**strategy_args)
+
+
+def context_size_from_spec(model_spec: backends.ModelSpec, default: int = None) -> int:
+    """
+    :param model_spec: with an optional 'context_size' registry field
+    :param default: the context size known from the model itself (e.g. its config)
+    :return: the context size of the registry entry, if given, otherwise the default
+    """
+    if "context_size" in model_spec:
+        return model_spec["context_size"]
+    return default
+
+
+class ContextWindow:
+    """
+    Knows the context size of a model and how to count the tokens of messages for it. Applies the configured strategy
+    before a call, when the messages (plus the tokens to be generated) would exceed the context size.
+    """
+
+    def __init__(self, model_name: str, context_size: int, count_tokens: TokenCounter,
+                 strategy: ContextStrategy = None):
+        self.model_name = model_name
+        self.context_size = context_size
+        self.count_tokens = count_tokens
+        self.strategy = strategy
+
+    def fits(self, messages: List[Dict], max_new_tokens: int) -> bool:
+        return self.count_tokens(messages) + max_new_tokens <= self.context_size
+
+    def check(self, messages: List[Dict], max_new_tokens: int):
+        """
+        :raise ContextExceededError: if the messages and the tokens to be generated exceed the context size
+        """
+        tokens_used = self.count_tokens(messages) + max_new_tokens
+        if tokens_used > self.context_size:
+            self._reject(tokens_used)
+
+    def _reject(self, tokens_used: int):
+        logger.info("Context token limit for %s exceeded: %d/%d", self.model_name, tokens_used, self.context_size)
+        raise backends.ContextExceededError(f"Context token limit for {self.model_name} exceeded",
+                                            tokens_used=tokens_used, tokens_left=self.context_size - tokens_used,
+                                            context_size=self.context_size)
+
+    def fit(self, messages: List[Dict], max_new_tokens: int) -> List[Dict]:
+        """
+        :param messages: to be passed to the model
+        :param max_new_tokens: to be generated (these have to fit into the context window as well)
+        :return: the messages as is, if they fit or no strategy is configured; otherwise the shortened messages
+        """
+        if self.strategy is None or self.fits(messages, max_new_tokens):
+            return messages
+        fitted_messages = self.strategy.fit(messages, lambda _messages: self.fits(_messages, max_new_tokens))
+        logger.info("Context of %s exceeded: Applied %s to shorten the messages from %d to %d",
+                    self.model_name, self.strategy, len(messages), len(fitted_messages))
+        return fitted_messages
+
+
+class EstimatedContextWindow(ContextWindow):
+    """
+    A context window for token counts that are only estimates (e.g. with the tokenizer of another model): A safety
+    margin of the context size is kept free when the messages are fitted. Messages that exceed the context size by more
+    than the margin are rejected, while messages that only seem to exceed it are warned about, since the estimate might
+    be too high.
+    """
+
+    def __init__(self, model_name: str, context_size: int, count_tokens: TokenCounter,
+                 strategy: ContextStrategy = None, safety_margin: float = ESTIMATE_SAFETY_MARGIN):
+        super().__init__(model_name, context_size, count_tokens, strategy)
+        self.safety_margin = safety_margin
+
+    def fits(self, messages: List[Dict], max_new_tokens: int) -> bool:
+        return self.count_tokens(messages) + max_new_tokens <= self.context_size * (1 - self.safety_margin)
+
+    def check(self, messages: List[Dict], max_new_tokens: int):
+        """
+        :raise ContextExceededError: if the messages and the tokens to be generated exceed the context size by more
+                                     than the safety margin
+        """
+        tokens_used = self.count_tokens(messages) + max_new_tokens
+        if tokens_used > self.context_size * (1 + self.safety_margin):
+            self._reject(tokens_used)
+        if tokens_used > self.context_size:
+            logger.warning("Context token limit for %s probably exceeded: %d/%d (estimated); sending anyway",
+                           self.model_name, tokens_used, self.context_size)
+
+
+def api_context_window(model_spec: backends.ModelSpec, exact: bool = False) -> Union[ContextWindow, None]:
+    """
+    :param model_spec: of an API model with an optional 'context_size' registry field
+    :param exact: True, if the tiktoken encoding of the model counts the prompt tokens exactly (OpenAI models);
+                  otherwise the counts are estimates (see EstimatedContextWindow)
+    :return: a context window that counts the prompt tokens with the tiktoken encoding of the model (loaded on the
+             first count) or None, if the registry entry gives no context size
+    """
+    context_size = context_size_from_spec(model_spec)
+    if context_size is None:
+        return None
+    token_counter = token_counting.tiktoken_counter(model_spec.model_id)
+    context_window_class = ContextWindow if exact else EstimatedContextWindow
+    return context_window_class(model_spec.model_name, context_size, token_counter.count_messages,
+                                strategy_from_spec(model_spec))
+
+
+def ensure_context_limit(generate_response_fn):
+    """
+    Applies the context window of an API model (if any) before the model is called: Shortens the messages with the
+    configured strategy and raises a ContextExceededError, if they still do not fit. This decorator has to be applied
+    before (outside of) any retry decorator, so that a prompt that is too long is not retried.
+    """
+    @wraps(generate_response_fn)
+    def wrapped_fn(self, messages, *args, **kwargs):
+        if self.context_window is not None:
+            messages = ensure_alternating_roles(messages)
+            messages = self.context_window.fit(messages, max_new_tokens=self.get_max_tokens())
+            self.context_window.check(messages, max_new_tokens=self.get_max_tokens())
+        return generate_response_fn(self, messages, *args, **kwargs)
+
+    return wrapped_fn
@@ -2,21 +2,31 @@
     Backend using HuggingFace transformers models.
     Uses HF tokenizers instruct/chat templates for proper input format per model.
 """
+import gc
+import time
 from typing import List, Dict, Tuple, Any, Union
 import torch
 import backends
 
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig, StoppingCriteria, StoppingCriteriaList
 import copy
 
 from jinja2 import TemplateError
 
-from backends.utils import ensure_alternating_roles
+from backends.utils import ensure_alternating_roles, trimmed_response, optional_gen_args, truncate_at_stop, \
+    log_load_time, normalized_usage, USAGE_KEY
+from backends.context_management import ContextWindow, strategy_from_spec, context_size_from_spec
+from backends import token_counting, residency
+from backends.replicas import ReplicatedModel
 
 logger = backends.get_logger(__name__)
 
 FALLBACK_CONTEXT_SIZE = 256
 
+QUANTIZATION_SCHEMES = ["dynamic_int8"]
+LOAD_OPTIONS = ["use_safetensors", "low_cpu_mem_usage"]  # passed to from_pretrained, if given in the model spec
+WEIGHT_FILE_PATTERNS = ["*.safetensors", "*.bin"]  # from_pretrained prefers the safetensors weights
+
 
 def load_config_and_tokenizer(model_spec: backends.ModelSpec) -> Union[AutoTokenizer, AutoConfig, int]:
     """
@@ -78,7 +88,9 @@ def load_config_and_tokenizer(model_spec: backends.ModelSpec) -> Union[AutoToken
         model_config = AutoConfig.from_pretrained(hf_model_str)
 
     # get context token limit for model:
-    if hasattr(model_config, 'max_position_embeddings'):  # this is the standard attribute used by most
+    if 'context_size' in model_spec:  # the registry entry can set a (lower) context limit
+        context_size = context_size_from_spec(model_spec)
+    elif hasattr(model_config, 'max_position_embeddings'):  # this is the standard attribute used by most
         context_size = model_config.max_position_embeddings
     elif hasattr(model_config, 'n_positions'):  # some models may have their context size under this attribute
         context_size = model_config.n_positions
@@ -103,15 +115,30 @@ def load_model(model_spec: backends.ModelSpec) -> Any:
     """
     logger.info(f'Start loading huggingface model weights: {model_spec.model_name}')
 
+    # quantized models are run on the CPU and quantized from full precision weights:
+    quantization = get_quantization(model_spec)
+    load_args = dict(device_map="auto", torch_dtype="auto")
+    if quantization:
+        load_args = dict(device_map="cpu", torch_dtype=torch.float32)
+    # safetensors weights are memory-mapped, so that a reload reads them from the OS page cache:
+    for load_option in LOAD_OPTIONS:
+        if load_option in model_spec:
+            load_args[load_option] = model_spec[load_option]
+
     hf_model_str = model_spec['huggingface_id']
     if 'requires_api_key' in model_spec and model_spec['requires_api_key']:
         # load HF API key:
         creds = backends.load_credentials("huggingface")
         api_key = creds["huggingface"]["api_key"]
         # load model using its default configuration:
-        model = AutoModelForCausalLM.from_pretrained(hf_model_str, token=api_key, device_map="auto", torch_dtype="auto")
+        model = AutoModelForCausalLM.from_pretrained(hf_model_str, token=api_key, **load_args)
     else:
-        model = AutoModelForCausalLM.from_pretrained(hf_model_str, device_map="auto", torch_dtype="auto")
+        model = AutoModelForCausalLM.from_pretrained(hf_model_str, **load_args)
+
+    if quantization == "dynamic_int8":
+        # the weights of linear layers are stored as int8; activations are quantized on the fly per batch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        logger.info(f"Applied {quantization} quantization to {model_spec.model_name}")
 
     logger.info(f"Finished loading huggingface model: {model_spec.model_name}")
     logger.info(f"Model device map: {model.hf_device_map}")
@@ -119,6 +146,125 @@ def load_model(model_spec: backends.ModelSpec) -> Any:
     return model
 
 
+def get_quantization(model_spec: backends.ModelSpec) -> Union[str, None]:
+    """
+    :param model_spec: The ModelSpec for the model with an optional 'quantization'.
+    :return: the quantization scheme to be applied at load time or None
+    """
+    if 'quantization' not in model_spec:
+        return None
+    quantization = model_spec['quantization']
+    if quantization not in QUANTIZATION_SCHEMES:
+        raise ValueError(f"Unknown quantization '{quantization}' for {model_spec.model_name}. "
+                         f"Choose one of {QUANTIZATION_SCHEMES}.")
+    if torch.cuda.is_available():
+        logger.info(f"The {quantization} quantization of {model_spec.model_name} runs on the CPU only, "
+                    f"although a GPU is available.")
+    return quantization
+
+
+def load_draft_model(model_spec: backends.ModelSpec, tokenizer: AutoTokenizer) -> Any:
+    """
+    Load the weights of the draft model referred to by the 'draft_model' of the model spec for assisted generation.
+    The draft model has to be a huggingface_local entry of the model registry sharing the vocabulary of the model.
+    :param model_spec: The ModelSpec for the (main) model.
+    :param tokenizer: The tokenizer of the main model.
+    :return: The transformers model class instance of the loaded draft model.
+    """
+    draft_spec = backends.lookup_model_spec(backends.ModelSpec.from_name(model_spec['draft_model']))
+    if not draft_spec.has_backend() or draft_spec.backend != "huggingface_local":
+        raise ValueError(f"The draft_model '{model_spec['draft_model']}' of {model_spec.model_name} must be a "
+                         f"huggingface_local entry of the model registry.")
+    draft_tokenizer, _, _ = load_config_and_tokenizer(draft_spec)
+    if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+        raise ValueError(f"The draft_model '{draft_spec.model_name}' does not share the vocabulary of "
+                         f"{model_spec.model_name}, which is required for assisted generation.")
+    return load_model(draft_spec)
+
+
+def estimate_weights_bytes(model_spec: backends.ModelSpec) -> int:
+    """
+    Estimate the memory footprint of the model weights (and of the weights of its draft model) before loading them by
+    the size of the weight files.
+    :param model_spec: The ModelSpec for the model.
+    :return: The number of bytes of the weight files, 0 if unknown.
+    """
+    token = None
+    if 'requires_api_key' in model_spec and model_spec['requires_api_key']:
+        token = backends.load_credentials("huggingface")["huggingface"]["api_key"]
+    weights_bytes = residency.weight_files_bytes(model_spec['huggingface_id'], WEIGHT_FILE_PATTERNS, token=token)
+    if 'draft_model' in model_spec:
+        draft_spec = backends.lookup_model_spec(backends.ModelSpec.from_name(model_spec['draft_model']))
+        weights_bytes += residency.weight_files_bytes(draft_spec['huggingface_id'], WEIGHT_FILE_PATTERNS, token=token)
+    return weights_bytes
+
+
+class ForwardCounter:
+    """
+    Counts the forward passes of a model (as a forward hook) to compute the statistics of assisted generation:
+    Each forward pass of the draft model proposes one token and each forward pass of the main model verifies
+    the proposed tokens and adds one token of its own.
+    """
+
+    def __init__(self, model):
+        self.num_calls = 0
+        model.register_forward_hook(self)
+
+    def __call__(self, module, inputs, outputs):
+        self.num_calls += 1
+
+    def reset(self):
+        self.num_calls = 0
+
+
+class StopSequencesCriteria(StoppingCriteria):
+    """
+    Stops the generation once each generated sequence contains one of the stop sequences (transformers 4.38 has no
+    stop_strings). Only the tokens added since the last check are decoded (with a few tokens before them, in which a
+    stop sequence completed by the new tokens may start); the responses are cut at the stop sequences afterwards.
+    """
+
+    def __init__(self, tokenizer: AutoTokenizer, stop: List[str], prompt_length: int):
+        self.tokenizer = tokenizer
+        self.stop = stop
+        # each token is decoded to at least one character, so that a stop sequence starts within these tokens:
+        self.overlap = max(len(stop_sequence) for stop_sequence in stop)
+        self.prompt_length = prompt_length
+        self.checked_length = prompt_length
+        self.stopped = None  # for each sequence, whether it contains a stop sequence
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        if self.stopped is None:
+            self.stopped = [False] * input_ids.shape[0]
+        check_start = max(self.checked_length - self.overlap, self.prompt_length)
+        for sequence_idx, output_ids in enumerate(input_ids):
+            if not self.stopped[sequence_idx]:
+                new_text = self.tokenizer.decode(output_ids[check_start:])
+                self.stopped[sequence_idx] = any(stop_sequence in new_text for stop_sequence in self.stop)
+        self.checked_length = input_ids.shape[1]
+        return all(self.stopped)
+
+
+def set_torch_threads(model_spec: backends.ModelSpec):
+    """
+    Set the number of threads used by torch on the CPU from the optional 'intra_op_threads' and 'inter_op_threads' of
+    the model spec. Without 'intra_op_threads', a single thread is used when a GPU is available (the CPU only feeds the
+    GPU) and otherwise the torch default (one thread per physical core).
+    :param model_spec: The ModelSpec for the model.
+    """
+    if 'intra_op_threads' in model_spec:
+        torch.set_num_threads(model_spec['intra_op_threads'])
+    elif torch.cuda.is_available():
+        torch.set_num_threads(1)
+    if 'inter_op_threads' in model_spec:
+        try:
+            torch.set_num_interop_threads(model_spec['inter_op_threads'])
+        except RuntimeError as e:  # can only be set once per process before any inter-op parallel work
+            logger.warning(f"Cannot set inter_op_threads for {model_spec.model_name}: {e}")
+    logger.info(f"Torch threads for {model_spec.model_name}: intra-op {torch.get_num_threads()}, "
+                f"inter-op {torch.get_num_interop_threads()}")
+
+
 class HuggingfaceLocal(backends.Backend):
     """
     Model/backend handler class for locally-run Huggingface models.
@@ -130,15 +276,18 @@ class HuggingfaceLocal(backends.Backend):
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
         """
         Get a HuggingFaceLocalModel instance with the passed model and settings. Will load all required data for using
-        the model upon initialization.
+        the model upon initialization. When the model spec configures 'replicas', the model is loaded in pinned worker
+        processes instead.
         :param model_spec: The ModelSpec for the model.
         :return: The Model class instance of the model.
         """
-        torch.set_num_threads(1)
+        if 'replicas' in model_spec:
+            return ReplicatedModel(model_spec)
+        set_torch_threads(model_spec)
         return HuggingfaceLocalModel(model_spec)
 
 
-class HuggingfaceLocalModel(backends.Model):
+class HuggingfaceLocalModel(backends.Model, residency.ResidentModel):
     """
     Class for loaded models ready for generation.
     """
@@ -147,14 +296,104 @@ class HuggingfaceLocalModel(backends.Model):
         super().__init__(model_spec)
         # fail-fast
         self.tokenizer, self.config, self.context_size = load_config_and_tokenizer(model_spec)
-        self.model = load_model(model_spec)
+        self.device = self._select_device()
+        self.model = None
+        self.draft_model = None
+        self.weights_location = None  # the device or 'disk', when the weights are unloaded
+        # the raw responses only contain the continuation, unless the full output is kept for debugging:
+        self.keep_full_output = 'full_raw_response' in model_spec and model_spec['full_raw_response']
+        self.load_report = None  # the load duration, the size and the throughput of the last load of the weights
+        residency.prepare_load(self.get_name(), lambda: estimate_weights_bytes(model_spec))
+        self._load_weights_timed()
+        self._memory_footprint = self.load_report["weights_bytes"]
+
+        # count tokens incrementally per message; the chat template overhead is calibrated with exact counts
+        self.token_counter = token_counting.for_encoder(
+            lambda text: self.tokenizer.encode(text, add_special_tokens=False))
+        self.token_counter.calibrate_chat_template(self.count_prompt_tokens_exact)
+        self.context_window = ContextWindow(model_spec.model_name, self.context_size,
+                                            self.token_counter.count_messages,
+                                            strategy=strategy_from_spec(model_spec))
+        residency.register(self)
+
+    def _load_weights_timed(self):
+        load_start = time.perf_counter()
+        self._load_weights()
+        self.load_report = log_load_time(self.get_name(), time.perf_counter() - load_start,
+                                         self._weights_memory_footprint())
+
+    def _load_weights(self):
+        self.model = load_model(self.model_spec)
 
         # check if model's generation_config has pad_token_id set:
         if not self.model.generation_config.pad_token_id:
             # set pad_token_id to tokenizer's eos_token_id to prevent excessive warnings:
             self.model.generation_config.pad_token_id = self.tokenizer.eos_token_id
 
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # assisted (speculative) decoding with a smaller draft model; the draft proposes tokens verified by the model
+        if 'draft_model' in self.model_spec:
+            self.draft_model = load_draft_model(self.model_spec, self.tokenizer)
+            self.draft_model.generation_config.pad_token_id = self.model.generation_config.pad_token_id
+            self.model_forward_counter = ForwardCounter(self.model)
+            self.draft_forward_counter = ForwardCounter(self.draft_model)
+        self.weights_location = self.device
+
+    def _select_device(self) -> str:
+        return "cuda" if torch.cuda.is_available() and not get_quantization(self.model_spec) else "cpu"
+
+    def _weights_memory_footprint(self) -> int:
+        memory_footprint = self.model.get_memory_footprint()
+        if self.draft_model is not None:
+            memory_footprint += self.draft_model.get_memory_footprint()
+        return memory_footprint
+
+    def memory_footprint(self) -> int:
+        return self._memory_footprint
+
+    def is_resident(self) -> bool:
+        return self.weights_location == self.device
+
+    def evict(self, offload: str):
+        """
+        Move the weights to the CPU (only possible for models on a single GPU) or unload them completely.
+        """
+        if offload == "cpu" and self.device != "cpu":
+            try:
+                self.model.to("cpu")
+                if self.draft_model is not None:
+                    self.draft_model.to("cpu")
+                self.weights_location = "cpu"
+            except (RuntimeError, ValueError) as e:  # e.g. the weights are dispatched to several devices
+                logger.info("Cannot offload %s to the CPU, unloading it instead: %s", self.get_name(), e)
+                offload = "disk"
+        if offload == "disk" or self.device == "cpu":
+            self.model = None
+            self.draft_model = None
+            self.weights_location = "disk"
+            gc.collect()
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+
+    def reload(self):
+        if self.weights_location == "cpu":
+            self.model.to(self.device)
+            if self.draft_model is not None:
+                self.draft_model.to(self.device)
+            self.weights_location = self.device
+        elif self.weights_location == "disk":
+            self._load_weights_timed()
+
+    def count_prompt_tokens_exact(self, messages: List[Dict]) -> int:
+        """
+        :return: the number of prompt tokens after applying the chat template to all messages
+        """
+        return len(self.tokenizer.apply_chat_template(messages, add_generation_prompt=True))
+
+    def count_prompt_tokens(self, messages: List[Dict]) -> int:
+        """
+        :return: the estimated number of prompt tokens (only new messages are tokenized)
+        """
+        return self.token_counter.count_messages(messages)
 
     def generate_response(self, messages: List[Dict],
                           return_full_text: bool = False,
@@ -171,24 +410,46 @@ class HuggingfaceLocalModel(backends.Model):
         :param log_messages: If True, raw and cleaned messages passed will be logged.
         :return: the continuation
         """
+        return self.generate_responses(messages, 1, return_full_text=return_full_text, log_messages=log_messages)[0]
+
+    @residency.keep_resident
+    def generate_responses(self, messages: List[Dict], n: int,
+                           return_full_text: bool = False,
+                           log_messages: bool = False) -> List[Tuple[Any, Any, str]]:
+        """
+        Sample n continuations of the same prompt in a single generation (num_return_sequences), so that the prompt
+        is processed once. For greedy decoding, the single continuation is returned n times.
+        :param messages: as for generate_response()
+        :param n: the number of continuations
+        :param return_full_text: If True, whole input context is returned.
+        :param log_messages: If True, raw and cleaned messages passed will be logged.
+        :return: the prompt, the raw response and the continuation for each of the n continuations
+        """
+        if n > 1 and self.draft_model is not None:  # assisted generation supports only a single sequence
+            return [self.generate_response(messages, return_full_text, log_messages) for _ in range(n)]
+
         # log current given messages list:
         if log_messages:
-            logger.info(f"Raw messages passed: {messages}")
+            logger.info("Raw messages passed: %s", messages)
 
         current_messages = ensure_alternating_roles(messages)
+        # shorten the messages with the configured strategy, if they would exceed the context limit:
+        current_messages = self.context_window.fit(current_messages, max_new_tokens=self.get_max_tokens())
 
         # log current flattened messages list:
         if log_messages:
-            logger.info(f"Flattened messages: {current_messages}")
+            logger.info("Flattened messages: %s", current_messages)
 
         # apply chat template & tokenize:
         prompt_tokens = self.tokenizer.apply_chat_template(current_messages, add_generation_prompt=True,
                                                            return_tensors="pt")
         prompt_tokens = prompt_tokens.to(self.device)
+        self.token_counter.calibrate(current_messages, len(prompt_tokens[0]))
 
         prompt_text = self.tokenizer.batch_decode(prompt_tokens)[0]
         prompt = {"inputs": prompt_text, "max_new_tokens": self.get_max_tokens(),
-                  "temperature": self.get_temperature(), "return_full_text": return_full_text}
+                  "temperature": self.get_temperature(), "return_full_text": return_full_text,
+                  **optional_gen_args(self)}
 
         # check context limit:
         context_check = _check_context_limit(self.context_size, prompt_tokens[0],
@@ -206,24 +467,52 @@ class HuggingfaceLocalModel(backends.Model):
         if self.get_temperature() > 0.0:
             do_sample = True
 
+        generation_args = dict(max_new_tokens=self.get_max_tokens(), do_sample=do_sample)
         if do_sample:
-            model_output_ids = self.model.generate(
-                prompt_tokens,
-                temperature=self.get_temperature(),
-                max_new_tokens=self.get_max_tokens(),
-                do_sample=do_sample
-            )
-        else:
-            model_output_ids = self.model.generate(
-                prompt_tokens,
-                max_new_tokens=self.get_max_tokens(),
-                do_sample=do_sample
-            )
-
-        model_output = self.tokenizer.batch_decode(model_output_ids)[0]
-
-        response = {'response': model_output}
-
+            generation_args["temperature"] = self.get_temperature()
+            generation_args["num_return_sequences"] = n
+            if self.get_top_p() is not None:
+                generation_args["top_p"] = self.get_top_p()
+        if self.get_stop():
+            generation_args["stopping_criteria"] = StoppingCriteriaList([
+                StopSequencesCriteria(self.tokenizer, self.get_stop(), prompt_length=prompt_tokens.shape[1])])
+        if self.draft_model is not None:  # greedy outputs are identical to those without the draft model
+            generation_args["assistant_model"] = self.draft_model
+            self.model_forward_counter.reset()
+            self.draft_forward_counter.reset()
+
+        generation_start = time.perf_counter()
+        model_output_ids = self.model.generate(prompt_tokens, **generation_args)
+        generation_time = time.perf_counter() - generation_start
+
+        prompt_length = prompt_tokens.shape[1]
+        pad_token_id = self.model.generation_config.pad_token_id
+        # the shorter sequences are padded (only for n > 1); remove the padding before decoding:
+        all_output_ids = [_strip_padding(output_ids.tolist(), pad_token_id) if n > 1 else output_ids.tolist()
+                          for output_ids in model_output_ids]
+        if not do_sample:
+            all_output_ids = all_output_ids * n
+
+        responses = []
+        for output_idx, output_ids in enumerate(all_output_ids):
+            model_output = self.tokenizer.decode(output_ids)
+            continuation = self.tokenizer.decode(output_ids[prompt_length:])
+            response = trimmed_response(continuation, prompt_text, prompt_tokens=prompt_length,
+                                        completion_tokens=len(output_ids) - prompt_length)
+            if output_idx > 0:  # the prompt is processed once (and greedy continuations are generated once)
+                response[USAGE_KEY] = normalized_usage(0, len(output_ids) - prompt_length if do_sample else 0)
+            if self.keep_full_output:
+                response['response'] = model_output
+            if self.draft_model is not None:
+                response['assisted_decoding'] = self._assisted_decoding_stats(len(output_ids) - prompt_length,
+                                                                              generation_time)
+            response_text = self._cull_response(model_output, prompt_text, return_full_text)
+            if self.get_stop() and not return_full_text:  # the generation may go beyond the first stop sequence
+                response_text = truncate_at_stop(response_text, self.get_stop()).strip()
+            responses.append((prompt, response, response_text))
+        return responses
+
+    def _cull_response(self, model_output: str, prompt_text: str, return_full_text: bool) -> str:
         # cull input context; equivalent to transformers.pipeline method:
         if not return_full_text:
             response_text = model_output.replace(prompt_text, '').strip()
@@ -239,7 +528,35 @@ class HuggingfaceLocalModel(backends.Model):
         else:
             response_text = model_output.strip()
 
-        return prompt, response, response_text
+        return response_text
+
+    def _assisted_decoding_stats(self, num_new_tokens: int, generation_time: float) -> Dict:
+        """
+        :return: the statistics of the last assisted generation: the acceptance rate of the draft tokens and the
+                 speedup as the number of new tokens per forward pass of the model (1.0 without assistance)
+        """
+        model_calls = self.model_forward_counter.num_calls
+        draft_calls = self.draft_forward_counter.num_calls
+        # each forward pass of the model adds one token of its own after the accepted draft tokens
+        accepted_tokens = max(0, num_new_tokens - model_calls)
+        return {
+            "draft_model": self.model_spec['draft_model'],
+            "new_tokens": num_new_tokens,
+            "draft_tokens": draft_calls,
+            "accepted_tokens": accepted_tokens,
+            "acceptance_rate": round(accepted_tokens / draft_calls, 4) if draft_calls else 0.0,
+            "model_forward_passes": model_calls,
+            "estimated_speedup": round(num_new_tokens / model_calls, 4) if model_calls else 0.0,
+            "tokens_per_second": round(num_new_tokens / generation_time, 2) if generation_time else 0.0
+        }
+
+
+def _strip_padding(output_ids: List[int], pad_token_id: int) -> List[int]:
+    """ Remove the trailing padding of a sequence, but keep one pad token, as it is the EOS token as well by default """
+    end = len(output_ids)
+    while end > 1 and output_ids[end - 1] == pad_token_id and output_ids[end - 2] == pad_token_id:
+        end -= 1
+    return output_ids[:end]
 
 
 def _check_context_limit(context_size, prompt_tokens, max_new_tokens: int = 100) -> Tuple[bool, int, int, int]:
@@ -2,10 +2,16 @@
     Backend using llama.cpp for GGUF/GGML models.
 """
 
+import gc
+import os
+import time
 from typing import List, Dict, Tuple, Any
 
 import backends
-from backends.utils import check_context_limit_generic
+from backends.utils import check_context_limit_generic, trimmed_response, optional_gen_args, log_load_time
+from backends.context_management import ContextWindow, strategy_from_spec, context_size_from_spec
+from backends import token_counting, residency
+from backends.replicas import ReplicatedModel
 
 import llama_cpp
 from llama_cpp import Llama
@@ -38,15 +44,30 @@ def load_model(model_spec: backends.ModelSpec) -> Any:
     elif hasattr(model_spec, 'gpu_layers_offloaded'):
         gpu_layers_offloaded = model_spec.gpu_layers_offloaded
 
+    # the registry entry can set the context size, otherwise it is read from the model file (n_ctx=0):
+    context_size = context_size_from_spec(model_spec, default=0)
+
+    # the registry entry can set the CPU threads and the memory mapping, otherwise llama.cpp uses its defaults:
+    load_args = dict()
+    if 'intra_op_threads' in model_spec:
+        load_args['n_threads'] = model_spec['intra_op_threads']
+    if 'batch_threads' in model_spec:  # llama.cpp processes the prompt (in batches) with its own threads
+        load_args['n_threads_batch'] = model_spec['batch_threads']
+    # the model file is memory-mapped by default (use_mmap), so that a reload reads it from the OS page cache;
+    # use_mlock keeps it in RAM:
+    for mmap_option in ['use_mmap', 'use_mlock']:
+        if mmap_option in model_spec:
+            load_args[mmap_option] = model_spec[mmap_option]
+
     if 'requires_api_key' in model_spec and model_spec['requires_api_key']:
         # load HF API key:
         creds = backends.load_credentials("huggingface")
         api_key = creds["huggingface"]["api_key"]
         model = Llama.from_pretrained(hf_repo_id, hf_model_file, token=api_key, verbose=False,
-                                      n_gpu_layers=gpu_layers_offloaded, n_ctx=0)
+                                      n_gpu_layers=gpu_layers_offloaded, n_ctx=context_size, **load_args)
     else:
         model = Llama.from_pretrained(hf_repo_id, hf_model_file, verbose=False, n_gpu_layers=gpu_layers_offloaded,
-                                      n_ctx=0)
+                                      n_ctx=context_size, **load_args)
 
     logger.info(f"Finished loading llama.cpp model: {model_spec.model_name}")
 
@@ -112,20 +133,28 @@ class LlamaCPPLocal(backends.Backend):
     def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
         """
         Get a LlamaCPPLocalModel instance with the passed model and settings. Will load all required data for using
-        the model upon initialization.
+        the model upon initialization. When the model spec configures 'replicas', the model is loaded in pinned worker
+        processes instead.
         :param model_spec: The ModelSpec for the model.
         :return: The Model class instance of the model.
         """
+        if 'replicas' in model_spec:
+            return ReplicatedModel(model_spec)
         return LlamaCPPLocalModel(model_spec)
 
 
-class LlamaCPPLocalModel(backends.Model):
+class LlamaCPPLocalModel(backends.Model, residency.ResidentModel):
     """
     Class for loaded llama.cpp models ready for generation.
     """
     def __init__(self, model_spec: backends.ModelSpec):
         super().__init__(model_spec)
-        self.model = load_model(model_spec)
+        self.model = None
+        self.load_report = None  # the load duration, the size and the throughput of the last load of the weights
+        residency.prepare_load(self.get_name(), lambda: residency.weight_files_bytes(model_spec['huggingface_id'],
+                                                                                    [model_spec['filename']]))
+        self._load_weights()
+        self._memory_footprint = self.load_report["weights_bytes"]  # the weights are loaded from the file
 
         self.chat_formatter = get_chat_formatter(self.model, model_spec)
 
@@ -141,6 +170,53 @@ class LlamaCPPLocalModel(backends.Model):
         # get context size from model instance:
         self.context_size = self.model._n_ctx
 
+        # count tokens incrementally per message; the chat template overhead is calibrated with exact counts
+        self.token_counter = token_counting.for_encoder(
+            lambda text: self.model.tokenize(text.encode(), add_bos=False, special=False))
+        self.token_counter.calibrate_chat_template(self.count_prompt_tokens_exact)
+        self.context_window = ContextWindow(model_spec.model_name, self.context_size,
+                                            self.token_counter.count_messages,
+                                            strategy=strategy_from_spec(model_spec))
+        residency.register(self)
+
+    def _load_weights(self):
+        load_start = time.perf_counter()
+        self.model = load_model(self.model_spec)
+        self.load_report = log_load_time(self.get_name(), time.perf_counter() - load_start,
+                                         os.path.getsize(self.model.model_path))
+
+    def memory_footprint(self) -> int:
+        return self._memory_footprint
+
+    def is_resident(self) -> bool:
+        return self.model is not None
+
+    def evict(self, offload: str):
+        """
+        Unload the weights completely (llama.cpp cannot move loaded weights between devices).
+        """
+        if hasattr(self.model, "close"):
+            self.model.close()
+        self.model = None
+        gc.collect()
+
+    def reload(self):
+        self._load_weights()
+
+    def count_prompt_tokens_exact(self, messages: List[Dict]) -> int:
+        """
+        :return: the number of prompt tokens after applying the chat template to all messages
+        """
+        prompt_text = self.chat_formatter(messages=messages).prompt
+        return len(self.model.tokenize(prompt_text.encode(), add_bos=False))
+
+    def count_prompt_tokens(self, messages: List[Dict]) -> int:
+        """
+        :return: the estimated number of prompt tokens (only new messages are tokenized)
+        """
+        return self.token_counter.count_messages(messages)
+
+    @residency.keep_resident
     def generate_response(self, messages: List[Dict], return_full_text: bool = False) -> Tuple[Any, Any, str]:
         """
         :param messages: for example
@@ -153,13 +229,18 @@ class LlamaCPPLocalModel(backends.Model):
         :param return_full_text: If True, whole input context is returned.
         :return: the continuation
         """
+        # shorten the messages with the configured strategy, if they would exceed the context limit:
+        messages = self.context_window.fit(messages, max_new_tokens=self.get_max_tokens())
+
         # use llama.cpp jinja to apply chat template for prompt:
         prompt_text = self.chat_formatter(messages=messages).prompt
 
         prompt = {"inputs": prompt_text, "max_new_tokens": self.get_max_tokens(),
-                  "temperature": self.get_temperature(), "return_full_text": return_full_text}
+                  "temperature": self.get_temperature(), "return_full_text": return_full_text,
+                  **optional_gen_args(self)}
 
         prompt_tokens = self.model.tokenize(prompt_text.encode(), add_bos=False)  # BOS expected in template
+        self.token_counter.calibrate(messages, len(prompt_tokens))
 
         # check context limit:
         check_context_limit_generic(self.context_size, prompt_tokens, self.model_spec.model_name,
@@ -175,10 +256,17 @@ class LlamaCPPLocalModel(backends.Model):
         model_output = self.model(
             prompt_text,
             temperature=self.get_temperature(),
-            max_tokens=self.get_max_tokens()
+            max_tokens=self.get_max_tokens(),
+            **optional_gen_args(self)
         )
 
-        response = {'response': model_output}
+        # the raw response only contains the continuation, unless the full output is kept for debugging:
+        response = trimmed_response(model_output['choices'][0]['text'], prompt_text,
+                                    prompt_tokens=model_output['usage']['prompt_tokens'],
+                                    completion_tokens=model_output['usage']['completion_tokens'],
+                                    finish_reason=model_output['choices'][0]['finish_reason'])
+        if 'full_raw_response' in self.model_spec and self.model_spec['full_raw_response']:
+            response['response'] = model_output
 
         # cull input context:
         if not return_full_text:
@@ -1,10 +1,11 @@
 from mistralai.client import MistralClient
 from mistralai.models.chat_completion import ChatMessage
 from typing import List, Dict, Tuple, Any
-from retry import retry
 import json
 import backends
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, optional_gen_args, openai_usage, USAGE_KEY, retry, \
+    truncate_at_stop
+from backends.context_management import api_context_window, ensure_context_limit
 
 logger = backends.get_logger(__name__)
 
@@ -32,7 +33,9 @@ class MistralModel(backends.Model):
     def __init__(self, client: MistralClient, model_spec: backends.ModelSpec):
         super().__init__(model_spec)
         self.client = client
+        self.context_window = api_context_window(model_spec)
 
+    @ensure_context_limit
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
@@ -53,11 +56,13 @@ class MistralModel(backends.Model):
         api_response = self.client.chat(model=self.model_spec.model_id,
                                         messages=prompt,
                                         temperature=self.get_temperature(),
-                                        max_tokens=self.get_max_tokens())
+                                        max_tokens=self.get_max_tokens(),
+                                        **optional_gen_args(self, stop=None))  # the client has no stop sequences
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
-        response_text = message.content.strip()
+        response_text = truncate_at_stop(message.content, self.get_stop()).strip()
         response = json.loads(api_response.model_dump_json())
+        response[USAGE_KEY] = openai_usage(response.get("usage"))
 
         return messages, response, response_text
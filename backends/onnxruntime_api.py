@@ -0,0 +1,122 @@
+"""
+    Backend using ONNX Runtime for HuggingFace decoder models exported to ONNX (CPU-optimized inference).
+    Uses HF tokenizers instruct/chat templates for proper input format per model, like the huggingface_local backend.
+"""
+import glob
+import os
+from typing import Any
+
+import onnxruntime
+from optimum.onnxruntime import ORTModelForCausalLM
+
+import backends
+from backends.huggingface_local_api import HuggingfaceLocalModel
+from backends.replicas import ReplicatedModel
+
+logger = backends.get_logger(__name__)
+
+DEFAULT_EXECUTION_PROVIDER = "CPUExecutionProvider"
+
+
+def get_session_options(model_spec: backends.ModelSpec) -> onnxruntime.SessionOptions:
+    """
+    Create the ONNX Runtime session options with all graph optimizations and the optional 'intra_op_threads' and
+    'inter_op_threads' of the model spec.
+    :param model_spec: The ModelSpec for the model.
+    :return: The session options for the inference session of the model.
+    """
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if 'intra_op_threads' in model_spec:
+        session_options.intra_op_num_threads = model_spec['intra_op_threads']
+    if 'inter_op_threads' in model_spec:
+        session_options.inter_op_num_threads = model_spec['inter_op_threads']
+        session_options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+    return session_options
+
+
+def load_model(model_spec: backends.ModelSpec) -> Any:
+    """
+    Load an ONNX decoder model from HuggingFace with KV cache (and IO binding on GPUs). The model repository must
+    contain an ONNX export, unless the registry entry sets 'export' to true; then the model is exported to ONNX on
+    loading. The optional 'onnx_file_name' selects one of several ONNX files (e.g. a quantized export) of the
+    repository and the optional 'onnx_subfolder' the folder of the repository that contains the ONNX files.
+    :param model_spec: The ModelSpec for the model.
+    :return: The optimum ORTModelForCausalLM instance of the loaded model.
+    """
+    logger.info(f'Start loading onnxruntime model: {model_spec.model_name}')
+
+    provider = model_spec['execution_provider'] if 'execution_provider' in model_spec else DEFAULT_EXECUTION_PROVIDER
+    load_args = dict(
+        export=model_spec['export'] if 'export' in model_spec else False,
+        provider=provider,
+        session_options=get_session_options(model_spec),
+        use_cache=True,  # reuse the keys and values of previous tokens (KV cache) during generation
+        # bind the inputs and outputs (including the KV cache) to device buffers to avoid copies between the decoding
+        # steps; this only pays off on GPUs, on the CPU there are no copies to avoid:
+        use_io_binding=model_spec['use_io_binding'] if 'use_io_binding' in model_spec
+        else provider != DEFAULT_EXECUTION_PROVIDER
+    )
+    if 'onnx_file_name' in model_spec:
+        load_args['file_name'] = model_spec['onnx_file_name']
+    if 'onnx_subfolder' in model_spec:
+        load_args['subfolder'] = model_spec['onnx_subfolder']
+    if 'requires_api_key' in model_spec and model_spec['requires_api_key']:
+        # load HF API key:
+        creds = backends.load_credentials("huggingface")
+        load_args['token'] = creds["huggingface"]["api_key"]
+
+    model = ORTModelForCausalLM.from_pretrained(model_spec['huggingface_id'], **load_args)
+
+    logger.info(f"Finished loading onnxruntime model: {model_spec.model_name} ({load_args['provider']})")
+
+    return model
+
+
+class OnnxRuntime(backends.Backend):
+    """
+    Model/backend handler class for ONNX models run with ONNX Runtime.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+    def get_model_for(self, model_spec: backends.ModelSpec) -> backends.Model:
+        """
+        Get an OnnxRuntimeModel instance with the passed model and settings. Will load all required data for using
+        the model upon initialization. When the model spec configures 'replicas', the model is loaded in pinned worker
+        processes instead.
+        :param model_spec: The ModelSpec for the model.
+        :return: The Model class instance of the model.
+        """
+        if 'replicas' in model_spec:
+            return ReplicatedModel(model_spec)
+        return OnnxRuntimeModel(model_spec)
+
+
+class OnnxRuntimeModel(HuggingfaceLocalModel):
+    """
+    Class for loaded ONNX models ready for generation. Shares the chat template application, context limit handling
+    and generation with HuggingfaceLocalModel; only the model weights are run with ONNX Runtime.
+    """
+
+    def _select_device(self) -> str:
+        if 'execution_provider' in self.model_spec and self.model_spec['execution_provider'] == "CUDAExecutionProvider":
+            return "cuda"
+        return "cpu"
+
+    def _load_weights(self):
+        if 'draft_model' in self.model_spec:
+            raise ValueError(f"The onnxruntime backend does not support the draft_model of {self.get_name()}.")
+        self.model = load_model(self.model_spec)
+
+        # check if model's generation_config has pad_token_id set:
+        if not self.model.generation_config.pad_token_id:
+            # set pad_token_id to tokenizer's eos_token_id to prevent excessive warnings:
+            self.model.generation_config.pad_token_id = self.tokenizer.eos_token_id
+        self.weights_location = self.device
+
+    def _weights_memory_footprint(self) -> int:
+        """ The weights are loaded from the ONNX file and its external data files """
+        model_dir = os.path.dirname(str(self.model.model_path))
+        return sum(os.path.getsize(model_file) for model_file in glob.glob(os.path.join(model_dir, "*.onnx*")))
@@ -1,10 +1,10 @@
 from typing import List, Dict, Tuple, Any
-from retry import retry
 
 import json
 import openai
 import backends
-from backends.utils import ensure_messages_format
+from backends.utils import ensure_messages_format, optional_gen_args, openai_usage, with_choice_usage, USAGE_KEY, retry
+from backends.context_management import api_context_window, ensure_context_limit
 
 logger = backends.get_logger(__name__)
 
@@ -35,7 +35,9 @@ class OpenAIModel(backends.Model):
     def __init__(self, client: openai.OpenAI, model_spec: backends.ModelSpec):
         super().__init__(model_spec)
         self.client = client
+        self.context_window = api_context_window(model_spec, exact=True)  # tiktoken is the tokenizer of the model
 
+    @ensure_context_limit
     @retry(tries=3, delay=0, logger=logger)
     @ensure_messages_format
     def generate_response(self, messages: List[Dict]) -> Tuple[str, Any, str]:
@@ -53,11 +55,36 @@ class OpenAIModel(backends.Model):
         api_response = self.client.chat.completions.create(model=self.model_spec.model_id,
                                                            messages=prompt,
                                                            temperature=self.get_temperature(),
-                                                           max_tokens=self.get_max_tokens())
+                                                           max_tokens=self.get_max_tokens(),
+                                                           **optional_gen_args(self))
         message = api_response.choices[0].message
         if message.role != "assistant":  # safety check
             raise AttributeError("Response message role is " + message.role + " but should be 'assistant'")
         response_text = message.content.strip()
         response = json.loads(api_response.json())
+        response[USAGE_KEY] = openai_usage(response.get("usage"))
 
         return prompt, response, response_text
+
+    @ensure_context_limit
+    @retry(tries=3, delay=0, logger=logger)
+    @ensure_messages_format
+    def generate_responses(self, messages: List[Dict], n: int) -> List[Tuple[str, Any, str]]:
+        """
+        Sample n completions in a single request (the prompt is processed once).
+        :return: for each completion the prompt, the raw response with only this choice and the continuation
+        """
+        prompt = messages
+        api_response = self.client.chat.completions.create(model=self.model_spec.model_id, messages=prompt,
+                                                           temperature=self.get_temperature(),
+                                                           max_tokens=self.get_max_tokens(), n=n,
+                                                           **optional_gen_args(self))
+        response = json.loads(api_response.json())
+        response[USAGE_KEY] = openai_usage(response.get("usage"))
+        completions = []
+        for choice_idx, choice in enumerate(api_response.choices):
+            if choice.message.role != "assistant":  # safety check
+                raise AttributeError("Response message role is " + choice.message.role + " but should be 'assistant'")
+            choice_response = with_choice_usage(dict(response, choices=[response["choices"][choice_idx]]), choice_idx)
+            completions.append((prompt, choice_response, choice.message.content.strip()))
+        return completions
@@ -0,0 +1,193 @@
+"""
+    Replica workers: Run one replica of a local model per NUMA node or core group in a worker process.
+
+    The replicas are configured per model in the model registry, for example:
+        "replicas": "numa"                  one replica per NUMA node (using the cores available to this process)
+        "replicas": 4                       four replicas on equally sized groups of the available cores
+        "replicas": [[0, 1, 2, 3], [4, 5]]  one replica per given core group
+    Each worker process is pinned to its cores and uses as many intra-op threads as it has cores (unless the model
+    spec sets 'intra_op_threads'). Calls are dispatched to the replica with the fewest pending calls.
+"""
+import glob
+import multiprocessing
+import os
+import threading
+from typing import List, Dict, Tuple, Any
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """
+    :param cpu_list: in the format of the Linux sysfs, e.g. '0-3,8-11'
+    :return: the cpu ids
+    """
+    cpus = []
+    for cpu_range in cpu_list.strip().split(","):
+        if not cpu_range:
+            continue
+        if "-" in cpu_range:
+            first, last = cpu_range.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(cpu_range))
+    return cpus
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def numa_core_groups() -> List[List[int]]:
+    """
+    :return: the available cores per NUMA node; all available cores as a single group, if the nodes are unknown
+    """
+    cores = set(available_cores())
+    core_groups = []
+    for node_cpu_list in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        with open(node_cpu_list) as f:
+            node_cores = [core for core in parse_cpu_list(f.read()) if core in cores]
+        if node_cores:
+            core_groups.append(node_cores)
+    return core_groups if core_groups else [sorted(cores)]
+
+
+def split_cores(cores: List[int], num_groups: int) -> List[List[int]]:
+    """
+    :return: the cores split into num_groups consecutive groups of (almost) equal size
+    """
+    if not 0 < num_groups <= len(cores):
+        raise ValueError(f"Cannot split {len(cores)} cores into {num_groups} groups")
+    group_size, remainder = divmod(len(cores), num_groups)
+    core_groups, start = [], 0
+    for group_idx in range(num_groups):
+        end = start + group_size + (1 if group_idx < remainder else 0)
+        core_groups.append(cores[start:end])
+        start = end
+    return core_groups
+
+
+def core_groups_from_spec(model_spec: backends.ModelSpec) -> List[List[int]]:
+    """
+    :param model_spec: with 'replicas' given as 'numa', the number of replicas or a list of core groups
+    :return: the core groups to pin the replicas to
+    """
+    replicas = model_spec["replicas"]
+    if replicas == "numa":
+        return numa_core_groups()
+    if isinstance(replicas, int):
+        return split_cores(available_cores(), replicas)
+    if isinstance(replicas, list) and all(isinstance(core_group, list) and core_group for core_group in replicas):
+        return replicas
+    raise ValueError(f"Unknown replicas '{replicas}' for {model_spec.model_name}. "
+                     f"Use 'numa', the number of replicas or a list of core groups.")
+
+
+def _replica_worker(model_spec_dict: Dict, cores: List[int], connection):
+    """
+    Runs in the worker process: Loads the model pinned to the cores and answers calls until None is received.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    model_spec_dict = {key: value for key, value in model_spec_dict.items() if key != "replicas"}
+    model_spec_dict.setdefault("intra_op_threads", len(cores))
+    try:
+        model = backends._load_model_for(backends.ModelSpec.from_dict(model_spec_dict))  # spec is already unified
+    except Exception as e:
+        connection.send(e)
+        return
+    connection.send("ready")
+    while True:
+        call = connection.recv()
+        if call is None:
+            break
+        messages, gen_args = call
+        model.set_gen_args(**gen_args)
+        try:
+            connection.send(model.generate_response(messages))
+        except Exception as e:  # e.g. ContextExceededError; re-raised by the ReplicatedModel
+            connection.send(e)
+
+
+class Replica:
+    """ The handle of a worker process holding one model replica """
+
+    def __init__(self, model_spec: backends.ModelSpec, cores: List[int]):
+        self.cores = cores
+        self.pending_calls = 0
+        self.lock = threading.Lock()  # one call at a time per worker
+        context = multiprocessing.get_context("spawn")  # do not fork the (possibly loaded) parent process
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(target=_replica_worker, args=(dict(model_spec.__dict__), cores,
+                                                                     worker_connection), daemon=True)
+        self.process.start()
+
+    def wait_until_ready(self):
+        status = self.connection.recv()
+        if isinstance(status, Exception):
+            raise status
+
+    def call(self, messages: List[Dict], gen_args: Dict) -> Tuple[Any, Any, str]:
+        with self.lock:
+            self.connection.send((messages, gen_args))
+            result = self.connection.recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        with self.lock:
+            try:
+                self.connection.send(None)
+            except (BrokenPipeError, OSError):  # the worker has already stopped, e.g. after a loading error
+                pass
+        self.process.join()
+
+
+class ReplicatedModel(backends.Model):
+    """
+    A local model with one replica per core group in pinned worker processes. Calls are dispatched to the replica
+    with the fewest pending calls, so that concurrent callers (e.g. episodes run in parallel) are load-balanced.
+    """
+
+    def __init__(self, model_spec: backends.ModelSpec):
+        super().__init__(model_spec)
+        core_groups = core_groups_from_spec(model_spec)
+        logger.info("Starting %d replicas of %s on the core groups %s", len(core_groups), model_spec.model_name,
+                    core_groups)
+        self.replicas = [Replica(model_spec, cores) for cores in core_groups]
+        self._dispatch_lock = threading.Lock()
+        try:
+            for replica in self.replicas:
+                replica.wait_until_ready()
+        except Exception:
+            self.close()
+            raise
+
+    def _acquire_replica(self) -> Replica:
+        with self._dispatch_lock:
+            replica = min(self.replicas, key=lambda _replica: _replica.pending_calls)
+            replica.pending_calls += 1
+        return replica
+
+    def _release_replica(self, replica: Replica):
+        with self._dispatch_lock:
+            replica.pending_calls -= 1
+
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        replica = self._acquire_replica()
+        try:
+            # send a plain list, since the messages might be a view on the history (e.g. AlternatingMessages):
+            return replica.call(list(messages), self.get_gen_args())
+        finally:
+            self._release_replica(replica)
+
+    def close(self):
+        for replica in self.replicas:
+            if replica.process.is_alive():
+                replica.close()
+
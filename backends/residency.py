@@ -0,0 +1,267 @@
+"""
+    Residency management: Keep the weights of local models within a memory budget.
+
+    Local models (huggingface_local, llama.cpp) make room for their weights before they are loaded (estimated by the
+    size of their weight files), register themselves when they are loaded and acquire their weights before each
+    generation. When the weights of the registered models would exceed the budget, then the least recently used models
+    are evicted: their weights are either offloaded to the CPU (only for models on the GPU) or unloaded completely, to
+    be reloaded from disk on demand. Models are never evicted while they generate. Without a configured
+    budget, models are never evicted.
+
+    The budget only applies to the device used for generation: the weights offloaded to the CPU are not counted (they
+    take up RAM until the model is used again or garbage collected).
+"""
+import fnmatch
+import functools
+import os
+import re
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Union, Dict, List, Callable
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+OFFLOAD_MODES = ["cpu", "disk"]
+
+_MEMORY_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+
+def parse_memory_size(memory_size: Union[str, int]) -> int:
+    """
+    :param memory_size: number of bytes or a string like '512MB' or '24GB'
+    :return: the number of bytes
+    """
+    if isinstance(memory_size, int):
+        return memory_size
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?B?)\s*", memory_size.upper())
+    if not match:
+        raise ValueError(f"Cannot parse memory size '{memory_size}'. Use for example '512MB' or '24GB'.")
+    return int(float(match.group(1)) * _MEMORY_UNITS[match.group(2)])
+
+
+def _to_mb(num_bytes: int) -> str:
+    return f"{num_bytes / 1024 ** 2:.0f}MB"
+
+
+def weight_files_bytes(repo_id: str, file_patterns: List[str], token: str = None) -> int:
+    """
+    Estimate the footprint of model weights before loading them by the size of their files.
+    :param repo_id: the Huggingface hub repository or a local directory of the weight files
+    :param file_patterns: glob patterns of the weight files; only the files of the first matching pattern are counted,
+                          e.g. ['*.safetensors', '*.bin'] to ignore the PyTorch weights next to the safetensors weights
+    :param token: for gated repositories
+    :return: the number of bytes of the matching files or 0, if the file sizes are not available (e.g. offline)
+    """
+    if os.path.isdir(repo_id):
+        file_sizes = {file_name: os.path.getsize(os.path.join(repo_id, file_name)) for file_name in os.listdir(repo_id)}
+    else:
+        from huggingface_hub import HfApi  # installed with the local backends
+        try:
+            repo_files = HfApi().model_info(repo_id, files_metadata=True, token=token).siblings or []
+        except Exception as e:  # e.g. offline; then room is only made once the weights are loaded
+            logger.info("Cannot get the size of the weight files of %s: %s", repo_id, e)
+            return 0
+        file_sizes = {repo_file.rfilename: repo_file.size or 0 for repo_file in repo_files}
+    for file_pattern in file_patterns:
+        matching_sizes = [size for file_name, size in file_sizes.items() if fnmatch.fnmatch(file_name, file_pattern)]
+        if matching_sizes:
+            return sum(matching_sizes)
+    return 0
+
+
+class ResidentModel:
+    """
+    Interface for models whose weights can be evicted and reloaded by the ResidencyManager.
+    """
+
+    def memory_footprint(self) -> int:
+        """
+        :return: the number of bytes of the (resident) model weights
+        """
+        raise NotImplementedError()
+
+    def is_resident(self) -> bool:
+        """
+        :return: True, if the weights are loaded onto the device used for generation
+        """
+        raise NotImplementedError()
+
+    def evict(self, offload: str):
+        """
+        :param offload: 'cpu' to move the weights to the CPU (if on a GPU) or 'disk' to unload the weights completely
+        """
+        raise NotImplementedError()
+
+    def reload(self):
+        """
+        Bring the weights back onto the device used for generation.
+        """
+        raise NotImplementedError()
+
+
+class ResidencyManager:
+    """
+    Tracks the registered models in least recently used order and evicts them when the budget is exceeded.
+    The models are only weakly referenced, so that the manager does not keep unused models alive.
+    """
+
+    def __init__(self, budget: int, offload: str = "disk"):
+        """
+        :param budget: the number of bytes that the resident model weights may take up
+        :param offload: how to evict models: 'cpu' or 'disk'
+        """
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown offload mode '{offload}'. Choose one of {OFFLOAD_MODES}.")
+        self.budget = budget
+        self.offload = offload
+        self._models: OrderedDict = OrderedDict()  # id -> weakref to model; least recently used first
+        self._in_use: Dict[int, int] = defaultdict(int)  # id -> the number of generations in progress
+        self._lock = threading.RLock()
+
+    def _resident_models(self):
+        for model_ref in list(self._models.values()):
+            model = model_ref()
+            if model is not None and model.is_resident():
+                yield model
+
+    def resident_bytes(self) -> int:
+        return sum(model.memory_footprint() for model in self._resident_models())
+
+    def prepare_load(self, model_name: str, footprint: int):
+        """
+        Evict models before a model is loaded, so that the budget is not exceeded while its weights are loaded.
+        :param footprint: the (estimated) number of bytes of the weights to be loaded
+        """
+        with self._lock:
+            logger.info("Loading %s (%s); resident models take up %s of %s", model_name, _to_mb(footprint),
+                        _to_mb(self.resident_bytes()), _to_mb(self.budget))
+            self._make_room(model_name, needed=footprint)
+
+    def register(self, model: ResidentModel):
+        """
+        Track a newly loaded model and evict other models, if the budget is exceeded now (e.g. when the footprint of the
+        model was underestimated before loading it).
+        """
+        with self._lock:
+            model_id = id(model)
+            self._models[model_id] = weakref.ref(model, lambda _: self._models.pop(model_id, None))
+            logger.info("Loaded %s (%s); resident models take up %s of %s",
+                        model.get_name(), _to_mb(model.memory_footprint()),
+                        _to_mb(self.resident_bytes()), _to_mb(self.budget))
+            self._make_room(model.get_name(), needed=0, keep=model)
+
+    def acquire(self, model: ResidentModel):
+        """
+        Mark the model as most recently used and in use, and make sure that its weights are resident; evicts other
+        models, if necessary. Models in use are not evicted until they are released. Models that have not been
+        registered before are registered.
+        """
+        with self._lock:
+            self._in_use[id(model)] += 1
+            if id(model) not in self._models:
+                self.register(model)
+                return
+            self._models.move_to_end(id(model))
+            if model.is_resident():  # the budget might have been exceeded while other models were in use
+                self._make_room(model.get_name(), needed=0, keep=model)
+                return
+            self._make_room(model.get_name(), needed=model.memory_footprint(), keep=model)
+            model.reload()
+            logger.info("Reloaded %s (%s)", model.get_name(), _to_mb(model.memory_footprint()))
+
+    def release(self, model: ResidentModel):
+        """
+        Mark the end of a generation that acquired the model, so that the model may be evicted again.
+        """
+        with self._lock:
+            self._in_use[id(model)] -= 1
+            if self._in_use[id(model)] <= 0:
+                del self._in_use[id(model)]
+
+    def is_in_use(self, model: ResidentModel) -> bool:
+        with self._lock:
+            return id(model) in self._in_use
+
+    def _make_room(self, model_name: str, needed: int, keep: ResidentModel = None):
+        """ Evict the least recently used models not in use (except keep) until the needed bytes fit into the budget """
+        for other in self._resident_models():
+            if self.resident_bytes() + needed <= self.budget:
+                return
+            if other is keep or id(other) in self._in_use:
+                continue
+            other.evict(self.offload)
+            logger.info("Evicted %s (%s) to %s", other.get_name(), _to_mb(other.memory_footprint()), self.offload)
+        if self.resident_bytes() + needed > self.budget:
+            logger.warning("Memory budget of %s exceeded by %s and the models in use", _to_mb(self.budget),
+                           model_name)
+
+
+_residency_manager: Union[ResidencyManager, None] = None
+
+
+def configure(budget: Union[str, int, None], offload: str = "disk"):
+    """
+    Set the memory budget for the weights of local models. Models loaded afterwards are tracked.
+    :param budget: number of bytes or a string like '24GB'; None disables the residency management
+    :param offload: how to evict models: 'cpu' (only for models on the GPU) or 'disk'
+    """
+    global _residency_manager
+    if budget is None:
+        _residency_manager = None
+        return
+    _residency_manager = ResidencyManager(parse_memory_size(budget), offload)
+    logger.info("Memory budget for local models: %s (offload to %s)", _to_mb(_residency_manager.budget), offload)
+
+
+def get_residency_manager() -> Union[ResidencyManager, None]:
+    return _residency_manager
+
+
+def prepare_load(model_name: str, estimate_footprint: Callable[[], int]):
+    """
+    Evict models before loading a model, if a memory budget is configured.
+    :param estimate_footprint: returns the estimated number of bytes of the weights (only called with a budget)
+    """
+    if _residency_manager is not None:
+        _residency_manager.prepare_load(model_name, estimate_footprint())
+
+
+def register(model: ResidentModel):
+    """ Track the loaded model, if a memory budget is configured """
+    if _residency_manager is not None:
+        _residency_manager.register(model)
+
+
+def acquire(model: ResidentModel):
+    """ Make sure that the model weights are resident before generation, if a memory budget is configured """
+    if _residency_manager is not None:
+        _residency_manager.acquire(model)
+
+
+def release(model: ResidentModel):
+    """ Allow the eviction of the model again after generation, if a memory budget is configured """
+    if _residency_manager is not None:
+        _residency_manager.release(model)
+
+
+def keep_resident(generate):
+    """
+    Decorator for the generation methods of resident models: the weights are acquired before the generation and cannot
+    be evicted (e.g. by the generation of another model in a concurrent thread) until the generation has returned.
+    """
+
+    @functools.wraps(generate)
+    def wrapper(model: ResidentModel, *args, **kwargs):
+        manager = _residency_manager  # the same manager has to release the model, even if it is configured anew
+        if manager is None:
+            return generate(model, *args, **kwargs)
+        manager.acquire(model)
+        try:
+            return generate(model, *args, **kwargs)
+        finally:
+            manager.release(model)
+
+    return wrapper
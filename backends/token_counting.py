@@ -0,0 +1,144 @@
+"""
+    Token accounting: Count the tokens of messages incrementally.
+
+    The token count of each message is cached by its contents, so that only new messages are tokenized, when the
+    (growing) history of a player is counted before each call. The encoders are cached per model.
+"""
+import json
+import math
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Callable
+
+import backends
+
+logger = backends.get_logger(__name__)
+
+MAX_CACHED_MESSAGES = 100_000
+
+
+class TokenCounter:
+    """
+    Counts the tokens of messages with a per-message cache. The count of messages is the sum of the cached message
+    counts plus an overhead per message and per prompt (e.g. for the special tokens of a chat template). For models
+    where this overhead is not known, the counts are estimates that can be calibrated with exact counts.
+    """
+
+    def __init__(self, count_message_tokens: Callable[[Dict], int], per_message_overhead: int = 0,
+                 per_prompt_overhead: int = 0, max_cached_messages: int = MAX_CACHED_MESSAGES):
+        """
+        :param count_message_tokens: tokenizes the contents of a single message and returns the number of tokens
+        :param per_message_overhead: number of tokens added to each message (e.g. role markers)
+        :param per_prompt_overhead: number of tokens added once per prompt (e.g. the generation prompt)
+        :param max_cached_messages: the least recently used message counts are removed beyond this number
+        """
+        self.count_message_tokens = count_message_tokens
+        self.per_message_overhead = per_message_overhead
+        self.per_prompt_overhead = per_prompt_overhead
+        self.max_cached_messages = max_cached_messages
+        self._message_tokens: OrderedDict = OrderedDict()  # message contents -> token count
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def count_message(self, message: Dict) -> int:
+        """
+        :return: the number of tokens of the message contents (without any overhead)
+        """
+        message_key = _cache_key(message)
+        if message_key in self._message_tokens:
+            self.cache_hits += 1
+            self._message_tokens.move_to_end(message_key)
+            return self._message_tokens[message_key]
+        self.cache_misses += 1
+        num_tokens = self.count_message_tokens(message)
+        self._message_tokens[message_key] = num_tokens
+        if len(self._message_tokens) > self.max_cached_messages:
+            self._message_tokens.popitem(last=False)
+        return num_tokens
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        """
+        :return: the number of prompt tokens for the messages (exact, if the overheads are known; otherwise estimated)
+        """
+        num_tokens = sum(self.count_message(message) for message in messages)
+        return num_tokens + len(messages) * self.per_message_overhead + self.per_prompt_overhead
+
+    def calibrate(self, messages: List[Dict], exact_num_tokens: int):
+        """
+        Adjust the per message overhead, so that the estimate is not lower than the exact count for these messages.
+        :param messages: that have been tokenized by the model
+        :param exact_num_tokens: the number of prompt tokens as tokenized by the model
+        """
+        if not messages:
+            return
+        content_tokens = sum(self.count_message(message) for message in messages)
+        overhead = math.ceil((exact_num_tokens - content_tokens - self.per_prompt_overhead) / len(messages))
+        self.per_message_overhead = max(self.per_message_overhead, overhead)
+
+    def calibrate_chat_template(self, count_exact: Callable[[List[Dict]], int]):
+        """
+        Determine the per message and per prompt overheads of a chat template from two sample conversations.
+        :param count_exact: returns the number of prompt tokens for messages after applying the chat template
+        """
+        one_turn = [{"role": "user", "content": "Hello"}]
+        two_turns = one_turn + [{"role": "assistant", "content": "Hello"}, {"role": "user", "content": "Hello"}]
+        try:
+            one_turn_overhead = count_exact(one_turn) - self.count_message(one_turn[0])
+            two_turns_overhead = count_exact(two_turns) - sum(self.count_message(message) for message in two_turns)
+        except Exception as e:  # e.g. the template does not accept these messages; then rely on calibrate()
+            logger.info("Cannot calibrate the chat template overhead: %s", e)
+            return
+        self.per_message_overhead = max(0, math.ceil((two_turns_overhead - one_turn_overhead) / 2))
+        self.per_prompt_overhead = max(0, one_turn_overhead - self.per_message_overhead)
+
+
+def _cache_key(message: Dict):
+    """
+    :return: a hashable key for the message contents; messages with unhashable values (e.g. a list of images) are
+             serialized to JSON with sorted keys
+    """
+    try:
+        message_key = tuple(message.items())
+        hash(message_key)
+        return message_key
+    except TypeError:
+        return json.dumps(message, sort_keys=True, default=str)
+
+
+def for_encoder(encode: Callable[[str], List]) -> TokenCounter:
+    """
+    :param encode: the tokenizer function of a model, e.g. tokenizer.encode without special tokens
+    :return: a TokenCounter that counts the tokens of the message contents (the overheads need calibration)
+    """
+    return TokenCounter(lambda message: len(encode(message["content"])))
+
+
+@lru_cache(maxsize=None)
+def tiktoken_encoding(model_name: str):
+    """
+    :return: the tiktoken encoding for the model; falls back to cl100k_base for unknown models
+    """
+    import tiktoken  # optional dependency only needed for OpenAI models
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=None)
+def tiktoken_counter(model_name: str) -> TokenCounter:
+    """
+    :return: a TokenCounter for OpenAI chat models, counting the tokens as described in the OpenAI cookbook
+    """
+
+    def count_message_tokens(message: Dict) -> int:
+        encoding = tiktoken_encoding(model_name)  # loaded on the first count (cached)
+        num_tokens = 0
+        for key, value in message.items():
+            num_tokens += len(encoding.encode(value))
+            if key == "name":  # if there's a name, the role is omitted
+                num_tokens += -1  # role is always required and always 1 token
+        return num_tokens
+
+    # every message follows <im_start>{role/name}\n{content}<im_end>\n; every reply is primed with <im_start>assistant
+    return TokenCounter(count_message_tokens, per_message_overhead=4, per_prompt_overhead=2)
@@ -1,67 +1,254 @@
-import copy
+import hashlib
+import logging
+import time
 from functools import wraps
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Callable, Union
 
+import backends
 from backends import get_logger, ContextExceededError
 
 logger = get_logger(__name__)
 
+MESSAGE_DELIMITER = "\n\n"  # joins the contents of consecutive messages with the same role
+USAGE_KEY = "clem_usage"  # the normalized token usage in the raw response of a backend (see normalized_usage)
 
-def ensure_alternating_roles(messages: List[Dict], cull_system_message: bool = True) -> List[Dict]:
-    """
-    The messages format assumes alternating roles of user and assistant. This method checks, if this constraint
-    is satisfied. If this is not the case and there are consecutive user or assistant messages,
-    then these are merged into a single one.
+# called with the model, the error and whether the call is retried, for each failed attempt of a call (see retry)
+RETRY_LISTENERS: List[Callable[["backends.Model", Exception, bool], None]] = []
+# in the messages of HTTP 400 responses of the APIs to prompts that exceed the context size (see retry)
+CONTEXT_LENGTH_ERROR_HINTS = ["context length", "context window", "context_length", "too long", "too many tokens",
+                              "maximum number of tokens"]
 
-    :param messages: to be checked
-    :return: a new messages object with the alternating roles ensured
-    """
-    _messages = copy.deepcopy(messages)
 
-    if cull_system_message:
-        if _messages[0]['role'] == "system" and not _messages[0]["content"]:
-            del _messages[0]
+class AlternatingMessages(list):
+    """
+    An alternating-role view on a messages history that is maintained incrementally.
 
-    def is_same_role(msg1, msg2):
-        return msg1["role"] == msg2["role"]
+    The view is updated with the (growing) history of a player before each call. Only the messages that have been
+    appended since the last update are processed: consecutive messages with the same role are merged into a new
+    message, while the messages of the history itself are never modified. When the history has not only been extended
+    (e.g. it is a new list, it became shorter, or any of its earlier messages has been replaced or changed), then the
+    view is rebuilt. Only the new messages are copied and merged, but detecting the changes is a linear check of the
+    whole history on each update: the earlier messages are compared by identity and with shallow copies taken when they
+    were added, which is cheap (unchanged values are the same objects), but still O(n) per update and O(n²) per
+    episode. Only in-place changes of nested values (e.g. of a list of images) are not detected, use reset() for these.
+    """
 
-    delimiter = "\n\n"
+    def __init__(self, cull_system_message: bool = True):
+        """
+        :param cull_system_message: if True, then an initial system message with empty content is removed
+        """
+        super().__init__()
+        self.cull_system_message = cull_system_message
+        self._source: List[Dict] = None  # the history this view is based on
+        # the messages of the source that are already in the view and their (shallow) copies at the time they were added
+        self._seen: List[Dict] = []
+        self._seen_states: List[Dict] = []
 
-    def join_content(msg1, msg2):
-        return f"{msg1['content']}{delimiter}{msg2['content']}"
+    def reset(self):
+        self.clear()
+        self._source = None
+        self._seen = []
+        self._seen_states = []
 
-    if len(_messages) <= 1:
-        return _messages
+    def update(self, messages: List[Dict]) -> "AlternatingMessages":
+        """
+        Add the messages that have been appended to the history since the last update.
+        :param messages: the history (which is expected to only grow between the updates)
+        :return: this view with the alternating roles ensured
+        """
+        if not self._extends_source(messages):
+            self.reset()
+            self._source = messages
+        for msg_idx in range(len(self._seen), len(messages)):
+            self._append_message(msg_idx, messages[msg_idx])
+            self._seen.append(messages[msg_idx])
+            self._seen_states.append(dict(messages[msg_idx]))
+        return self
 
-    def is_valid(idx):
-        return idx < len(_messages)
+    def _extends_source(self, messages: List[Dict]) -> bool:
+        """
+        :return: True, if the messages are the source with only messages appended since the last update (linear in
+                 the number of messages seen so far)
+        """
+        if messages is not self._source or len(messages) < len(self._seen):
+            return False
+        return all(message is seen and message == seen_state
+                   for message, seen, seen_state in zip(messages, self._seen, self._seen_states))
 
-    msg_idx = 1
-    while is_valid(msg_idx):
-        prev_message = _messages[msg_idx - 1]
-        message = _messages[msg_idx]
-        if is_same_role(prev_message, message):
+    def _append_message(self, msg_idx: int, message: Dict):
+        if msg_idx == 0 and self.cull_system_message:
+            if message["role"] == "system" and not message["content"]:
+                return
+        if self and self[-1]["role"] == message["role"]:
+            prev_message = self[-1]
             warn_msg = (f"Found consecutive role assignments. These will be merged into one:\n"
                         f"{prev_message}\n"
                         f"{message}")
             logger.warning(warn_msg)
-            prev_message['content'] = join_content(prev_message, message)
-            del _messages[msg_idx]
+            # replace instead of modify, so that the messages handed out before stay unchanged
+            merged_content = f"{prev_message['content']}{MESSAGE_DELIMITER}{message['content']}"
+            self[-1] = dict(prev_message, content=merged_content)
         else:
-            msg_idx += 1
+            self.append(dict(message))
+
+
+def ensure_alternating_roles(messages: List[Dict], cull_system_message: bool = True) -> List[Dict]:
+    """
+    The messages format assumes alternating roles of user and assistant. This method checks, if this constraint
+    is satisfied. If this is not the case and there are consecutive user or assistant messages,
+    then these are merged into a single one.
 
-    return _messages
+    :param messages: to be checked; an AlternatingMessages view is returned as is (it is already alternating)
+    :return: a new messages object with the alternating roles ensured
+    """
+    if isinstance(messages, AlternatingMessages) and messages.cull_system_message == cull_system_message:
+        return messages
+    return AlternatingMessages(cull_system_message).update(messages)
 
 
 def ensure_messages_format(generate_response_fn):
     @wraps(generate_response_fn)
-    def wrapped_fn(self, messages):
+    def wrapped_fn(self, messages, *args, **kwargs):
         _messages = ensure_alternating_roles(messages)
-        return generate_response_fn(self, _messages)
+        return generate_response_fn(self, _messages, *args, **kwargs)
 
     return wrapped_fn
 
 
+def retry(tries: int = 3, delay: float = 0, logger: logging.Logger = logger):
+    """
+    Retry the calls of a model that raise an exception (like retry.retry), and report each failed attempt to the
+    RETRY_LISTENERS, e.g. to count the retries and rate limit errors. Prompts that exceed the context size are not
+    retried (see is_context_length_error).
+    :param tries: the maximum number of attempts
+    :param delay: between the attempts in seconds
+    :param logger: to warn about the retries
+    """
+
+    def decorator(generate_response_fn):
+        @wraps(generate_response_fn)
+        def wrapped_fn(self, *args, **kwargs):
+            for attempt in range(1, tries + 1):
+                try:
+                    return generate_response_fn(self, *args, **kwargs)
+                except Exception as e:
+                    will_retry = attempt < tries and not is_context_length_error(e)
+                    for listener in RETRY_LISTENERS:
+                        listener(self, e, will_retry)
+                    if not will_retry:
+                        raise
+                    logger.warning("%s, retrying in %s seconds...", e, delay)
+                    if delay > 0:
+                        time.sleep(delay)
+
+        return wrapped_fn
+
+    return decorator
+
+
+def _status_code(error: Exception) -> Union[int, None]:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None and getattr(error, "response", None) is not None:
+        status_code = getattr(error.response, "status_code", None)
+    return status_code
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """
+    :return: True, if the error is an HTTP 429 (Too Many Requests) response of an API
+    """
+    return _status_code(error) == 429 or "RateLimit" in type(error).__name__
+
+
+def is_context_length_error(error: Exception) -> bool:
+    """
+    :return: True, if the error is a ContextExceededError or an HTTP 413 (Payload Too Large) response of an API or an
+             HTTP 400 (Bad Request) response that mentions the context length or the number of tokens
+    """
+    if isinstance(error, ContextExceededError):
+        return True
+    status_code = _status_code(error)
+    if status_code == 413:
+        return True
+    error_message = str(error).lower()
+    return status_code == 400 and any(hint in error_message for hint in CONTEXT_LENGTH_ERROR_HINTS)
+
+
+def trimmed_response(continuation: str, prompt_text: str, prompt_tokens: int, completion_tokens: int,
+                     **kwargs) -> Dict:
+    """
+    The raw response of a local model to be logged: Only the generated continuation and the token counts, but not the
+    prompt (which is logged with the call anyway), so that the logged responses do not grow with the history.
+    :param continuation: the generated text (without the prompt)
+    :param prompt_text: the prompt as passed to the model; referred to by its hash
+    :param prompt_tokens: the number of prompt tokens
+    :param completion_tokens: the number of generated tokens
+    :param kwargs: further backend-specific information
+    :return: the response object
+    """
+    response = {
+        "continuation": continuation,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "prompt_sha1": hashlib.sha1(prompt_text.encode()).hexdigest()
+    }
+    response.update(kwargs)
+    response[USAGE_KEY] = normalized_usage(prompt_tokens, completion_tokens)
+    return response
+
+
+def normalized_usage(prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Dict:
+    """
+    The token usage of a call in the same format for all backends, to be added to the raw response under USAGE_KEY.
+    :param prompt_tokens: the number of prompt tokens (including the cached ones)
+    :param completion_tokens: the number of generated tokens
+    :param cached_tokens: the number of prompt tokens that were read from a prompt cache (not processed again)
+    :return: the usage with 'prompt_tokens', 'completion_tokens' and 'cached_tokens' (None counts as 0)
+    """
+    return {
+        "prompt_tokens": int(prompt_tokens or 0),
+        "completion_tokens": int(completion_tokens or 0),
+        "cached_tokens": int(cached_tokens or 0)
+    }
+
+
+def openai_usage(usage: Dict) -> Dict:
+    """
+    :param usage: the usage of an OpenAI(-compatible) chat completion response (or None, if not reported)
+    :return: the normalized usage (see normalized_usage)
+    """
+    usage = usage or {}
+    prompt_tokens_details = usage.get("prompt_tokens_details") or {}
+    return normalized_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"),
+                            prompt_tokens_details.get("cached_tokens"))
+
+
+def with_choice_usage(response: Dict, choice_idx: int) -> Dict:
+    """
+    The usage of a request with several completions (choices) is only reported for the whole request. It is assigned
+    to the first choice, the other choices have no usage, so that the totals over the choices are correct.
+    :return: the response of a single choice with its normalized usage
+    """
+    if choice_idx == 0:
+        return response
+    return dict(response, **{USAGE_KEY: normalized_usage(0, 0)})
+
+
+def log_load_time(model_name: str, load_duration: float, num_bytes: int) -> Dict:
+    """
+    Report the time it took to load the weights of a model. A high throughput indicates that the weights were read
+    from the OS page cache (e.g. memory-mapped files of a previous load) instead of the disk.
+    :param model_name: of the loaded model
+    :param load_duration: in seconds
+    :param num_bytes: the size of the loaded weights
+    :return: the load-time report with the 'load_duration', the 'weights_bytes' and the 'throughput' in bytes/sec
+    """
+    throughput = num_bytes / load_duration if load_duration > 0 else 0.
+    logger.info("Loaded the weights of %s in %.2fs (%.2f GB, %.2f GB/s)", model_name, load_duration,
+                num_bytes / 1e9, throughput / 1e9)
+    return {"load_duration": load_duration, "weights_bytes": num_bytes, "throughput": throughput}
+
+
 def check_context_limit_generic(context_size: int, prompt_tokens: List, model_name: str, max_new_tokens: int = 100) \
         -> Tuple[bool, int, int, int]:
     """
@@ -88,3 +275,32 @@ def check_context_limit_generic(context_size: int, prompt_tokens: List, model_na
                                    tokens_used=tokens_used, tokens_left=tokens_left, context_size=context_size)
 
     return fits, tokens_used, tokens_left, context_size
+
+
+def optional_gen_args(model: "backends.Model", stop: str = "stop", top_p: str = "top_p") -> Dict:
+    """
+    The optional generation arguments that are set for the model, to be passed to an API (None for unsupported ones).
+    :param model: whose generation arguments are used
+    :param stop: the API's name for the stop sequences
+    :param top_p: the API's name for the nucleus sampling probability mass
+    :return: the API arguments for the optional generation arguments that are set
+    """
+    api_args = {}
+    if stop is not None and model.get_stop():
+        api_args[stop] = model.get_stop()
+    if top_p is not None and model.get_top_p() is not None:
+        api_args[top_p] = model.get_top_p()
+    return api_args
+
+
+def truncate_at_stop(text: str, stop: List[str]) -> str:
+    """
+    :param text: a generated text
+    :param stop: the stop sequences (or None)
+    :return: the text up to the first occurrence of any of the stop sequences
+    """
+    for stop_sequence in stop or []:
+        stop_idx = text.find(stop_sequence)
+        if stop_idx != -1:
+            text = text[:stop_idx]
+    return text
@@ -0,0 +1,94 @@
+"""
+    Warm-up: Load the models of a run concurrently and probe each with a tiny request before the first episode.
+
+    This way, the loading time and the latency of the first request (e.g. establishing the connection to an API) do
+    not show up in the call durations of the first episode, and misconfigured credentials or registry entries fail
+    the run before it has started.
+
+    When a memory budget for local models is configured (see backends/residency.py), the models are loaded one at a
+    time, because the weights of a model only count against the budget once the model has been loaded.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple
+
+import backends
+from backends import Model, ModelSpec, CustomResponseModel, HumanModel, residency
+
+logger = backends.get_logger(__name__)
+
+PROBE_MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+class WarmUpError(Exception):
+    """
+    Exception to be raised when at least one of the models of a run cannot be loaded or does not respond.
+    """
+
+    def __init__(self, failures: List[Tuple[str, Exception]]):
+        """
+        :param failures: the model name and the exception for each model that failed
+        """
+        details = "; ".join(f"{model_name}: {type(e).__name__}: {e}" for model_name, e in failures)
+        super().__init__(f"Warm-up failed for {len(failures)} model(s): {details}")
+        self.failures = failures
+
+
+def probe(model: Model) -> float:
+    """
+    Send a tiny request (one token to be generated) to the model. Human and programmatic players are not probed.
+    :param model: to be probed
+    :return: the latency of the request in seconds (0.0 for models that are not probed)
+    """
+    if isinstance(model, (CustomResponseModel, HumanModel)):
+        return 0.0
+    with model.using_gen_args(temperature=0.0, max_tokens=1):
+        time_start = time.perf_counter()
+        model.generate_response(PROBE_MESSAGES)
+        return time.perf_counter() - time_start
+
+
+def _load_and_probe(model_spec: ModelSpec) -> Tuple[Model, Dict]:
+    time_start = time.perf_counter()
+    model = backends.get_model_for(model_spec)
+    load_duration = time.perf_counter() - time_start
+    first_response_duration = probe(model)
+    report = {"model_name": model.get_name(), "load_duration": load_duration,
+              "first_response_duration": first_response_duration}
+    load_report = getattr(model, "load_report", None)  # only local models load weights
+    if load_report is not None:
+        report["weights_throughput"] = load_report["throughput"]
+    return model, report
+
+
+def warm_up(model_specs: List[ModelSpec], max_workers: int = None) -> Tuple[List[Model], List[Dict]]:
+    """
+    Load the models concurrently (one at a time with a memory budget) and probe each of them once.
+    :param model_specs: of the models to be loaded
+    :param max_workers: the number of models to load at the same time; all at once, if not given (and no memory
+                        budget is configured)
+    :return: the models (in the order of the model specs) and for each model a report with the 'load_duration' and
+             the 'first_response_duration' in seconds and, for local models, the 'weights_throughput' of loading the
+             weights in bytes/sec (see backends.utils.log_load_time)
+    :raise WarmUpError: if any of the models cannot be loaded or probed (after all models have been tried)
+    """
+    if not model_specs:
+        return [], []
+    if residency.get_residency_manager() is not None:  # otherwise, the models could exceed the budget while loading
+        max_workers = 1
+    with ThreadPoolExecutor(max_workers=max_workers or len(model_specs)) as executor:
+        futures = [executor.submit(_load_and_probe, model_spec) for model_spec in model_specs]
+    models, reports, failures = [], [], []
+    for model_spec, future in zip(model_specs, futures):
+        try:
+            model, report = future.result()
+        except Exception as e:
+            model_name = model_spec.model_name if "model_name" in model_spec else str(model_spec)
+            logger.error("Warm-up of %s failed", model_name, exc_info=True)
+            failures.append((model_name, e))
+            continue
+        models.append(model)
+        reports.append(report)
+    if failures:
+        raise WarmUpError(failures)
+    return models, reports
@@ -1,9 +1,9 @@
 import importlib
+import json
 import sys
 import os
 import logging
-import logging.config
-import yaml
+from typing import Dict, List
 
 BANNER = \
     r"""
@@ -19,29 +19,80 @@ print(BANNER)
 
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# Configure logging
-with open(os.path.join(project_root, "logging.yaml")) as f:
-    conf = yaml.safe_load(f)
-    log_fn = conf["handlers"]["file_handler"]["filename"]
-    log_fn = os.path.join(project_root, log_fn)
-    conf["handlers"]["file_handler"]["filename"] = log_fn
-    logging.config.dictConfig(conf)
+# The logging is configured by the backends package (see logging.yaml)
+import backends  # noqa: E402
+
+EVENTS_LOGGER = "clemgame.events"  # the records of each logged event and score of the game recorders
+VERBOSITY_LEVELS = {"events": logging.INFO, "throughput": logging.WARNING}
 
 
 def get_logger(name):
     return logging.getLogger(name)
 
 
-# Load games dynamically from "games" sibling directory
+def set_verbosity(verbosity: str):
+    """
+    :param verbosity: 'events' to log each event and score of the episodes, 'throughput' to only log the episodes
+    """
+    if verbosity not in VERBOSITY_LEVELS:
+        raise ValueError(f"Unknown verbosity '{verbosity}'. Choose one of {list(VERBOSITY_LEVELS.keys())}.")
+    logging.getLogger(EVENTS_LOGGER).setLevel(VERBOSITY_LEVELS[verbosity])
+
+
+# Games are loaded lazily from the "games" sibling directory: The game registry lists the names and descriptions of
+# the games, so that listing them does not require to import them. A game module is only imported when it is used.
 # Note: The games might use get_logger (circular import)
 games_root = os.path.join(project_root, "games")
-if os.path.isdir(games_root):
-    games_modules = [file for file in os.listdir(games_root)
-                     if os.path.isdir(os.path.join(games_root, file)) and file not in ["__pycache__"]]
-    for game_module in games_modules:
-        try:
-            importlib.import_module(f"games.{game_module}.master")
-        except Exception as e:
-            print(e)
-            print(f"Cannot load 'games.{game_module}.master'."
-                  f" Please make sure that the file exists.", file=sys.stderr)
+_game_registry: Dict[str, Dict] = dict()  # game_name -> game registry entry
+
+
+def load_game_registry(_game_registry_path: str = None):
+    """
+    Load the game names and descriptions from a game registry JSON file (a list of game entries).
+    :param _game_registry_path: Defaults to games/game_registry.json in the clembench root directory.
+    """
+    if not _game_registry_path:
+        _game_registry_path = os.path.join(games_root, "game_registry.json")
+    if not os.path.isfile(_game_registry_path):
+        return  # unregistered games are still discovered by importing them
+    with open(_game_registry_path, encoding='utf-8') as f:
+        for _game_entry in json.load(f):
+            _game_registry[_game_entry["game_name"]] = _game_entry
+
+
+def get_game_registry() -> Dict[str, Dict]:
+    return _game_registry
+
+
+def list_game_modules() -> List[str]:
+    """
+    :return: the names of the game directories which are expected to contain a master.py
+    """
+    if not os.path.isdir(games_root):
+        return []
+    return sorted([file for file in os.listdir(games_root)
+                   if os.path.isdir(os.path.join(games_root, file)) and file not in ["__pycache__"]])
+
+
+def load_game_module(game_module: str) -> bool:
+    """
+    Import the master.py of a game, so that its GameBenchmark becomes available.
+    :param game_module: the name of the game directory
+    :return: True, if the module could be imported
+    """
+    try:
+        importlib.import_module(f"games.{game_module}.master")
+        return True
+    except Exception as e:
+        print(e)
+        print(f"Cannot load 'games.{game_module}.master'."
+              f" Please make sure that the file exists.", file=sys.stderr)
+        return False
+
+
+def load_game_modules():
+    for game_module in list_game_modules():
+        load_game_module(game_module)
+
+
+load_game_registry()
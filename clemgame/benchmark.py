@@ -2,11 +2,12 @@
 from typing import List, Dict
 
 import backends
+import backends.warmup
 import clemgame
 
 from datetime import datetime
 
-from clemgame.clemgame import load_benchmarks, load_benchmark
+from clemgame.clemgame import load_benchmarks, load_benchmark, load_game_descriptions
 
 logger = clemgame.get_logger(__name__)
 stdout_logger = clemgame.get_logger("benchmark.run")
@@ -18,31 +19,40 @@ backends.load_model_registry()
 
 def list_games():
     stdout_logger.info("Listing benchmark games:")
-    games_list = load_benchmarks(do_setup=False)
-    if not games_list:
+    game_descriptions = load_game_descriptions()
+    if not game_descriptions:
         stdout_logger.info(" No games found. You can create a new game module in a sibling 'games' directory.")
-    games_list = sorted(games_list, key=lambda gb: gb.name)
-    for game in games_list:
-        stdout_logger.info(" Game: %s -> %s", game.name, game.get_description())
+    for game_name in sorted(game_descriptions):
+        stdout_logger.info(" Game: %s -> %s", game_name, game_descriptions[game_name])
 
 
 def run(game_name: str, model_specs: List[backends.ModelSpec], gen_args: Dict,
-        experiment_name: str = None, instances_name: str = None, results_dir: str = None):
+        experiment_name: str = None, instances_name: str = None, results_dir: str = None, num_samples: int = 1,
+        player_gen_args: List[Dict] = None, warmup: bool = True, stream_records: bool = False,
+        delta_requests: bool = False):
     if experiment_name:
         logger.info("Only running experiment: %s", experiment_name)
     try:
-        player_models = []
-        for model_spec in model_specs:
-            model = backends.get_model_for(model_spec)
+        if warmup:  # load all models at once and probe them, so that misconfigurations fail before the first episode
+            player_models, warmup_reports = backends.warmup.warm_up(model_specs)
+            for report in warmup_reports:
+                weights_info = f" (weights at {report['weights_throughput'] / 1e9:.2f} GB/s)" \
+                    if "weights_throughput" in report else ""
+                stdout_logger.info("Warm-up of %s: loaded in %.2fs%s, first response in %.2fs", report["model_name"],
+                                   report["load_duration"], weights_info, report["first_response_duration"])
+        else:
+            player_models = [backends.get_model_for(model_spec) for model_spec in model_specs]
+        for model in player_models:
             model.set_gen_args(**gen_args)  # todo make this somehow available in generate method?
-            player_models.append(model)
         benchmark = load_benchmark(game_name, instances_name=instances_name)
         logger.info("Running benchmark for '%s' (models=%s)", game_name,
                     player_models if player_models is not None else "see experiment configs")
         if experiment_name:
             benchmark.filter_experiment.append(experiment_name)
         time_start = datetime.now()
-        benchmark.run(player_models=player_models, results_dir=results_dir)
+        benchmark.run(player_models=player_models, results_dir=results_dir, num_samples=num_samples,
+                      player_gen_args=player_gen_args, stream_records=stream_records,
+                      delta_requests=delta_requests)
         time_end = datetime.now()
         logger.info(f"Run {benchmark.name} took {str(time_end - time_start)}")
     except Exception as e:
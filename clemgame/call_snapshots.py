@@ -0,0 +1,108 @@
+"""
+    Copy-free call logging: Immutable snapshots of the prompts that are logged with the calls of an episode.
+
+    The prompt of a call is usually the (growing) messages history of a player. Instead of a deep copy of the whole
+    history for each call, a snapshot only copies the messages that have been appended since the previous call with
+    the same history and shares the snapshot of the earlier messages (structural sharing). The messages are copied
+    when they are added, so that later changes of the history do not change the prompts logged before.
+"""
+import copy
+from typing import List, Dict, Tuple, Any
+
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None))
+
+
+def _copy_message(message: Dict) -> Dict:
+    if all(isinstance(value, _IMMUTABLE_TYPES) for value in message.values()):
+        return dict(message)
+    return copy.deepcopy(message)  # e.g. a list of images
+
+
+class MessagesSnapshot:
+    """
+    An immutable snapshot of a messages history: The messages added to the snapshot of an earlier state of the history.
+    """
+    __slots__ = ("prefix", "messages", "length")
+
+    def __init__(self, prefix: "MessagesSnapshot", messages: Tuple[Dict, ...]):
+        """
+        :param prefix: the snapshot of the earlier messages (or None)
+        :param messages: the copies of the messages appended since then (never modified)
+        """
+        self.prefix = prefix
+        self.messages = messages
+        self.length = (prefix.length if prefix is not None else 0) + len(messages)
+
+    def __len__(self):
+        return self.length
+
+    def last_message(self) -> Dict:
+        node = self
+        while node is not None and not node.messages:
+            node = node.prefix
+        return node.messages[-1] if node is not None else None
+
+    def to_list(self) -> List[Dict]:
+        """
+        :return: a new list with (copies of) the messages, e.g. to be stored
+        """
+        chunks = []
+        node = self
+        while node is not None:
+            chunks.append(node.messages)
+            node = node.prefix
+        return [dict(message) for chunk in reversed(chunks) for message in chunk]
+
+
+class CallSnapshots:
+    """
+    Takes the snapshots of the prompts logged by a GameRecorder. Appending messages to a history is detected; when any
+    earlier message has been replaced or changed, or for another list, a new snapshot is taken from scratch. As for
+    AlternatingMessages, the earlier messages are compared with the copies in the snapshot, which is a linear check, but
+    a cheap one, because unchanged messages are the same objects and share their (shallowly copied) values.
+    """
+
+    def __init__(self):
+        # id of the history -> the history, the snapshot of its state at the latest call, the messages of the history
+        # in the snapshot and their copies in the snapshot
+        self._histories: Dict[int, Tuple[List, MessagesSnapshot, List[Dict], List[Dict]]] = {}
+
+    def snapshot(self, prompt: Any) -> Any:
+        """
+        :param prompt: the prompt object of a call
+        :return: a snapshot, if the prompt is a messages list; otherwise a copy of the prompt
+        """
+        if not isinstance(prompt, list):
+            return copy.deepcopy(prompt) if isinstance(prompt, dict) else prompt
+        prefix, seen, seen_copies = None, [], []
+        previous = self._histories.get(id(prompt))
+        if previous is not None and previous[0] is prompt and self._extends(prompt, previous[2], previous[3]):
+            _, prefix, seen, seen_copies = previous
+        new_messages = prompt[len(seen):]
+        if not all(isinstance(message, dict) for message in new_messages):  # not a messages history
+            return copy.deepcopy(prompt)
+        message_copies = tuple(_copy_message(message) for message in new_messages)
+        snapshot = MessagesSnapshot(prefix, message_copies)
+        seen.extend(new_messages)
+        seen_copies.extend(message_copies)
+        self._histories[id(prompt)] = (prompt, snapshot, seen, seen_copies)  # keeps the history alive (its id is unique)
+        return snapshot
+
+    @staticmethod
+    def _extends(history: List, seen: List[Dict], seen_copies: List[Dict]) -> bool:
+        """
+        :return: True, if the history only has messages appended since the messages in the snapshot
+        """
+        if len(history) < len(seen):
+            return False
+        return all(message is seen_message and message == seen_copy
+                   for message, seen_message, seen_copy in zip(history, seen, seen_copies))
+
+
+def expand(call_obj: Any) -> Any:
+    """
+    :return: the messages list of a snapshot; other objects as is
+    """
+    if isinstance(call_obj, MessagesSnapshot):
+        return call_obj.to_list()
+    return call_obj
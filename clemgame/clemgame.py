@@ -8,13 +8,17 @@ from typing import List, Dict, Tuple, Any
 from tqdm import tqdm
 
 import backends
-from backends import Model, CustomResponseModel, HumanModel
+from backends import Model, ModelProxy, CustomResponseModel, HumanModel
+from backends.utils import AlternatingMessages, USAGE_KEY
 import clemgame
-from clemgame import file_utils, transcript_utils
+from clemgame import file_utils, transcript_utils, call_snapshots, results_store, timing, live_metrics
+from clemgame.episode_forks import EpisodeFork
+from clemgame.token_usage import UsageTotals, UsageByModel
 import clemgame.metrics as ms
 
 logger = clemgame.get_logger(__name__)
 stdout_logger = clemgame.get_logger("benchmark.run")
+events_logger = clemgame.get_logger(clemgame.EVENTS_LOGGER)
 
 # Showcases that should not be run for the overall benchmark (still can be run, when specified specifically)
 GAMES_TO_IGNORE = ["hellogame", "chatgame"]
@@ -32,6 +36,8 @@ class Player(abc.ABC):
     def __init__(self, model: Model):
         self.model = model
         self.descriptor: str = None
+        self.alternating_messages = AlternatingMessages()  # incrementally updated view on the messages history
+        self.usage = UsageTotals()  # the token usage of the calls of this player so far
         logger.info("Player %s", self.get_description())
 
     def get_description(self) -> str:
@@ -41,19 +47,29 @@ class Player(abc.ABC):
         call_start = datetime.now()
         prompt = messages
         response = dict()
-        if isinstance(self.model, CustomResponseModel):
-            response_text = self._custom_response(messages, turn_idx)
-        elif isinstance(self.model, HumanModel):
-            response_text = self._terminal_response(messages, turn_idx)
-        else:
-            prompt, response, response_text = self.model.generate_response(messages)
+        # the model of the player; the model attribute of the enclosing spans is the dialogue pair:
+        backend_model = self.model.get_name() if timing.is_enabled() else None
+        with timing.span("backend_call", backend_model=backend_model):
+            if isinstance(self.model, CustomResponseModel):
+                response_text = self._custom_response(messages, turn_idx)
+            elif isinstance(self.model, HumanModel):
+                response_text = self._terminal_response(messages, turn_idx)
+            else:
+                model_messages = self.alternating_messages.update(messages)
+                with live_metrics.model_call(self.model):
+                    prompt, response, response_text = self.model.generate_response(model_messages)
         call_duration = datetime.now() - call_start
         response["clem_player"] = {
             "call_start": str(call_start),
             "call_duration": str(call_duration),
+            "call_seconds": call_duration.total_seconds(),
             "response": response_text,
             "model_name": self.model.get_name()
         }
+        if response.get(USAGE_KEY):  # reported by the backend (not by programmatic and human players)
+            self.usage.add(response[USAGE_KEY], call_duration.total_seconds())
+            live_metrics.record_usage(self.model, response[USAGE_KEY])
+            response["clem_player"]["usage"] = self.usage.to_dict()
         return prompt, response, response_text
 
     def _terminal_response(self, messages, turn_idx) -> str:
@@ -122,11 +138,11 @@ class GameResourceLocator(abc.ABC):
 
     def load_results_json(self, file_name: str, results_dir: str, dialogue_pair: str) -> Dict:
         """
-        Load a .json file from your game (or game results) directory
+        Load a .json file from your game results (see results_store.open_store)
         :param file_name: can have subdirectories e.g. "sub/my_file"
         :return: the file contents
         """
-        return file_utils.load_results_json(file_name, results_dir, dialogue_pair, self.name)
+        return results_store.open_store(results_dir).load_results_json(file_name, dialogue_pair, self.name)
 
     def load_csv(self, file_name: str) -> Dict:
         """
@@ -163,10 +179,11 @@ class GameResourceLocator(abc.ABC):
         :param sub_dir: automatically created when given; otherwise an error will be thrown.
         :param data: to store
         :param file_name: can have subdirectories e.g. "sub/my_file"
-        :param root_dir: an alternative results directory structure given as a relative or absolute path
+        :param root_dir: an alternative results directory structure given as a relative or absolute path (or an SQLite
+                         file, see results_store.open_store)
         """
-        fp = file_utils.store_game_results_file(data, file_name, dialogue_pair, self.name,
-                                                sub_dir=sub_dir, root_dir=root_dir)
+        fp = results_store.open_store(root_dir).store_results_file(data, file_name, dialogue_pair, self.name,
+                                                                   sub_dir=sub_dir)
         self.logger.info("Results file stored to %s", fp)
 
     def results_path_for(self, results_dir: str, dialogue_pair: str):
@@ -188,20 +205,55 @@ class GameRecorder(GameResourceLocator):
         }
         """ Stores calls to the API """
         self.requests = []
+        """ Snapshots of the logged prompts, which share their earlier messages """
+        self._call_snapshots = call_snapshots.CallSnapshots()
+        """ Whether to store the prompts in requests.json as the difference to an earlier prompt """
+        self.delta_requests = False
+        """ Appends the interactions and calls to JSONL files as they happen (if streaming) """
+        self._interactions_stream: file_utils.JsonlAppender = None
+        self._requests_stream: file_utils.JsonlAppender = None
+        """ The token usage of the logged calls per model """
+        self.usage = UsageByModel()
+
+    def stream_records(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str):
+        """
+        Append the interactions and calls to interactions.jsonl and requests.jsonl in the episode directory as they are
+        logged, instead of keeping the calls in memory. The writes are flushed after each turn and each call, so that
+        a crash loses at most the events of the current turn. store_records() converts the JSONL files into the
+        interactions.json and requests.json files; the results loaders read the JSONL files of episodes that have not
+        been finalized. To be called before anything is logged.
+        """
+        episode_dir = results_store.open_store(results_root).stream_dir(
+            results_store.rel_path_for(dialogue_pair_desc, self.name, game_record_dir))
+        self._interactions_stream = file_utils.JsonlAppender(os.path.join(episode_dir, "interactions.jsonl"))
+        self._requests_stream = file_utils.JsonlAppender(os.path.join(episode_dir, "requests.jsonl"))
+
+    def close_records(self):
+        """ Flush and close the JSONL files of a streaming recorder (without converting them) """
+        for stream in (self._interactions_stream, self._requests_stream):
+            if stream is not None:
+                stream.close()
 
     def log_next_turn(self):
         """ Call this method to group interactions per turn """
         self.log_current_turn += 1
         self.interactions["turns"].append([])
+        if self._interactions_stream is not None:
+            self._interactions_stream.flush()  # the events of the previous turn
+            self._interactions_stream.append({"next_turn": self.log_current_turn})
 
     def log_key(self, key: str, value: Any):
         """Add a key and value to the internal log."""
         self.interactions[key] = value
-        self.logger.info(f"{self.name}: Logged a game-specific interaction key: {key}.")
+        if self._interactions_stream is not None:
+            self._interactions_stream.append({"key": key, "value": value})
+        events_logger.info("%s: Logged a game-specific interaction key: %s.", self.name, key)
 
     def log_players(self, players_dic: Dict):
         self.interactions["players"] = players_dic
-        self.logger.info(f"{self.name}: Logged players metadata.")
+        if self._interactions_stream is not None:
+            self._interactions_stream.append({"players": players_dic})
+        events_logger.info("%s: Logged players metadata.", self.name)
 
     def log_event(self, from_: str, to: str, action: Dict, call: Tuple[Any, Any] = None):
         """
@@ -222,16 +274,24 @@ class GameRecorder(GameResourceLocator):
             "action": action
         }
         self.interactions["turns"][self.log_current_turn].append(action_obj.copy())
-        self.logger.info(
-            f"{self.name}: Logged {action['type']} action ({from_}->{to}).")
+        if self._interactions_stream is not None:
+            self._interactions_stream.append({"turn": self.log_current_turn, "event": action_obj})
+        events_logger.info("%s: Logged %s action (%s->%s).", self.name, action['type'], from_, to)
         if call:
-            call_obj = {
-                "timestamp": timestamp,
-                "manipulated_prompt_obj": self._needs_copy(call[0]),
-                "raw_response_obj": self._needs_copy(call[1])
-            }
-            self.requests.append(call_obj)
-            self.logger.info(f"{self.name}: Logged a call with timestamp {timestamp}")
+            self.usage.add_response(call[1])
+            if self._requests_stream is not None:  # serialized right away, so that no copy is needed
+                self._requests_stream.append({"timestamp": timestamp, "manipulated_prompt_obj": call[0],
+                                              "raw_response_obj": call[1]})
+                self._interactions_stream.flush()
+                self._requests_stream.flush()
+            else:
+                call_obj = {
+                    "timestamp": timestamp,
+                    "manipulated_prompt_obj": self._call_snapshots.snapshot(call[0]),
+                    "raw_response_obj": self._needs_copy(call[1])
+                }
+                self.requests.append(call_obj)
+            events_logger.info("%s: Logged a call with timestamp %s", self.name, timestamp)
 
     @staticmethod
     def _needs_copy(call_obj):
@@ -243,6 +303,12 @@ class GameRecorder(GameResourceLocator):
 
     def store_records(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str):
         """Raise warnings if a mandatory element is empty or format is wrong."""
+        with timing.span("store_records"):
+            self._store_records(results_root, dialogue_pair_desc, game_record_dir)
+
+    def _store_records(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str):
+        if self.usage:
+            self.interactions["usage"] = self.usage.to_dict()
         if not self.interactions["players"]:
             self.logger.warning(f"Players metadada is missing!")
         else:
@@ -254,17 +320,54 @@ class GameRecorder(GameResourceLocator):
                     self.logger.warning(f"Invalid player identifiers, html builder won't work.")
         if not self.interactions["turns"]:
             self.logger.warning(f"Interaction logs are missing!")
+        if self._requests_stream is not None:
+            self._finalize_streamed_records(results_root, dialogue_pair_desc, game_record_dir)
+            return
         if not self.requests:
             self.logger.warning(f"No calls logged!")
         self.store_results_file(self.interactions, "interactions.json",
                                 dialogue_pair_desc,
                                 sub_dir=game_record_dir,
                                 root_dir=results_root)
-        self.store_results_file(self.requests, "requests.json",
+        requests = [dict(call_obj, manipulated_prompt_obj=call_snapshots.expand(call_obj["manipulated_prompt_obj"]))
+                    for call_obj in self.requests]
+        if self.delta_requests:
+            requests = file_utils.delta_encode_requests(requests)
+        self.store_results_file(requests, "requests.json",
                                 dialogue_pair_desc,
                                 sub_dir=game_record_dir,
                                 root_dir=results_root)
 
+    def _finalize_streamed_records(self, results_root: str, dialogue_pair_desc: str, game_record_dir: str):
+        self.close_records()
+        if self._requests_stream.num_records == 0:
+            self.logger.warning(f"No calls logged!")
+        self.store_results_file(self.interactions, "interactions.json",
+                                dialogue_pair_desc,
+                                sub_dir=game_record_dir,
+                                root_dir=results_root)
+        requests_path = self._requests_stream.file_path
+        is_directory_store = isinstance(results_store.open_store(results_root), results_store.DirectoryStore)
+        if self.delta_requests or not is_directory_store:
+            requests = file_utils.load_jsonl(requests_path)
+            if self.delta_requests:
+                requests = file_utils.delta_encode_requests(requests)
+            self.store_results_file(requests, "requests.json",
+                                    dialogue_pair_desc,
+                                    sub_dir=game_record_dir,
+                                    root_dir=results_root)
+        else:
+            json_path = os.path.join(os.path.dirname(requests_path), file_utils.compressed_file_name("requests.json"))
+            file_utils.jsonl_to_json_list(requests_path, json_path)
+            self.logger.info("Results file stored to %s", json_path)
+        os.remove(requests_path)
+        os.remove(self._interactions_stream.file_path)
+        if not is_directory_store:  # remove the then empty stream directories
+            try:
+                os.removedirs(os.path.dirname(requests_path))
+            except OSError:
+                pass
+
 
 class GameMaster(GameRecorder):
     """
@@ -321,19 +424,19 @@ class GameScorer(GameResourceLocator):
 
     def log_turn_score(self, turn_idx, score_name, score_value):
         if isinstance(score_value, bool):
-            self.logger.warning(f"{self.name}: Score {score_name} value is boolean, this can break the eval!")
+            self.logger.warning("%s: Score %s value is boolean, this can break the eval!", self.name, score_name)
         if turn_idx not in self.scores["turn scores"]:
             self.scores["turn scores"][turn_idx] = {}
         if score_name in self.scores["turn scores"][turn_idx]:
-            self.logger.warning(f"{self.name}: Score {score_name} overwritten at turn {turn_idx}!")
+            self.logger.warning("%s: Score %s overwritten at turn %s!", self.name, score_name, turn_idx)
         self.scores["turn scores"][turn_idx][score_name] = score_value
-        self.logger.info(f"{self.name}: Logged turn {turn_idx} score {score_name}={score_value}.")
+        events_logger.info("%s: Logged turn %s score %s=%s.", self.name, turn_idx, score_name, score_value)
 
     def log_episode_score(self, score_name, score_value):
         if score_name in self.scores["episode scores"]:
-            self.logger.warning(f"{self.name}: Episode score {score_name} overwritten!")
+            self.logger.warning("%s: Episode score %s overwritten!", self.name, score_name)
         self.scores["episode scores"][score_name] = score_value
-        self.logger.info(f"{self.name}: Logged episode score {score_name}={score_value}.")
+        events_logger.info("%s: Logged episode score %s=%s.", self.name, score_name, score_value)
 
     def compute_scores(self, episode_interactions: Dict) -> None:
         self.score_turns(episode_interactions)
@@ -423,7 +526,7 @@ class DialogueGameMaster(GameMaster):
         while not inner_break and self._does_game_proceed():
             self.log_next_turn()  # not sure if we want to do this always here (or add to _on_before_turn)
             self._on_before_turn(self.current_turn)
-            self.logger.info(f"{self.name}: %s turn: %d", self.name, self.current_turn)
+            events_logger.info("%s: %s turn: %d", self.name, self.name, self.current_turn)
             for player in self.__player_sequence():
                 if not self._does_game_proceed():
                     inner_break = True  # break outer loop without calling _does_game_proceed again
@@ -437,6 +540,10 @@ class DialogueGameMaster(GameMaster):
         self._on_after_game()
 
     def prompt(self, player: Player, is_reprompt=False):
+        with timing.span("prompt", player=player.descriptor):
+            self._prompt(player, is_reprompt)
+
+    def _prompt(self, player: Player, is_reprompt=False):
         # GM -> Player
         history = self.messages_by_names[player.descriptor]
         assert history, f"messages history must not be empty for {player.descriptor}"
@@ -503,8 +610,11 @@ class DialogueGameMaster(GameMaster):
         # todo: it seems we should change the order here: Parse should come first, and then validate.
         # While parse might throw a parsing (format error) validate would check solely for satisfied game rules.
         # Note: this would allow to cut off too long responses (during parse) and to only validate on the cut off piece.
-        if self._validate_player_response(player, utterance):
-            utterance = self.__parse_response(player, utterance)
+        with timing.span("validation"):
+            is_valid = self._validate_player_response(player, utterance)
+        if is_valid:
+            with timing.span("parse"):
+                utterance = self.__parse_response(player, utterance)
             self.add_assistant_message(player, utterance)
             self._after_add_player_response(player, utterance)
 
@@ -592,6 +702,20 @@ class DialogueGameMaster(GameMaster):
         pass
 
 
+def with_player_gen_args(player_models: List[Model], *player_gen_args_configs: List[Dict]) -> List[Model]:
+    """
+    :param player_models: the models of the players (in the order of the players)
+    :param player_gen_args_configs: lists of generation arguments per player (or None); later ones overwrite earlier
+    :return: the player models, where those with own generation arguments are replaced by a ModelProxy
+    """
+    player_gen_args = [dict() for _ in player_models]
+    for player_gen_args_config in player_gen_args_configs:
+        for player_idx, gen_args in enumerate((player_gen_args_config or [])[:len(player_models)]):
+            player_gen_args[player_idx].update(gen_args or {})
+    return [ModelProxy(model, gen_args) if gen_args and not isinstance(model, (CustomResponseModel, HumanModel))
+            else model for model, gen_args in zip(player_models, player_gen_args)]
+
+
 class GameBenchmark(GameResourceLocator):
     """
     The GameBenchmark organizes the run of a particular collection of game instances
@@ -617,20 +741,18 @@ class GameBenchmark(GameResourceLocator):
 
     def build_transcripts(self, results_dir: str = None):
         results_root = file_utils.results_root(results_dir)
-        dialogue_partners = [file for file in os.listdir(results_root)
-                             if os.path.isdir(os.path.join(results_root, file))]
+        store = results_store.open_store(results_root)
+        dialogue_partners = store.list_dirs()
         for dialogue_pair in dialogue_partners:
-            game_result_path = self.results_path_for(results_root, dialogue_pair)
-            if not os.path.exists(game_result_path) or not os.path.isdir(game_result_path):
+            if self.name not in store.list_dirs(dialogue_pair):
+                game_result_path = self.results_path_for(results_root, dialogue_pair)
                 stdout_logger.info("No results directory found at: " + game_result_path)
                 continue
 
-            experiment_dirs = [file for file in os.listdir(game_result_path)
-                               if os.path.isdir(os.path.join(game_result_path, file))]
+            experiment_dirs = store.list_dirs(results_store.rel_path_for(dialogue_pair, self.name))
             if not experiment_dirs:
                 stdout_logger.warning(f"{self.name}: No experiments for {dialogue_pair}")
             for experiment_dir in experiment_dirs:
-                experiment_path = os.path.join(game_result_path, experiment_dir)
                 experiment_name = "_".join(experiment_dir.split("_")[1:])  # remove leading index number
                 if self.filter_experiment and experiment_name not in self.filter_experiment:
                     stdout_logger.info(f"Skip experiment {experiment_name}")
@@ -638,28 +760,28 @@ class GameBenchmark(GameResourceLocator):
                 stdout_logger.info(f"Transcribe: {experiment_name}")
                 experiment_config = self.load_results_json(f"{experiment_dir}/experiment_{experiment_name}",
                                                            results_root, dialogue_pair)
-                episode_dirs = [file for file in os.listdir(experiment_path)
-                                if os.path.isdir(os.path.join(experiment_path, file))]
+                episode_dirs = store.list_dirs(results_store.rel_path_for(dialogue_pair, self.name, experiment_dir))
                 error_count = 0
                 for episode_dir in tqdm(episode_dirs, desc="Building transcripts"):
                     try:
-                        rel_episode_path = f"{experiment_dir}/{episode_dir}"
-                        game_instance = self.load_results_json(f"{rel_episode_path}/instance",
-                                                               results_root, dialogue_pair)
-                        game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
+                        with timing.span("transcript", game=self.name, experiment=experiment_name, model=dialogue_pair):
+                            rel_episode_path = f"{experiment_dir}/{episode_dir}"
+                            game_instance = self.load_results_json(f"{rel_episode_path}/instance",
                                                                    results_root, dialogue_pair)
-
-                        transcript = transcript_utils.build_transcript(game_interactions, experiment_config,
-                                                                       game_instance, dialogue_pair)
-                        self.store_results_file(transcript, "transcript.html",
-                                                dialogue_pair,
-                                                sub_dir=rel_episode_path,
-                                                root_dir=results_root)
-                        transcript_tex = transcript_utils.build_tex(game_interactions)
-                        self.store_results_file(transcript_tex, "transcript.tex",
-                                                dialogue_pair,
-                                                sub_dir=rel_episode_path,
-                                                root_dir=results_root)
+                            game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
+                                                                       results_root, dialogue_pair)
+
+                            transcript = transcript_utils.build_transcript(game_interactions, experiment_config,
+                                                                           game_instance, dialogue_pair)
+                            self.store_results_file(transcript, "transcript.html",
+                                                    dialogue_pair,
+                                                    sub_dir=rel_episode_path,
+                                                    root_dir=results_root)
+                            transcript_tex = transcript_utils.build_tex(game_interactions)
+                            self.store_results_file(transcript_tex, "transcript.tex",
+                                                    dialogue_pair,
+                                                    sub_dir=rel_episode_path,
+                                                    root_dir=results_root)
                     except Exception:  # continue with other episodes if something goes wrong
                         self.logger.exception(f"{self.name}: Cannot transcribe {episode_dir} (but continue)")
                         error_count += 1
@@ -669,20 +791,18 @@ class GameBenchmark(GameResourceLocator):
 
     def compute_scores(self, results_dir: str = None):
         results_root = file_utils.results_root(results_dir)
-        dialogue_partners = [file for file in os.listdir(results_root)
-                             if os.path.isdir(os.path.join(results_root, file))]
+        store = results_store.open_store(results_root)
+        dialogue_partners = store.list_dirs()
         for dialogue_pair in dialogue_partners:
-            game_result_path = self.results_path_for(results_root, dialogue_pair)
-            if not os.path.exists(game_result_path) or not os.path.isdir(game_result_path):
+            if self.name not in store.list_dirs(dialogue_pair):
+                game_result_path = self.results_path_for(results_root, dialogue_pair)
                 stdout_logger.info("No results directory found at: " + game_result_path)
                 continue
 
-            experiment_dirs = [file for file in os.listdir(game_result_path)
-                               if os.path.isdir(os.path.join(game_result_path, file))]
+            experiment_dirs = store.list_dirs(results_store.rel_path_for(dialogue_pair, self.name))
             if not experiment_dirs:
                 stdout_logger.warning(f"{self.name}: No experiments for {dialogue_pair}")
             for experiment_dir in experiment_dirs:
-                experiment_path = os.path.join(game_result_path, experiment_dir)
                 experiment_name = "_".join(experiment_dir.split("_")[1:])  # remove leading index number
                 if self.filter_experiment and experiment_name not in self.filter_experiment:
                     stdout_logger.info(f"Skip experiment {experiment_name}")
@@ -690,20 +810,20 @@ class GameBenchmark(GameResourceLocator):
                 stdout_logger.info(f"Scoring: {experiment_name}")
                 experiment_config = self.load_results_json(f"{experiment_dir}/experiment_{experiment_name}",
                                                            results_root, dialogue_pair)
-                episode_dirs = [file for file in os.listdir(experiment_path)
-                                if os.path.isdir(os.path.join(experiment_path, file))]
+                episode_dirs = store.list_dirs(results_store.rel_path_for(dialogue_pair, self.name, experiment_dir))
                 error_count = 0
                 for episode_dir in tqdm(episode_dirs, desc="Scoring episodes"):
                     try:
-                        rel_episode_path = f"{experiment_dir}/{episode_dir}"
-                        game_instance = self.load_results_json(f"{rel_episode_path}/instance",
-                                                               results_root, dialogue_pair)
-                        game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
+                        with timing.span("scoring", game=self.name, experiment=experiment_name, model=dialogue_pair):
+                            rel_episode_path = f"{experiment_dir}/{episode_dir}"
+                            game_instance = self.load_results_json(f"{rel_episode_path}/instance",
                                                                    results_root, dialogue_pair)
+                            game_interactions = self.load_results_json(f"{rel_episode_path}/interactions",
+                                                                       results_root, dialogue_pair)
 
-                        game_scorer = self.create_game_scorer(experiment_config, game_instance)
-                        game_scorer.compute_scores(game_interactions)
-                        game_scorer.store_scores(results_root, dialogue_pair, rel_episode_path)
+                            game_scorer = self.create_game_scorer(experiment_config, game_instance)
+                            game_scorer.compute_scores(game_interactions)
+                            game_scorer.store_scores(results_root, dialogue_pair, rel_episode_path)
                     except Exception:  # continue with other episodes if something goes wrong
                         self.logger.exception(f"{self.name}: Cannot score {episode_dir} (but continue)")
                         error_count += 1
@@ -711,9 +831,11 @@ class GameBenchmark(GameResourceLocator):
                     stdout_logger.error(
                         f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
 
-    def run(self, player_models: List[Model], results_dir: str = None):
+    def run(self, player_models: List[Model], results_dir: str = None, num_samples: int = 1,
+            player_gen_args: List[Dict] = None, stream_records: bool = False, delta_requests: bool = False):
         """
-        Runs game-play on all game instances for a game.
+        Runs game-play on all game instances for a game. With num_samples > 1, each game instance is played several
+        times (one episode per sample); the samples share the first model call (see EpisodeFork).
         There must be an instances.json with the following structure:
         "experiments": [ # this is required
             {
@@ -727,6 +849,14 @@ class GameBenchmark(GameResourceLocator):
             }
         ]
 
+        The experiment can set generation arguments per player (in the order of the models given for the players), for
+        example "player_gen_args": [{"max_tokens": 20}, {"max_tokens": 200, "stop": ["END"]}]. These overwrite the
+        generation arguments of the models; the player_gen_args given as argument overwrite those of the experiment.
+
+        With stream_records, the interactions and calls of each episode are appended to JSONL files as they happen
+        (see GameRecorder.stream_records), so that a crash does not lose the episode. With delta_requests, the prompts
+        in requests.json are stored as the difference to an earlier prompt (see file_utils.delta_encode_requests).
+
         The instances will be automatically stored in "game-name" with the following structure:
             - results
                 - pairing
@@ -738,6 +868,7 @@ class GameBenchmark(GameResourceLocator):
                                 - interaction.json
         """
         results_root = "results" if results_dir is None else results_dir
+        run_usage: Dict[str, UsageByModel] = collections.defaultdict(UsageByModel)  # per dialogue pair
         experiments: List = self.instances["experiments"]
         if not experiments:
             self.logger.warning(f"{self.name}: No experiments for %s", self.name)
@@ -775,6 +906,9 @@ class GameBenchmark(GameResourceLocator):
                         message = f"Too many player for singe-player game '{self.name}': '{len(dialogue_partners)}'"
                         stdout_logger.error(message)
                         raise ValueError(message)
+                    # the players might have their own generation arguments (e.g. temperatures):
+                    dialogue_pair = with_player_gen_args(dialogue_pair, experiment.get("player_gen_args"),
+                                                         player_gen_args)
                     model_0 = dialogue_pair[0]
                     model_0 = f"{model_0.get_name()}-t{model_0.get_temperature()}"
                     # still we store to model--model dir (virtual self-play)
@@ -786,6 +920,9 @@ class GameBenchmark(GameResourceLocator):
                         raise ValueError(message)
                     if len(dialogue_pair) == 1:
                         dialogue_pair.append(dialogue_pair[0])  # model expansion
+                    # the players might have their own generation arguments (e.g. temperatures):
+                    dialogue_pair = with_player_gen_args(dialogue_pair, experiment.get("player_gen_args"),
+                                                         player_gen_args)
                     model_0 = dialogue_pair[0]
                     model_0 = f"{model_0.get_name()}-t{model_0.get_temperature()}"
                     model_1 = dialogue_pair[1]
@@ -802,6 +939,8 @@ class GameBenchmark(GameResourceLocator):
                 # Add some important infos to track
                 experiment_config["timestamp"] = datetime.now().isoformat()
                 experiment_config["dialogue_partners"] = dialogue_pair_desc
+                if num_samples > 1:
+                    experiment_config["num_samples"] = num_samples
 
                 self.store_results_file(experiment_config,
                                         f"experiment_{experiment_name}.json",
@@ -814,23 +953,43 @@ class GameBenchmark(GameResourceLocator):
                 game_instances: List = experiment["game_instances"]
                 for game_instance in tqdm(game_instances, desc="Playing games"):
                     game_id = game_instance["game_id"]
-                    self.logger.info("Activity: %s Experiment: %s Episode: %d Game: %s",
-                                     self.name, experiment_name, episode_counter, game_id)
-                    episode_dir = experiment_record_dir + f"/episode_{episode_counter}"
-                    self.store_results_file(game_instance,
-                                            f"instance.json",
-                                            dialogue_pair_desc,
-                                            sub_dir=episode_dir,
-                                            root_dir=results_root)
-                    try:
-                        game_master = self.create_game_master(experiment_config, dialogue_pair)
-                        game_master.setup(**game_instance)
-                        game_master.play()
-                        game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
-                    except Exception:  # continue with other episodes if something goes wrong
-                        self.logger.exception(f"{self.name}: Exception for episode {game_id} (but continue)")
-                        error_count += 1
-                    episode_counter += 1
+                    episode_fork = EpisodeFork(num_samples)
+                    for sample_idx in range(num_samples):
+                        self.logger.info("Activity: %s Experiment: %s Episode: %d Game: %s Sample: %d",
+                                         self.name, experiment_name, episode_counter, game_id, sample_idx)
+                        episode_dir = experiment_record_dir + f"/episode_{episode_counter}"
+                        self.store_results_file(game_instance,
+                                                f"instance.json",
+                                                dialogue_pair_desc,
+                                                sub_dir=episode_dir,
+                                                root_dir=results_root)
+                        game_master = None
+                        try:
+                            with timing.span("episode", game=self.name, experiment=experiment_name,
+                                             model=dialogue_pair_desc):
+                                with timing.span("setup"):
+                                    episode_models = dialogue_pair
+                                    if num_samples > 1:
+                                        episode_fork.start_sample(sample_idx)
+                                        episode_models = episode_fork.fork_models(dialogue_pair)
+                                    game_master = self.create_game_master(experiment_config, episode_models)
+                                    game_master.delta_requests = delta_requests
+                                    if stream_records:
+                                        game_master.stream_records(results_root, dialogue_pair_desc, episode_dir)
+                                    game_master.setup(**game_instance)
+                                with timing.span("play"):
+                                    game_master.play()
+                                game_master.store_records(results_root, dialogue_pair_desc, episode_dir)
+                            live_metrics.episode_finished(self.name)
+                        except Exception:  # continue with other episodes if something goes wrong
+                            self.logger.exception(f"{self.name}: Exception for episode {game_id} (but continue)")
+                            error_count += 1
+                            live_metrics.episode_finished(self.name, failed=True)
+                            if game_master is not None:  # keep what has been streamed so far
+                                game_master.close_records()
+                        if game_master is not None:  # the tokens of failed episodes have been used as well
+                            run_usage[dialogue_pair_desc].update(game_master.usage)
+                        episode_counter += 1
                 if error_count > 0:
                     stdout_logger.error(
                         f"{self.name}: '{error_count}' exceptions occurred: See clembench.log for details.")
@@ -842,6 +1001,22 @@ class GameBenchmark(GameResourceLocator):
                                         dialogue_pair_desc,
                                         sub_dir=experiment_record_dir,
                                         root_dir=results_root)
+        for dialogue_pair_desc, usage in run_usage.items():
+            self.store_usage(usage, dialogue_pair_desc, results_root)
+
+    def store_usage(self, usage: UsageByModel, dialogue_pair_desc: str, results_root: str):
+        """
+        Store the token usage of the run (of the game for the dialogue pair) as usage.json in the game directory.
+        """
+        if not usage:  # no backend reported usage (e.g. programmatic players)
+            return
+        usage_report = usage.to_dict()
+        usage_report["timestamp"] = datetime.now().isoformat()
+        self.store_results_file(usage_report, "usage.json", dialogue_pair_desc, root_dir=results_root)
+        for model_name, totals in usage_report["models"].items():
+            stdout_logger.info("%s: %s used %d prompt (%d cached) and %d completion tokens in %d calls (%s tokens/sec)",
+                               self.name, model_name, totals["prompt_tokens"], totals["cached_tokens"],
+                               totals["completion_tokens"], totals["calls"], totals["tokens_per_sec"])
 
     def is_single_player(self) -> bool:
         """
@@ -919,6 +1094,7 @@ class GameInstanceGenerator(GameResourceLocator):
 
 
 def load_benchmarks(do_setup: bool = True) -> List[GameBenchmark]:
+    clemgame.load_game_modules()
     game_benchmarks = []
     for gb_cls in GameBenchmark.__subclasses__():
         gb = gb_cls()  # subclasses should only get the model_name
@@ -937,9 +1113,39 @@ def load_benchmark(game_name: str, do_setup: bool = True, instances_name: str =
     return gm
 
 
-def find_benchmark(game_name: str):
+def load_game_descriptions() -> Dict[str, str]:
+    """
+    Collect the names and descriptions of the benchmark games. Registered games are not imported for this.
+    :return: a mapping of game names to game descriptions
+    """
+    game_descriptions = {game_name: game_entry["description"]
+                         for game_name, game_entry in clemgame.get_game_registry().items()}
+    for game_module in clemgame.list_game_modules():
+        if game_module not in game_descriptions:  # fallback to the game description of unregistered games
+            clemgame.load_game_module(game_module)
+    for gb_cls in GameBenchmark.__subclasses__():
+        gb = gb_cls()
+        if gb.name not in game_descriptions:
+            game_descriptions[gb.name] = gb.get_description()
+    return {game_name: game_description for game_name, game_description in game_descriptions.items()
+            if game_name not in GAMES_TO_IGNORE}
+
+
+def _find_loaded_benchmark(game_name: str):
     for gb_cls in GameBenchmark.__subclasses__():
         gb = gb_cls()  # subclasses should only get the dialog_pair
         if gb.applies_to(game_name):
             return gb
-    raise NotImplementedError("No game benchmark for:", game_name)
+    return None
+
+
+def find_benchmark(game_name: str):
+    if game_name in clemgame.list_game_modules():  # only import the game that is asked for
+        clemgame.load_game_module(game_name)
+    gb = _find_loaded_benchmark(game_name)
+    if gb is None:  # the game name might differ from the game directory name
+        clemgame.load_game_modules()
+        gb = _find_loaded_benchmark(game_name)
+    if gb is None:
+        raise NotImplementedError("No game benchmark for:", game_name)
+    return gb
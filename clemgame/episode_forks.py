@@ -0,0 +1,84 @@
+"""
+    Episode forks: Play n samples of the same game instance, which share everything up to the first model call.
+
+    The samples are played one after the other. Before the first model call, the game play of all samples is identical,
+    so that the first model call of the first sample requests n completions at once (e.g. OpenAI's n or HF's
+    num_return_sequences) and each sample continues with its own completion. Afterwards, the samples diverge and the
+    models are called as usual. This way, the shared prefix of the samples is only paid for once.
+"""
+import json
+from typing import List, Dict, Tuple, Any
+
+from backends import Model, ModelProxy, CustomResponseModel, HumanModel
+import clemgame
+
+logger = clemgame.get_logger(__name__)
+
+
+def _call_key(model: Model, messages: List[Dict]) -> str:
+    return json.dumps([model.get_name(), list(messages)], sort_keys=True)
+
+
+class EpisodeFork:
+    """
+    Shares the first model call between the samples of a game instance.
+    """
+
+    def __init__(self, num_samples: int):
+        self.num_samples = num_samples
+        self.sample_idx = -1
+        self.diverged = False  # whether the current sample has made its first model call
+        self._shared_call_key: str = None
+        self._shared_messages: List[Dict] = None  # a copy of the messages of the shared call
+        self._completions: List[Tuple[Any, Any, str]] = None
+
+    def start_sample(self, sample_idx: int):
+        self.sample_idx = sample_idx
+        self.diverged = False
+
+    def fork_models(self, player_models: List[Model]) -> List[Model]:
+        """
+        :return: the player models to play the current sample with (programmatic and human players are kept as is)
+        """
+        return [model if isinstance(model, (CustomResponseModel, HumanModel)) else ForkedModel(model, self)
+                for model in player_models]
+
+    def first_call(self, model: Model, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        """
+        The first model call of the current sample, at which the samples diverge.
+        """
+        self.diverged = True
+        call_key = _call_key(model, messages)
+        if self.sample_idx == 0:
+            self._shared_call_key = None
+            completions = model.generate_responses(messages, self.num_samples)
+            # the messages of the first sample keep growing, so that the prompts must not refer to them
+            self._shared_messages = list(messages)
+            self._completions = [(self._shared_messages if prompt is messages else prompt, response, response_text)
+                                 for prompt, response, response_text in completions]
+            self._shared_call_key = call_key  # only after the call succeeded
+        elif call_key != self._shared_call_key:  # the game play before the first call was not deterministic
+            logger.warning("Cannot share the first call of sample %d with the first sample (different messages)",
+                           self.sample_idx)
+            return model.generate_response(messages)
+        prompt, response, response_text = self._completions[self.sample_idx]
+        if prompt is self._shared_messages:  # the prompt are the messages (of this sample)
+            prompt = messages
+        if isinstance(response, dict):
+            response = dict(response, episode_fork={"sample": self.sample_idx, "num_samples": self.num_samples})
+        return prompt, response, response_text
+
+
+class ForkedModel(ModelProxy):
+    """
+    A proxy for a model that shares the first call of a sample via the EpisodeFork and otherwise calls the model.
+    """
+
+    def __init__(self, model: Model, fork: EpisodeFork):
+        super().__init__(model)
+        self.fork = fork
+
+    def generate_response(self, messages: List[Dict]) -> Tuple[Any, Any, str]:
+        if self.fork.diverged:
+            return super().generate_response(messages)
+        return self.fork.first_call(self, messages)
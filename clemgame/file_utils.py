@@ -1,8 +1,15 @@
-from typing import Dict
+from typing import Dict, List, Any
+import gzip
+import importlib.util
 import os
 import json
 import csv
 
+JSONL_BUFFER_SIZE = 64 * 1024
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+_results_compression: str = None  # the compression of the results files to be stored (None: uncompressed)
+DELTA_KEY = "__delta__"  # marks a prompt that is given as the difference to the prompt of an earlier call
+
 
 def project_root():
     return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -60,9 +67,109 @@ def load_file(file_name: str, game_name: str = None, file_ending: str = None) ->
     return data
 
 
+def set_results_compression(compression: str):
+    """
+    :param compression: of the results files to be stored: 'gzip', 'zstd' or None (uncompressed)
+    """
+    global _results_compression
+    if compression is not None and compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression '{compression}'. Choose one of {list(COMPRESSION_SUFFIXES.keys())}.")
+    if compression == "zstd" and importlib.util.find_spec("zstandard") is None:  # fail before the models are loaded
+        raise ValueError("The zstd compression requires the zstandard package: pip install zstandard")
+    _results_compression = compression
+
+
+def compressed_file_name(file_name: str) -> str:
+    """
+    :return: the name of a .json file with the suffix of the configured results compression (if any); other file
+             names, e.g. of the transcripts, as is
+    """
+    if _results_compression is None or not file_name.endswith(".json"):
+        return file_name
+    return file_name + COMPRESSION_SUFFIXES[_results_compression]
+
+
+def _compression_suffix(file_path: str) -> str:
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if file_path.endswith(suffix):
+            return suffix
+    return ""
+
+
+def _without_compression_suffix(file_path: str) -> str:
+    return file_path[:len(file_path) - len(_compression_suffix(file_path))]
+
+
+def _compression_variants(file_path: str) -> List[str]:
+    uncompressed_path = _without_compression_suffix(file_path)
+    return [uncompressed_path] + [uncompressed_path + suffix for suffix in COMPRESSION_SUFFIXES.values()]
+
+
+def _remove_other_variants(file_path: str):
+    # a stale version of the file with another compression (e.g. of an earlier run) would shadow or be shadowed by it
+    for variant_path in _compression_variants(file_path):
+        if variant_path != file_path and os.path.exists(variant_path):
+            os.remove(variant_path)
+
+
+def find_file(file_path: str) -> str:
+    """
+    :return: the path of the file or of its compressed version, if only that exists (otherwise the path as is)
+    """
+    for variant_path in _compression_variants(file_path):
+        if os.path.exists(variant_path):
+            return variant_path
+    return file_path
+
+
+def open_file(file_path: str, mode: str = "r"):
+    """
+    Open a text file; files ending with .gz or .zst are (de)compressed transparently.
+    :param file_path: of the file
+    :param mode: 'r', 'w' or 'a'
+    """
+    suffix = _compression_suffix(file_path)
+    if suffix == COMPRESSION_SUFFIXES["gzip"]:
+        return gzip.open(file_path, mode + "t", encoding="utf-8")
+    if suffix == COMPRESSION_SUFFIXES["zstd"]:
+        import zstandard  # optional dependency only needed for zstd compressed results
+        return zstandard.open(file_path, mode + "t", encoding="utf-8")
+    return open(file_path, mode, encoding="utf-8")
+
+
 def load_results_json(file_name: str, results_dir: str, dialogue_pair: str, game_name: str) -> Dict:
+    """
+    Load a results .json file (or its compressed version); if it does not exist, but its streamed .jsonl version (of
+    an episode that has not been finalized, e.g. because of a crash), then the records of the .jsonl file are read.
+    """
+    if file_name.endswith(".json"):
+        file_name = file_name[:-len(".json")]
+    game_results_dir = game_results_dir_for(results_dir, dialogue_pair, game_name)
+    jsonl_path = os.path.join(game_results_dir, file_name + ".jsonl")
+    json_path = find_file(os.path.join(game_results_dir, file_name + ".json"))
+    if not os.path.exists(json_path) and os.path.exists(jsonl_path):
+        return load_streamed_results(jsonl_path)
     data = __load_results_file(file_name, results_dir, dialogue_pair, game_name, file_ending=".json")
+    return parse_results_json(data)
+
+
+def load_streamed_results(jsonl_path: str) -> Any:
+    """
+    :return: the interactions (for interactions.jsonl) or the list of records of a streamed JSONL file
+    """
+    records = load_jsonl(jsonl_path)
+    if os.path.basename(jsonl_path) == "interactions.jsonl":
+        return interactions_from_records(records)
+    return records
+
+
+def parse_results_json(data: str) -> Any:
+    """
+    :return: the contents of a results .json file; delta encoded prompts are expanded
+    """
     data = json.loads(data)
+    if is_delta_encoded(data):
+        data = expand_requests(data)
     return data
 
 
@@ -71,8 +178,8 @@ def __load_results_file(file_name: str, results_dir: str, dialogue_pair: str, ga
     if file_ending and not file_name.endswith(file_ending):
         file_name = file_name + file_ending
     game_results_dir = game_results_dir_for(results_dir, dialogue_pair, game_name)
-    fp = os.path.join(game_results_dir, file_name)
-    with open(fp, encoding='utf8') as f:
+    fp = find_file(os.path.join(game_results_dir, file_name))
+    with open_file(fp) as f:
         data = f.read()
     return data
 
@@ -81,7 +188,7 @@ def store_game_results_file(data, file_name: str, dialogue_pair: str, game_name:
                             sub_dir: str = None, root_dir: str = None,
                             do_overwrite: bool = True) -> str:
     game_results_dir = game_results_dir_for(root_dir, dialogue_pair, game_name)
-    return store_file(data, file_name, game_results_dir, sub_dir, do_overwrite)
+    return store_file(data, compressed_file_name(file_name), game_results_dir, sub_dir, do_overwrite)
 
 
 def store_game_file(data, file_name: str, game_name: str, sub_dir: str = None, do_overwrite: bool = True) -> str:
@@ -91,7 +198,7 @@ def store_game_file(data, file_name: str, game_name: str, sub_dir: str = None, d
 def store_file(data, file_name: str, dir_path: str, sub_dir: str = None, do_overwrite: bool = True) -> str:
     """
     :param data: to store
-    :param file_name: of the file to store
+    :param file_name: of the file to store (compressed, if it ends with .gz or .zst)
     :param dir_path: to the directory to store to
     :param sub_dir: optional subdirectories
     :param do_overwrite: default: True
@@ -108,9 +215,148 @@ def store_file(data, file_name: str, dir_path: str, sub_dir: str = None, do_over
         if os.path.exists(fp):
             raise FileExistsError(fp)
 
-    with open(fp, "w", encoding='utf-8') as f:
-        if file_name.endswith(".json"):
+    with open_file(fp, "w") as f:
+        if _without_compression_suffix(file_name).endswith(".json"):
             json.dump(data, f, ensure_ascii=False)
         else:
             f.write(data)
+    _remove_other_variants(fp)
     return fp
+
+
+class JsonlAppender:
+    """
+    Appends records as lines to a new JSONL file. The writes are buffered until flush() is called. An existing file
+    (e.g. of a crashed earlier run of the same episode) is overwritten, so that its records are not mixed in.
+    """
+
+    def __init__(self, file_path: str, buffer_size: int = JSONL_BUFFER_SIZE):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file_path = file_path
+        self.num_records = 0
+        self._file = open(file_path, "w", encoding="utf-8", buffering=buffer_size)
+
+    def append(self, record: Any):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.num_records += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def load_jsonl(file_path: str) -> List:
+    """
+    :return: the records of the JSONL file; an incomplete last line (e.g. after a crash) is ignored
+    """
+    records = []
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                if line.endswith("\n"):  # only the last line may be incomplete
+                    raise
+    return records
+
+
+def jsonl_to_json_list(jsonl_path: str, json_path: str):
+    """
+    Convert a JSONL file into a .json file with the list of its records, line by line (without loading all records).
+    """
+    with open(jsonl_path, encoding="utf-8") as jsonl_file, open_file(json_path, "w") as json_file:
+        json_file.write("[")
+        separator = ""
+        for line in jsonl_file:
+            if not line.endswith("\n"):  # incomplete last line
+                break
+            json_file.write(separator + line.rstrip("\n"))
+            separator = ", "
+        json_file.write("]")
+    _remove_other_variants(json_path)
+
+
+def interactions_from_records(records: List[Dict]) -> Dict:
+    """
+    Assemble the interactions of an episode from the records streamed by the GameRecorder.
+    :param records: with either the 'players', a game-specific 'key' and its 'value', a 'next_turn' or an 'event' of a
+                    'turn'
+    :return: the interactions as stored in interactions.json
+    """
+    interactions = {"players": {}, "turns": []}
+    for record in records:
+        if "players" in record:
+            interactions["players"] = record["players"]
+        elif "key" in record:
+            interactions[record["key"]] = record["value"]
+        elif "next_turn" in record:
+            interactions["turns"].append([])
+        elif "event" in record:
+            interactions["turns"][record["turn"]].append(record["event"])
+    return interactions
+
+
+def _common_prefix_length(messages: List, other_messages: List) -> int:
+    length = 0
+    for message, other_message in zip(messages, other_messages):
+        if message != other_message:
+            break
+        length += 1
+    return length
+
+
+def delta_encode_requests(requests: List[Dict]) -> List[Dict]:
+    """
+    Encode the messages prompt of each call as the difference to the previous prompt of the same history (i.e. of the
+    same player, identified by the first message of the prompt), so that the shared messages are not stored again:
+        {"__delta__": {"base": <index of the previous call>, "keep": <number of its first messages>, "append": [...]}}
+    Each prompt is only compared with the previous one of its history, so that encoding takes linear time in the number
+    of calls. Other prompts (e.g. the prompt texts of local models) and the first prompt of a history are kept as is.
+    :param requests: the calls as stored in requests.json
+    :return: new calls with delta encoded prompts
+    """
+    encoded = []
+    last_call_of_history: Dict[str, int] = {}  # the first message of a history -> the index of its latest call
+    for call_idx, call_obj in enumerate(requests):
+        prompt = call_obj.get("manipulated_prompt_obj")
+        if not isinstance(prompt, list) or not prompt:
+            encoded.append(call_obj)
+            continue
+        history_key = json.dumps(prompt[0], sort_keys=True)
+        base_idx = last_call_of_history.get(history_key)
+        last_call_of_history[history_key] = call_idx
+        if base_idx is None:
+            encoded.append(call_obj)
+            continue
+        keep = _common_prefix_length(prompt, requests[base_idx]["manipulated_prompt_obj"])
+        delta = {"base": base_idx, "keep": keep, "append": prompt[keep:]}
+        encoded.append(dict(call_obj, manipulated_prompt_obj={DELTA_KEY: delta}))
+    return encoded
+
+
+def is_delta_encoded(data: Any) -> bool:
+    """
+    :return: whether the data are calls with at least one delta encoded prompt
+    """
+    return isinstance(data, list) and any(isinstance(call_obj, dict)
+                                          and isinstance(call_obj.get("manipulated_prompt_obj"), dict)
+                                          and DELTA_KEY in call_obj["manipulated_prompt_obj"] for call_obj in data)
+
+
+def expand_requests(requests: List[Dict]) -> List[Dict]:
+    """
+    :param requests: calls with delta encoded prompts (see delta_encode_requests)
+    :return: new calls with the full prompts
+    """
+    expanded = []
+    for call_obj in requests:
+        prompt = call_obj.get("manipulated_prompt_obj")
+        if isinstance(prompt, dict) and DELTA_KEY in prompt:
+            delta = prompt[DELTA_KEY]
+            base_prompt = expanded[delta["base"]]["manipulated_prompt_obj"]
+            call_obj = dict(call_obj, manipulated_prompt_obj=base_prompt[:delta["keep"]] + delta["append"])
+        expanded.append(call_obj)
+    return expanded
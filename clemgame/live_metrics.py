@@ -0,0 +1,244 @@
+"""
+    Live metrics: Watch a (multi-hour) run while it is going on, e.g. to tune the concurrency of the model calls.
+
+    Counts the completed and failed episodes per game, the calls in flight, the retries and rate limit (HTTP 429) errors
+    and the tokens per backend and model, and keeps the latencies of the most recent calls for their percentiles. The
+    metrics are exported in the Prometheus text format, either served over a local HTTP port (to be scraped by
+    Prometheus or to be looked at with curl) or written to a file that is rewritten periodically (e.g. for the textfile
+    collector of the node exporter).
+
+    The metrics are disabled by default (then the hooks cost next to nothing).
+"""
+import atexit
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Tuple, List
+
+import clemgame
+from backends import Model
+from backends.utils import RETRY_LISTENERS, is_rate_limit_error
+
+logger = clemgame.get_logger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_WINDOW = 1000  # the number of the most recent calls per backend and model for the latency percentiles
+QUANTILES = (0.5, 0.9, 0.99)
+
+_enabled = False
+_lock = threading.Lock()
+_episodes: Dict[Tuple[str, str], int] = defaultdict(int)  # (game, status) -> count
+_in_flight: Dict[Tuple[str, str], int] = defaultdict(int)  # (backend, model) -> calls
+_latencies: Dict[Tuple[str, str], deque] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+_latency_sums: Dict[Tuple[str, str], float] = defaultdict(float)
+_latency_counts: Dict[Tuple[str, str], int] = defaultdict(int)
+_retries: Dict[Tuple[str, str], int] = defaultdict(int)
+_rate_limited: Dict[Tuple[str, str], int] = defaultdict(int)
+_tokens: Dict[Tuple[str, str, str], int] = defaultdict(int)  # (backend, model, kind) -> tokens
+
+
+def enable():
+    global _enabled
+    _enabled = True
+    if _on_failed_attempt not in RETRY_LISTENERS:
+        RETRY_LISTENERS.append(_on_failed_attempt)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    if _on_failed_attempt in RETRY_LISTENERS:
+        RETRY_LISTENERS.remove(_on_failed_attempt)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        for metric in (_episodes, _in_flight, _latencies, _latency_sums, _latency_counts, _retries, _rate_limited,
+                       _tokens):
+            metric.clear()
+
+
+def _labels_of(model: Model) -> Tuple[str, str]:
+    """
+    :return: the backend and the name of the model
+    """
+    backend = model.model_spec["backend"] if model.model_spec.has_attr("backend") else "unknown"
+    return backend, model.get_name()
+
+
+@contextlib.contextmanager
+def model_call(model: Model):
+    """
+    Count the call as in flight during the with-block and record its latency (also of failed calls), if enabled.
+    """
+    if not _enabled:
+        yield
+        return
+    labels = _labels_of(model)
+    with _lock:
+        _in_flight[labels] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        latency = time.perf_counter() - start
+        with _lock:
+            _in_flight[labels] -= 1
+            _latencies[labels].append(latency)
+            _latency_sums[labels] += latency
+            _latency_counts[labels] += 1
+
+
+def record_usage(model: Model, usage: Dict):
+    """
+    :param usage: the normalized usage of a call (see backends.utils.normalized_usage)
+    """
+    if not _enabled:
+        return
+    backend, model_name = _labels_of(model)
+    with _lock:
+        for kind in ("prompt", "completion", "cached"):
+            _tokens[(backend, model_name, kind)] += usage.get(f"{kind}_tokens", 0)
+
+
+def episode_finished(game_name: str, failed: bool = False):
+    if not _enabled:
+        return
+    with _lock:
+        _episodes[(game_name, "failed" if failed else "completed")] += 1
+
+
+def _on_failed_attempt(model: Model, error: Exception, will_retry: bool):
+    labels = _labels_of(model)
+    with _lock:
+        if will_retry:
+            _retries[labels] += 1
+        if is_rate_limit_error(error):
+            _rate_limited[labels] += 1
+
+
+def _quantile(sorted_values: List[float], quantile: float) -> float:
+    """ the nearest-rank percentile """
+    return sorted_values[max(0, math.ceil(quantile * len(sorted_values)) - 1)]
+
+
+def _format_labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def to_prometheus_text() -> str:
+    """
+    :return: the metrics in the Prometheus text exposition format
+    """
+    lines = []
+
+    def add_metric(name: str, metric_type: str, help_text: str, samples: List[Tuple[str, Dict, float]]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_format_labels(**labels)} {value}")
+
+    with _lock:
+        add_metric("clem_episodes_total", "counter", "The finished episodes by game and status (completed or failed).",
+                   [("clem_episodes_total", {"game": game, "status": status}, count)
+                    for (game, status), count in sorted(_episodes.items())])
+        add_metric("clem_calls_in_flight", "gauge", "The model calls that are waiting for a response.",
+                   [("clem_calls_in_flight", {"backend": backend, "model": model}, count)
+                    for (backend, model), count in sorted(_in_flight.items())])
+        latency_samples = []
+        for (backend, model), latencies in sorted(_latencies.items()):
+            sorted_latencies = sorted(latencies)
+            latency_samples.extend(("clem_call_latency_seconds",
+                                    {"backend": backend, "model": model, "quantile": quantile},
+                                    round(_quantile(sorted_latencies, quantile), 6)) for quantile in QUANTILES)
+            labels = {"backend": backend, "model": model}
+            latency_samples.append(("clem_call_latency_seconds_sum", labels, round(_latency_sums[(backend, model)], 6)))
+            latency_samples.append(("clem_call_latency_seconds_count", labels, _latency_counts[(backend, model)]))
+        add_metric("clem_call_latency_seconds", "summary",
+                   f"The latency of the model calls (percentiles of the last {LATENCY_WINDOW} calls).", latency_samples)
+        add_metric("clem_call_retries_total", "counter", "The retried model calls.",
+                   [("clem_call_retries_total", {"backend": backend, "model": model}, count)
+                    for (backend, model), count in sorted(_retries.items())])
+        add_metric("clem_rate_limited_total", "counter", "The model calls rejected with HTTP 429 (Too Many Requests).",
+                   [("clem_rate_limited_total", {"backend": backend, "model": model}, count)
+                    for (backend, model), count in sorted(_rate_limited.items())])
+        add_metric("clem_tokens_total", "counter", "The tokens of the model calls (prompt, completion or cached).",
+                   [("clem_tokens_total", {"backend": backend, "model": model, "kind": kind}, count)
+                    for (backend, model, kind), count in sorted(_tokens.items())])
+        throughput_samples = []
+        for (backend, model), latency_sum in sorted(_latency_sums.items()):
+            tokens = _tokens.get((backend, model, "prompt"), 0) + _tokens.get((backend, model, "completion"), 0)
+            throughput_samples.append(("clem_tokens_per_second", {"backend": backend, "model": model},
+                                       round(tokens / latency_sum, 2) if latency_sum > 0 else 0))
+        add_metric("clem_tokens_per_second", "gauge",
+                   "The prompt and completion tokens per second of the model calls so far.", throughput_samples)
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = to_prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # no access log on stderr
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve the metrics at http://<host>:<port>/metrics (any path) from a background thread.
+    :param port: to listen on; 0 to choose a free port (see server.server_address)
+    :param host: to listen on; only the local host by default
+    :return: the server (to be shut down with server.shutdown())
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Serving the live metrics at http://%s:%d/metrics", *server.server_address[:2])
+    return server
+
+
+def write_file(file_path: str):
+    """
+    Write the metrics to the file atomically (via a temporary file), so that a reader never sees a partial file.
+    """
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(to_prometheus_text())
+    os.replace(tmp_path, file_path)
+
+
+def start_file_writer(file_path: str, interval: float = 15.0) -> threading.Event:
+    """
+    Rewrite the metrics file periodically from a background thread and once more at exit.
+    :param file_path: of the metrics file, e.g. clembench.prom
+    :param interval: between the writes in seconds
+    :return: an event that stops the writer when set
+    """
+    stopped = threading.Event()
+
+    def write_periodically():
+        while not stopped.wait(interval):
+            write_file(file_path)
+
+    write_file(file_path)
+    threading.Thread(target=write_periodically, name="metrics-file", daemon=True).start()
+    atexit.register(write_file, file_path)
+    logger.info("Writing the live metrics to %s every %.0fs", file_path, interval)
+    return stopped
@@ -0,0 +1,251 @@
+"""
+    Results stores: Where the results files of a run (experiment, instance, interactions, requests, scores and
+    transcripts) are kept.
+
+    The DirectoryStore keeps the usual directory layout with one file per artifact. The SQLiteStore keeps all artifacts
+    of a run in a single SQLite file with one row per artifact (indexed by dialogue pair, game, experiment and episode),
+    which is much faster to copy, sync and scan than many small files. The store is chosen by the results dir: a path
+    ending with .sqlite or .db refers to an SQLite store, e.g. `-r results/run.sqlite`.
+
+    The artifacts are addressed by their path relative to the results root, always separated by '/', e.g.
+    'pair/game/0_experiment/episode_0/interactions.json'.
+"""
+import abc
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Iterator, Tuple, Any
+
+from clemgame import file_utils
+
+SQLITE_SUFFIXES = (".sqlite", ".db")
+# the indexed columns of the SQLiteStore with the names of the directory levels of an artifact:
+DIR_COLUMNS = ("dialogue_pair", "game", "experiment", "episode")
+
+_stores: Dict[str, "ResultsStore"] = {}
+
+
+def is_sqlite_store(results_dir: str) -> bool:
+    return results_dir is not None and str(results_dir).endswith(SQLITE_SUFFIXES)
+
+
+def open_store(results_dir: str = None) -> "ResultsStore":
+    """
+    :param results_dir: the results root directory or the path to an SQLite file (ending with .sqlite or .db)
+    :return: the store of the results (the same instance for the same results dir)
+    """
+    results_root = file_utils.results_root(results_dir)
+    if results_root not in _stores:
+        if is_sqlite_store(results_root):
+            _stores[results_root] = SQLiteStore(results_root)
+        else:
+            _stores[results_root] = DirectoryStore(results_root)
+    return _stores[results_root]
+
+
+def close_stores():
+    for store in _stores.values():
+        store.close()
+    _stores.clear()
+
+
+def rel_path_for(*parts: str) -> str:
+    """
+    :return: the path relative to the results root of the given parts (which can be sub-paths or None)
+    """
+    return "/".join(part.strip("/") for part in parts if part)
+
+
+class ResultsStore(abc.ABC):
+    """
+    Stores and loads the artifacts of the runs in a results root.
+    """
+
+    def __init__(self, results_root: str):
+        self.results_root = results_root
+
+    @abc.abstractmethod
+    def store_file(self, data, rel_path: str) -> str:
+        """
+        :param data: to store; the data of .json files is stored as json, other data as text
+        :param rel_path: of the artifact
+        :return: the location of the stored artifact
+        """
+        pass
+
+    @abc.abstractmethod
+    def load_text(self, rel_path: str) -> str:
+        """
+        :return: the stored text of the artifact or None, if it does not exist
+        """
+        pass
+
+    @abc.abstractmethod
+    def list_dirs(self, rel_dir: str = None) -> List[str]:
+        """
+        :return: the names of the directories in the directory (the root, if not given), e.g. the episode directories
+        """
+        pass
+
+    @abc.abstractmethod
+    def find_files(self, file_name: str) -> List[str]:
+        """
+        :return: the paths of all artifacts with the name, e.g. of all scores.json files
+        """
+        pass
+
+    @abc.abstractmethod
+    def stream_dir(self, rel_dir: str) -> str:
+        """
+        :return: the file system directory for the JSONL files of an episode that streams its records
+        """
+        pass
+
+    def store_results_file(self, data, file_name: str, dialogue_pair: str, game_name: str, sub_dir: str = None) -> str:
+        return self.store_file(data, rel_path_for(dialogue_pair, game_name, sub_dir, file_name))
+
+    def load_results_json(self, file_name: str, dialogue_pair: str, game_name: str) -> Any:
+        return self.load_json(rel_path_for(dialogue_pair, game_name, file_name))
+
+    def load_json(self, rel_path: str) -> Any:
+        """
+        Load a .json artifact; if it does not exist, but its streamed .jsonl version (of an episode that has not been
+        finalized), then the records of the .jsonl file are read. Delta encoded prompts are expanded.
+        """
+        if not rel_path.endswith(".json"):
+            rel_path = rel_path + ".json"
+        data = self.load_text(rel_path)
+        if data is None:
+            rel_dir, file_name = os.path.split(rel_path)
+            jsonl_path = os.path.join(self.stream_dir(rel_dir), file_name + "l")
+            if os.path.exists(jsonl_path):
+                return file_utils.load_streamed_results(jsonl_path)
+            raise FileNotFoundError(f"{rel_path} not found in {self.results_root}")
+        return file_utils.parse_results_json(data)
+
+    def close(self):
+        pass
+
+
+class DirectoryStore(ResultsStore):
+    """
+    One file per artifact in nested directories (compressed, if configured; see file_utils.set_results_compression).
+    """
+
+    def _path(self, rel_path: str) -> str:
+        return os.path.join(self.results_root, *rel_path.split("/")) if rel_path else self.results_root
+
+    def store_file(self, data, rel_path: str) -> str:
+        rel_dir, file_name = os.path.split(rel_path)
+        return file_utils.store_file(data, file_utils.compressed_file_name(file_name), self._path(rel_dir))
+
+    def load_text(self, rel_path: str) -> str:
+        fp = file_utils.find_file(self._path(rel_path))
+        if not os.path.exists(fp):
+            return None
+        with file_utils.open_file(fp) as f:
+            return f.read()
+
+    def list_dirs(self, rel_dir: str = None) -> List[str]:
+        dir_path = self._path(rel_dir)
+        if not os.path.isdir(dir_path):
+            return []
+        return [file for file in os.listdir(dir_path) if os.path.isdir(os.path.join(dir_path, file))]
+
+    def find_files(self, file_name: str) -> List[str]:
+        file_names = [file_name] + [file_name + suffix for suffix in file_utils.COMPRESSION_SUFFIXES.values()]
+        rel_paths = []
+        for dir_path, _, dir_file_names in os.walk(self.results_root):
+            rel_dir = os.path.relpath(dir_path, self.results_root).replace(os.sep, "/")
+            rel_paths.extend(rel_path_for("" if rel_dir == "." else rel_dir, name[:len(file_name)])
+                             for name in dir_file_names if name in file_names)
+        return rel_paths
+
+    def stream_dir(self, rel_dir: str) -> str:
+        return self._path(rel_dir)
+
+
+class SQLiteStore(ResultsStore):
+    """
+    All artifacts of a run in a single SQLite file. Each stored artifact is committed right away, so that a crashed
+    run keeps its finished episodes. Episodes that stream their records keep the JSONL files in a directory next to the
+    SQLite file (<file>.streams) until they are finalized.
+    """
+
+    def __init__(self, results_root: str):
+        super().__init__(results_root)
+        db_dir = os.path.dirname(results_root)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(results_root, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS artifacts (path TEXT PRIMARY KEY, "
+                                     "dialogue_pair TEXT NOT NULL, game TEXT, experiment TEXT, episode TEXT, "
+                                     "name TEXT NOT NULL, data TEXT NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS artifacts_episode "
+                                     "ON artifacts (dialogue_pair, game, experiment, episode)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS artifacts_name ON artifacts (name)")
+
+    def store_file(self, data, rel_path: str) -> str:
+        parts = rel_path.split("/")
+        # pair/game/experiment_dir/experiment.json or pair/game/experiment_dir/episode_dir/.../file
+        experiment = parts[2] if len(parts) > 3 else None
+        episode = parts[3] if len(parts) > 4 else None
+        game = parts[1] if len(parts) > 2 else None
+        if parts[-1].endswith(".json"):
+            data = json.dumps(data, ensure_ascii=False)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (rel_path, parts[0], game, experiment, episode, parts[-1], data))
+        return f"{self.results_root}:{rel_path}"
+
+    def load_text(self, rel_path: str) -> str:
+        with self._lock:
+            row = self._connection.execute("SELECT data FROM artifacts WHERE path = ?", (rel_path,)).fetchone()
+        return row[0] if row is not None else None
+
+    def list_dirs(self, rel_dir: str = None) -> List[str]:
+        parent_names = rel_dir.strip("/").split("/") if rel_dir else []
+        if len(parent_names) >= len(DIR_COLUMNS):  # below the episode dirs (no column): the paths with the prefix
+            return self._list_dirs_by_path(rel_dir)
+        dir_column = DIR_COLUMNS[len(parent_names)]
+        conditions = [f"{column} = ?" for column in DIR_COLUMNS[:len(parent_names)]]
+        # the columns of the dirs below the dialogue pair are only set for artifacts in (sub dirs of) these dirs:
+        if dir_column == "dialogue_pair":  # ... but the dialogue pair is also set for the files in the results root
+            query = ("SELECT dialogue_pair FROM artifacts WHERE game IS NOT NULL "
+                     "UNION SELECT dialogue_pair FROM artifacts WHERE game IS NULL AND path != dialogue_pair")
+        else:
+            query = (f"SELECT DISTINCT {dir_column} FROM artifacts "
+                     f"WHERE {' AND '.join(conditions)} AND {dir_column} IS NOT NULL")
+        with self._lock:
+            rows = self._connection.execute(query + f" ORDER BY {dir_column}", parent_names).fetchall()
+        return [dir_name for dir_name, in rows]
+
+    def _list_dirs_by_path(self, rel_dir: str) -> List[str]:
+        prefix = rel_dir.strip("/") + "/"
+        with self._lock:
+            # the paths starting with the prefix (a range on the primary key index)
+            rows = self._connection.execute("SELECT path FROM artifacts WHERE path >= ? AND path < ?",
+                                            (prefix, prefix + "\uffff")).fetchall()
+        dir_names = {path[len(prefix):].split("/")[0] for path, in rows if "/" in path[len(prefix):]}
+        return sorted(dir_names)
+
+    def find_files(self, file_name: str) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute("SELECT path FROM artifacts WHERE name = ? ORDER BY path",
+                                            (file_name,)).fetchall()
+        return [path for path, in rows]
+
+    def stream_dir(self, rel_dir: str) -> str:
+        return os.path.join(self.results_root + ".streams", *rel_dir.split("/"))
+
+    def iter_artifacts(self) -> Iterator[Tuple[str, str]]:
+        """
+        :return: the path and the stored text of each artifact (ordered by path)
+        """
+        return iter(self._connection.execute("SELECT path, data FROM artifacts ORDER BY path"))
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,147 @@
+"""
+    Timing spans: Where the wall time of a run goes, e.g. the overhead of the game master versus the model latency.
+
+    A span measures a step of the game loop with time.perf_counter(), e.g. the setup of an episode, a prompt, a
+    backend call, the validation and parsing of a response, storing the records, scoring or building a transcript.
+    Spans are nested (per thread): a span started within another span is its child and inherits its attributes (the
+    game, experiment and model), so that the spans can be aggregated per game, experiment and model.
+
+    Timing is disabled by default (then span() costs next to nothing). The spans can be exported as Chrome trace-event
+    JSON (to be opened with chrome://tracing or https://ui.perfetto.dev) and summarized as a table.
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+_enabled = False
+_spans: List["Span"] = []
+_local = threading.local()  # the stack of the open spans of a thread
+
+
+class Span:
+    __slots__ = ("name", "attributes", "start", "duration", "children_duration", "depth", "thread_id")
+
+    def __init__(self, name: str, attributes: Dict, start: float, depth: int, thread_id: int):
+        self.name = name
+        self.attributes = attributes
+        self.start = start
+        self.duration = 0.0
+        self.children_duration = 0.0
+        self.depth = depth
+        self.thread_id = thread_id
+
+    @property
+    def self_duration(self) -> float:
+        """ the duration without the durations of the child spans """
+        return self.duration - self.children_duration
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    _spans.clear()
+
+
+def get_spans() -> List[Span]:
+    return list(_spans)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+    Measure the wall time of the with-block, if timing is enabled.
+    :param name: of the step, e.g. 'backend_call'
+    :param attributes: e.g. game, experiment, model; overwrite those inherited from the enclosing span
+    """
+    if not _enabled:
+        yield
+        return
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    if parent is not None:
+        attributes = dict(parent.attributes, **attributes)
+    current = Span(name, attributes, time.perf_counter(), len(stack), threading.get_ident())
+    stack.append(current)
+    try:
+        yield
+    finally:
+        current.duration = time.perf_counter() - current.start
+        stack.pop()
+        if parent is not None:
+            parent.children_duration += current.duration
+        _spans.append(current)
+
+
+def to_chrome_trace(spans: List[Span] = None) -> Dict:
+    """
+    :return: the spans as complete events ('ph': 'X') of the Chrome trace-event format; timestamps in microseconds
+    """
+    spans = _spans if spans is None else spans
+    time_origin = min((s.start for s in spans), default=0.0)
+    pid = os.getpid()
+    events = [{"name": s.name, "cat": s.attributes.get("game", "clembench"), "ph": "X",
+               "ts": (s.start - time_origin) * 1e6, "dur": s.duration * 1e6, "pid": pid, "tid": s.thread_id,
+               "args": {key: str(value) for key, value in s.attributes.items()}}
+              for s in sorted(spans, key=lambda s: s.start)]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(file_path: str, spans: List[Span] = None):
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(to_chrome_trace(spans), f)
+
+
+def summarize(group_by: Tuple[str, ...] = ("game", "model"), spans: List[Span] = None) -> List[Dict]:
+    """
+    Aggregate the spans by their name and the given attributes.
+    :return: a row per group with the 'count', the 'total' and 'self' duration (without the child spans) in seconds,
+             the 'mean' duration in seconds and the 'share' of the total self duration of all spans (the wall time
+             of the measured steps)
+    """
+    spans = _spans if spans is None else spans
+    groups = defaultdict(list)
+    for s in spans:
+        groups[tuple(s.attributes.get(key, "") for key in group_by) + (s.name,)].append(s)
+    wall_time = sum(s.self_duration for s in spans) or 1.0
+    rows = []
+    for key, group in groups.items():
+        total = sum(s.duration for s in group)
+        self_total = sum(s.self_duration for s in group)
+        row = dict(zip(group_by, key))
+        row.update({"span": key[-1], "count": len(group), "total": total, "self": self_total,
+                    "mean": total / len(group), "share": self_total / wall_time})
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["self"], reverse=True)
+
+
+def summary_table(group_by: Tuple[str, ...] = ("game", "model"), spans: List[Span] = None) -> str:
+    """
+    :return: the summary of the spans as a text table (see summarize)
+    """
+    rows = summarize(group_by, spans)
+    widths = [max([len(key)] + [len(str(row[key])) for row in rows]) for key in group_by + ("span",)]
+    header = "".join(f"{key:<{width + 2}}" for key, width in zip(group_by + ("span",), widths))
+    lines = [header + f"{'count':>8}{'total (s)':>12}{'self (s)':>12}{'mean (ms)':>12}{'self %':>8}"]
+    for row in rows:
+        line = "".join(f"{str(row[key]):<{width + 2}}" for key, width in zip(group_by + ("span",), widths))
+        lines.append(line + f"{row['count']:>8}{row['total']:>12.3f}{row['self']:>12.3f}"
+                            f"{row['mean'] * 1000:>12.2f}{row['share'] * 100:>8.1f}")
+    return "\n".join(lines)
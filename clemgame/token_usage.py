@@ -0,0 +1,98 @@
+"""
+    Token usage: The prompt, completion and cached tokens of the model calls, summed up per player, episode and run.
+
+    The backends add the normalized usage of each call to its raw response (see backends.utils.normalized_usage). The
+    totals also sum up the durations of the calls, so that the throughput (tokens/sec) can be compared across backends.
+"""
+from collections import defaultdict
+from typing import Dict, Any
+
+from backends.utils import USAGE_KEY
+
+TOKEN_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+class UsageTotals:
+    """
+    The sum of the token usage and the durations of model calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.duration = 0.0  # seconds
+
+    def add(self, usage: Dict, duration: float = 0.0):
+        """
+        :param usage: the normalized usage of a call
+        :param duration: of the call in seconds
+        """
+        self.calls += 1
+        for key in TOKEN_KEYS:
+            setattr(self, key, getattr(self, key) + usage.get(key, 0))
+        self.duration += duration
+
+    def update(self, other: "UsageTotals"):
+        self.calls += other.calls
+        for key in TOKEN_KEYS:
+            setattr(self, key, getattr(self, key) + getattr(other, key))
+        self.duration += other.duration
+
+    def to_dict(self) -> Dict:
+        """
+        :return: the totals with the 'tokens_per_sec' (prompt and completion tokens) and the 'completion_tokens_per_sec'
+                 over the durations of the calls
+        """
+        total_tokens = self.prompt_tokens + self.completion_tokens
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "total_tokens": total_tokens,
+            "duration": round(self.duration, 3),
+            "tokens_per_sec": round(total_tokens / self.duration, 2) if self.duration > 0 else None,
+            "completion_tokens_per_sec": round(self.completion_tokens / self.duration, 2) if self.duration > 0 else None
+        }
+
+
+class UsageByModel:
+    """
+    The token usage per model (e.g. of the two players of an episode or of all episodes of a run).
+    """
+
+    def __init__(self):
+        self.models: Dict[str, UsageTotals] = defaultdict(UsageTotals)
+
+    def __bool__(self):
+        return bool(self.models)
+
+    def add_response(self, response: Any) -> bool:
+        """
+        Add the usage of a call by the raw response of a player (with the 'clem_player' metadata).
+        :return: False, if the response has no usage (e.g. of a programmatic player)
+        """
+        if not isinstance(response, dict) or "clem_player" not in response or not response.get(USAGE_KEY):
+            return False
+        clem_player = response["clem_player"]
+        self.models[clem_player["model_name"]].add(response[USAGE_KEY], clem_player.get("call_seconds", 0.0))
+        return True
+
+    def update(self, other: "UsageByModel"):
+        for model_name, totals in other.models.items():
+            self.models[model_name].update(totals)
+
+    def total(self) -> UsageTotals:
+        total = UsageTotals()
+        for totals in self.models.values():
+            total.update(totals)
+        return total
+
+    def to_dict(self) -> Dict:
+        """
+        :return: the 'total' and the totals of the 'models'
+        """
+        return {"total": self.total().to_dict(),
+                "models": {model_name: totals.to_dict() for model_name, totals in sorted(self.models.items())}}
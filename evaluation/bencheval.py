@@ -12,6 +12,7 @@ import pandas as pd
 
 import evaluation.evalutils as utils
 import clemgame.metrics as clemmetrics
+from clemgame import results_store
 
 TABLE_NAME = 'results'
 
@@ -92,8 +93,12 @@ if __name__ == '__main__':
     parser.add_argument("-p", "--results_path",
                         type=str,
                         default='./results',
-                        help="Path to the results folder containing scores.")
+                        help="Path to the results folder containing scores (or to an SQLite run archive, then the "
+                             "tables are saved next to it).")
     args = parser.parse_args()
+    output_path = Path(args.results_path)
+    if results_store.is_sqlite_store(args.results_path):
+        output_path = output_path.parent
 
     # Get all episode scores as a pandas dataframe
     scores = utils.load_scores(path=args.results_path)
@@ -109,8 +114,8 @@ if __name__ == '__main__':
     df_episode_scores = pd.concat([df_episode_scores, aux], ignore_index=True)
 
     # save raw scores
-    df_episode_scores.to_csv(Path(args.results_path) / f'raw.csv')
-    print(f'\n Saved raw scores into {args.results_path}/raw.csv')
+    df_episode_scores.to_csv(output_path / f'raw.csv')
+    print(f'\n Saved raw scores into {output_path}/raw.csv')
 
     # save main table
-    save_clem_table(df_episode_scores, args.results_path)
+    save_clem_table(df_episode_scores, str(output_path))
@@ -12,6 +12,7 @@ import seaborn as sns
 from tqdm import tqdm
 
 import clemgame.metrics as clemmetrics
+from clemgame import file_utils, results_store
 
 EVAL_DIR = 'results_eval'
 RESULTS_DIR = './results'
@@ -152,16 +153,26 @@ def name_as_tuple(name: str) -> tuple:
 
 
 def load_json(path: str) -> dict:
-    """Load a json file."""
-    with open(path, 'r') as file:
+    """Load a json file (or its compressed version .json.gz or .json.zst)."""
+    with file_utils.open_file(file_utils.find_file(str(path))) as file:
         data = json.load(file)
     return data
 
 
+def find_results_files(path: str, file_name: str) -> list:
+    """Find the results files with the given name, uncompressed or compressed."""
+    patterns = [file_name] + [file_name + suffix for suffix in file_utils.COMPRESSION_SUFFIXES.values()]
+    return [file for pattern in patterns for file in Path(path).rglob(pattern)]
+
+
 def load_scores(game_name: str = None, path: str = RESULTS_DIR) -> dict:
     """Get all turn and episodes scores and return them in a dictionary."""
     # https://stackoverflow.com/a/18394205
-    score_files = list(Path(path).rglob("*scores.json"))
+    if results_store.is_sqlite_store(path):  # a run archive
+        store = results_store.open_store(os.path.abspath(path))
+        score_files, load = store.find_files("scores.json"), store.load_json
+    else:
+        score_files, load = find_results_files(path, "*scores.json"), load_json
     print(f'Loading {len(score_files)} JSON files.')
     scores = {}
     for path in tqdm(score_files, desc="Loading scores"):
@@ -170,7 +181,7 @@ def load_scores(game_name: str = None, path: str = RESULTS_DIR) -> dict:
                 continue
         naming = name_as_tuple(parse_directory_name(path))
         if naming not in scores:
-            data = load_json(path)
+            data = load(path)
             scores[naming] = {}
             scores[naming]['turns'] = data['turn scores']
             scores[naming]['episodes'] = data['episode scores']
@@ -183,7 +194,11 @@ def load_scores(game_name: str = None, path: str = RESULTS_DIR) -> dict:
 def load_interactions(game_name: str = None) -> dict:
     """Get all interaction records and return them in a dictionary."""
     # https://stackoverflow.com/a/18394205
-    interaction_files = list(Path(RESULTS_DIR).rglob("*interactions.json"))
+    if results_store.is_sqlite_store(RESULTS_DIR):  # a run archive
+        store = results_store.open_store(os.path.abspath(RESULTS_DIR))
+        interaction_files, load = store.find_files("interactions.json"), store.load_json
+    else:
+        interaction_files, load = find_results_files(RESULTS_DIR, "*interactions.json"), load_json
     print(f'Loading {len(interaction_files)} JSON files.')
     interactions = {}
     for path in tqdm(interaction_files, desc="Loading interactions"):
@@ -192,8 +207,8 @@ def load_interactions(game_name: str = None) -> dict:
                 continue
         naming = name_as_tuple(parse_directory_name(path))
         if naming not in interactions:
-            data = load_json(path)
-            instance = load_json(str(path).replace('interactions.json', 'instance.json'))
+            data = load(path)
+            instance = load(os.path.join(os.path.dirname(path), 'instance.json'))
             interactions[naming] = (data, instance)
         else:
             print(f'Repeated file {naming}!')
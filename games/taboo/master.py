@@ -9,18 +9,31 @@ from clemgame.metrics import METRIC_ABORTED, METRIC_SUCCESS, METRIC_LOSE, METRIC
 from clemgame import get_logger
 from clemgame import file_utils, string_utils
 
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem.snowball import SnowballStemmer
+GAME_NAME = "taboo"
 
-nltk.download('stopwords', quiet=True)
-EN_STOPWORDS = stopwords.words('english')
+logger = get_logger(__name__)
 
-EN_STEMMER = SnowballStemmer("english")
+# nltk and its corpora are loaded on first use (and not when the game module is imported)
+_EN_STOPWORDS: List[str] = None
+_EN_STEMMER = None
 
-GAME_NAME = "taboo"
 
-logger = get_logger(__name__)
+def get_en_stopwords() -> List[str]:
+    global _EN_STOPWORDS
+    if _EN_STOPWORDS is None:
+        import nltk
+        from nltk.corpus import stopwords
+        nltk.download('stopwords', quiet=True)
+        _EN_STOPWORDS = stopwords.words('english')
+    return _EN_STOPWORDS
+
+
+def get_en_stemmer():
+    global _EN_STEMMER
+    if _EN_STEMMER is None:
+        from nltk.stem.snowball import SnowballStemmer
+        _EN_STEMMER = SnowballStemmer("english")
+    return _EN_STEMMER
 
 
 class WordGuesser(Player):
@@ -47,13 +60,15 @@ class WordDescriber(Player):
 
 
 def check_clue(clue: str, target_word: str, related_words: List[str],
-               stemmer=EN_STEMMER, return_clue=False) -> Union[Tuple[str, List[Dict]], List[Dict]]:
+               stemmer=None, return_clue=False) -> Union[Tuple[str, List[Dict]], List[Dict]]:
+    if stemmer is None:
+        stemmer = get_en_stemmer()
     clue = clue.replace("CLUE:", "")
     clue = clue.strip()
     clue = clue.lower()
     clue = string_utils.remove_punctuation(clue)
     clue_words = clue.split(" ")
-    clue_words = [clue_word for clue_word in clue_words if clue_word not in EN_STOPWORDS]
+    clue_words = [clue_word for clue_word in clue_words if clue_word not in get_en_stopwords()]
     clue_word_stems = [stemmer.stem(clue_word) for clue_word in clue_words]
     errors = []
     target_word_stem = stemmer.stem(target_word)
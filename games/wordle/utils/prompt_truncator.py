@@ -1,7 +1,5 @@
-import tiktoken
-import openai
-
 import backends
+from backends.token_counting import tiktoken_counter
 
 NAME = "openai"
 
@@ -14,22 +12,9 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
         "text-davinci-003",
     ]
     """Returns the number of tokens used by a list of messages."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
     if model in supported_models:  # note: future models may deviate from this
-        num_tokens = 0
-        for message in messages:
-            num_tokens += (
-                4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
-            )
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":  # if there's a name, the role is omitted
-                    num_tokens += -1  # role is always required and always 1 token
-        num_tokens += 2  # every reply is primed with <im_start>assistant
-        return num_tokens
+        # the encoding is cached per model and the token counts per message, so only new messages are tokenized
+        return tiktoken_counter(model).count_messages(messages)
     else:
         raise NotImplementedError(
             f"""num_tokens_from_messages() is not presently implemented for model {model}."""
@@ -75,6 +60,7 @@ def test_counting():
             f"{num_tokens_from_messages(messages, model)} prompt tokens counted by num_tokens_from_messages()."
         )
         # example token count from the OpenAI API
+        import openai
         creds = backends.load_credentials(NAME)
         if "organisation" in creds[NAME]:
             openai.organization = creds[NAME]["organisation"]
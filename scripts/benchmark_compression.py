@@ -0,0 +1,95 @@
+import argparse
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import time
+from typing import List, Dict
+
+from clemgame import file_utils
+
+"""
+    Compare the size and the write and read times of the .json results files uncompressed, compressed with gzip and
+    compressed with zstd (if the zstandard package is installed).
+
+    To benchmark the results files in ./results:
+    $> python3 scripts/benchmark_compression.py -r results
+
+    The files are read (and loaded as json) -n times; the reported read time is the fastest round. At most -m files
+    (a random sample) are compared, one file at a time, so that large results directories need not fit into memory.
+"""
+
+SUFFIXES = {"none": ""}
+SUFFIXES.update(file_utils.COMPRESSION_SUFFIXES)
+
+
+def zstd_available() -> bool:
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def find_results_files(results_dir: str) -> List[str]:
+    file_paths = []
+    for dir_path, _, file_names in os.walk(file_utils.results_root(results_dir)):
+        for file_name in file_names:
+            if any(file_name.endswith(".json" + suffix) for suffix in SUFFIXES.values()):
+                file_paths.append(os.path.join(dir_path, file_name))
+    return file_paths
+
+
+def sample_files(file_paths: List[str], max_files: int, seed: int = 0) -> List[str]:
+    """ A random sample of at most max_files of the files (the same for the same seed) """
+    if len(file_paths) <= max_files:
+        return file_paths
+    return sorted(random.Random(seed).sample(file_paths, max_files))
+
+
+def benchmark(file_paths: List[str], compression: str, rounds: int) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_paths, write_duration = [], 0.
+        for idx, file_path in enumerate(file_paths):  # only one file is loaded at a time
+            with file_utils.open_file(file_path) as f:
+                data = json.load(f)
+            time_start = time.perf_counter()
+            tmp_paths.append(file_utils.store_file(data, f"{idx}.json{SUFFIXES[compression]}", tmp_dir))
+            write_duration += time.perf_counter() - time_start
+        num_bytes = sum(os.path.getsize(tmp_path) for tmp_path in tmp_paths)
+        read_durations = []
+        for _ in range(rounds):
+            time_start = time.perf_counter()
+            for tmp_path in tmp_paths:
+                with file_utils.open_file(tmp_path) as f:
+                    json.load(f)
+            read_durations.append(time.perf_counter() - time_start)
+    return {"compression": compression, "num_bytes": num_bytes, "write_duration": write_duration,
+            "read_duration": min(read_durations)}
+
+
+def main(args: argparse.Namespace):
+    all_file_paths = find_results_files(args.results_dir)
+    if not all_file_paths:
+        print(f"No .json results files found in {args.results_dir}")
+        return
+    file_paths = sample_files(all_file_paths, args.max_files)
+    compressions = ["none", "gzip"] + (["zstd"] if zstd_available() else [])
+    reports = [benchmark(file_paths, compression, args.rounds) for compression in compressions]
+    uncompressed_bytes = reports[0]["num_bytes"]
+    print(f"{len(file_paths)} of {len(all_file_paths)} results files")
+    print(f"{'compression':<12}{'size (MB)':>12}{'ratio':>8}{'write (s)':>12}{'read (s)':>12}")
+    for report in reports:
+        print(f"{report['compression']:<12}{report['num_bytes'] / 1e6:>12.2f}"
+              f"{uncompressed_bytes / report['num_bytes']:>8.2f}"
+              f"{report['write_duration']:>12.3f}{report['read_duration']:>12.3f}")
+    if "zstd" not in compressions:
+        print("zstd skipped: the zstandard package is not installed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--results_dir", type=str, default="results",
+                        help="A relative or absolute path to the results root directory. Default: results")
+    parser.add_argument("-n", "--rounds", type=int, default=3,
+                        help="How often to read all files. Default: 3")
+    parser.add_argument("-m", "--max_files", type=int, default=1000,
+                        help="The maximum number of files to compare (a random sample). Default: 1000")
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+import argparse
+import gc
+import glob
+import json
+import os
+import time
+from typing import List, Dict
+
+import backends
+from backends import ModelSpec
+
+"""
+    Compare a quantized huggingface_local model with the unquantized model on a fixed set of clembench prompts:
+    Generation speed (tokens/sec) and the agreement of the greedy outputs.
+
+    To compare the dynamic int8 quantization of a model from the model registry:
+    $> python3 scripts/benchmark_quantization.py -m falcon-7b-instruct
+
+    The prompts are the initial prompts of the games (games/*/resources/initial_prompts/*.template). Other prompts can be
+    given as a json file with a list of messages lists:
+    $> python3 scripts/benchmark_quantization.py -m falcon-7b-instruct --prompts my_prompts.json
+"""
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_game_prompts(max_prompts: int) -> List[List[Dict]]:
+    template_files = sorted(glob.glob(os.path.join(project_root, "games", "*", "resources", "initial_prompts",
+                                                   "*.template")))
+    prompts = []
+    for template_file in template_files[:max_prompts]:
+        with open(template_file, encoding="utf-8") as f:
+            prompts.append([{"role": "user", "content": f.read()}])
+    return prompts
+
+
+def generate_all(model_spec: ModelSpec, prompts: List[List[Dict]], max_tokens: int) -> Dict:
+    model = backends.get_model_for(model_spec)
+    model.set_gen_args(temperature=0.0, max_tokens=max_tokens)
+    outputs, num_tokens, duration = [], 0, 0.
+    for messages in prompts:
+        time_start = time.perf_counter()
+        _, _, response_text = model.generate_response(messages)
+        duration += time.perf_counter() - time_start
+        output_tokens = model.tokenizer.encode(response_text, add_special_tokens=False)
+        outputs.append(output_tokens)
+        num_tokens += len(output_tokens)
+    del model
+    gc.collect()
+    return dict(outputs=outputs, num_tokens=num_tokens, duration=duration)
+
+
+def prefix_agreement(tokens: List[int], reference_tokens: List[int]) -> float:
+    """ The length of the common prefix relative to the longer output (1.0 for identical outputs) """
+    max_length = max(len(tokens), len(reference_tokens))
+    if max_length == 0:
+        return 1.0
+    common_length = 0
+    for token, reference_token in zip(tokens, reference_tokens):
+        if token != reference_token:
+            break
+        common_length += 1
+    return common_length / max_length
+
+
+def main(args: argparse.Namespace):
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = json.load(f)[:args.max_prompts]
+    else:
+        prompts = load_game_prompts(args.max_prompts)
+    if not prompts:
+        print("No prompts to compare the models on.")
+        return
+    # look for custom user-defined models before loading the base registry
+    backends.load_custom_model_registry()
+    backends.load_model_registry()
+    reference_spec = backends.lookup_model_spec(ModelSpec.from_name(args.model))
+    quantized_spec = ModelSpec.from_dict(dict(reference_spec.__dict__, quantization=args.quantization))
+
+    results = {"unquantized": generate_all(reference_spec, prompts, args.max_tokens),
+               args.quantization: generate_all(quantized_spec, prompts, args.max_tokens)}
+
+    reference_outputs = results["unquantized"]["outputs"]
+    print(f"{args.model} on {len(prompts)} prompts (max_tokens={args.max_tokens}, greedy):")
+    for variant, result in results.items():
+        exact_matches = sum(outputs == reference for outputs, reference in zip(result["outputs"], reference_outputs))
+        agreement = sum(prefix_agreement(outputs, reference)
+                        for outputs, reference in zip(result["outputs"], reference_outputs)) / len(prompts)
+        tokens_per_sec = result["num_tokens"] / result["duration"] if result["duration"] > 0 else 0.
+        print(f"{variant}: {tokens_per_sec:.2f} tokens/sec, "
+              f"exact_match={exact_matches}/{len(prompts)}, prefix_agreement={agreement:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", type=str, required=True,
+                        help="The name of a huggingface_local model in the model registry.")
+    parser.add_argument("-q", "--quantization", type=str, default="dynamic_int8",
+                        help="The quantization scheme to compare with. Default: dynamic_int8.")
+    parser.add_argument("-l", "--max_tokens", type=int, default=100,
+                        help="The maximum number of tokens to be generated per prompt. Default: 100.")
+    parser.add_argument("-n", "--max_prompts", type=int, default=20,
+                        help="The maximum number of prompts to use. Default: 20.")
+    parser.add_argument("--prompts", type=str, default=None,
+                        help="A json file with a list of messages lists to use instead of the game prompts.")
+    main(parser.parse_args())
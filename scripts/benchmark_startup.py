@@ -0,0 +1,60 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+"""
+    Measure the startup time of the cli, so that listing the games and running a single game stay fast.
+
+    To measure the startup time of listing the games and loading the taboo game:
+    $> python3 scripts/benchmark_startup.py -g taboo
+
+    To fail (exit code 1) when the median startup time exceeds a threshold in seconds:
+    $> python3 scripts/benchmark_startup.py -g taboo --max_seconds 2.0
+"""
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# loads the benchmark for a single game as done by 'cli.py run' before the game-play starts
+RUN_STARTUP_CODE = "from clemgame import benchmark; benchmark.load_benchmark('{game_name}')"
+
+
+def time_command(command, repeats: int):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = project_root + os.pathsep + env.get("PYTHONPATH", "")
+    durations = []
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        subprocess.run(command, cwd=project_root, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - time_start)
+    return sorted(durations)
+
+
+def main(args: argparse.Namespace):
+    commands = {"ls": [sys.executable, "-m", "scripts.cli", "ls"]}
+    if args.game:
+        commands[f"run -g {args.game}"] = [sys.executable, "-c", RUN_STARTUP_CODE.format(game_name=args.game)]
+    exceeded = False
+    for command_name, command in commands.items():
+        durations = time_command(command, args.repeats)
+        median = durations[len(durations) // 2]
+        print(f"{command_name}: median={median:.3f}s min={durations[0]:.3f}s max={durations[-1]:.3f}s "
+              f"(n={args.repeats})")
+        if args.max_seconds and median > args.max_seconds:
+            print(f"{command_name}: median startup time exceeds {args.max_seconds:.3f}s", file=sys.stderr)
+            exceeded = True
+    if exceeded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--game", type=str,
+                        help="A specific game name (see ls) to measure the startup of a single-game run for.")
+    parser.add_argument("-n", "--repeats", type=int, default=5,
+                        help="How often to measure each command. Default: 5.")
+    parser.add_argument("--max_seconds", type=float, default=None,
+                        help="Exit with an error, when the median startup time exceeds this value.")
+    main(parser.parse_args())
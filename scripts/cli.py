@@ -2,8 +2,9 @@ import argparse
 import json
 from typing import List
 
-from backends import ModelSpec
-from clemgame import benchmark
+import clemgame
+from backends import ModelSpec, residency
+from clemgame import benchmark, file_utils, timing, live_metrics
 
 """
     Use good old argparse to run the commands.
@@ -51,20 +52,50 @@ def read_gen_args(args: argparse.Namespace):
     return dict(temperature=args.temperature, max_tokens=args.max_tokens)
 
 
+def read_player_gen_args(gen_args_strings: List[str]):
+    if not gen_args_strings:
+        return None
+    # make these proper json; a player without own generation arguments is given as {} or null
+    return [json.loads(gen_args_string.replace("'", "\"")) for gen_args_string in gen_args_strings]
+
+
 def main(args: argparse.Namespace):
     if args.command_name == "ls":
         benchmark.list_games()
+    if getattr(args, "compression", None):
+        file_utils.set_results_compression(args.compression)
+    if getattr(args, "trace", None):
+        timing.enable()
     if args.command_name == "run":
+        if args.verbosity:
+            clemgame.set_verbosity(args.verbosity)
+        if args.memory_budget:
+            residency.configure(args.memory_budget, offload=args.offload)
+        if args.metrics_port is not None or args.metrics_file:
+            live_metrics.enable()
+            if args.metrics_port is not None:
+                live_metrics.start_http_server(args.metrics_port)
+            if args.metrics_file:
+                live_metrics.start_file_writer(args.metrics_file, interval=args.metrics_interval)
         benchmark.run(args.game,
                       model_specs=read_model_specs(args.models),
                       gen_args=read_gen_args(args),
                       experiment_name=args.experiment_name,
                       instances_name=args.instances_name,
-                      results_dir=args.results_dir)
+                      results_dir=args.results_dir,
+                      num_samples=args.num_samples,
+                      player_gen_args=read_player_gen_args(args.player_gen_args),
+                      warmup=not args.skip_warmup,
+                      stream_records=args.stream_records,
+                      delta_requests=args.delta_requests)
     if args.command_name == "score":
         benchmark.score(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir)
     if args.command_name == "transcribe":
         benchmark.transcripts(args.game, experiment_name=args.experiment_name, results_dir=args.results_dir)
+    if getattr(args, "trace", None):
+        timing.write_chrome_trace(args.trace)
+        print(timing.summary_table())
+        print(f"Trace written to {args.trace}")
 
 
 if __name__ == "__main__":
@@ -102,7 +133,60 @@ if __name__ == "__main__":
     run_parser.add_argument("-r", "--results_dir", type=str, default="results",
                             help="A relative or absolute path to the results root directory. "
                                  "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
-                                 "When not specified, then the results will be located in './results'")
+                                 "When not specified, then the results will be located in './results'. "
+                                 "A path ending with .sqlite or .db refers to a single-file SQLite run archive "
+                                 "(see scripts/export_results.py).")
+    run_parser.add_argument("-n", "--num_samples", type=int, default=1,
+                            help="How often to play each game instance, e.g. to estimate the variance for temperature "
+                                 "> 0. The samples of an instance share the first model call, which requests all "
+                                 "completions at once. Default: 1.")
+    run_parser.add_argument("-p", "--player_gen_args", type=str, nargs="*",
+                            help="""Generation arguments per player (in the order of the players), which overwrite
+      the temperature and max_tokens above and the player_gen_args of the experiment. Supported are
+      'temperature', 'max_tokens', 'stop' and 'top_p'. For example, a short-answer guesser and a longer describer:
+      $> python3 scripts/cli.py run -g taboo -m mock -p "{'max_tokens': 200}" "{'max_tokens': 20, 'stop': ['\\n']}"
+
+      Use {} for a player without own generation arguments. Default: None.""")
+    run_parser.add_argument("--skip_warmup", action="store_true",
+                            help="Do not load the models concurrently and probe each with a tiny request before the "
+                                 "first episode (the warm-up reports the load and first response durations and fails "
+                                 "the run early on misconfigured credentials or registry entries).")
+    run_parser.add_argument("--stream_records", action="store_true",
+                            help="Append the interactions and calls of each episode to JSONL files as they happen, "
+                                 "instead of keeping them in memory until the end of the episode. A crashed episode "
+                                 "keeps its interactions.jsonl and requests.jsonl, which score and transcribe read.")
+    run_parser.add_argument("--delta_requests", action="store_true",
+                            help="Store the prompts in requests.json as the difference to an earlier prompt of the "
+                                 "episode instead of the full messages history. The results loaders expand them. "
+                                 "See scripts/convert_requests.py to convert existing results.")
+    run_parser.add_argument("--memory_budget", type=str,
+                            help="The memory budget for the weights of local models, e.g. '24GB'. When exceeded, "
+                                 "the least recently used models are evicted and reloaded on demand. "
+                                 "Default: None (models are never evicted).")
+    run_parser.add_argument("--offload", type=str, default="disk", choices=residency.OFFLOAD_MODES,
+                            help="How to evict models: 'cpu' moves the weights of models on a GPU to the CPU, "
+                                 "'disk' unloads the weights completely. Default: disk.")
+    run_parser.add_argument("--compression", type=str, choices=list(file_utils.COMPRESSION_SUFFIXES.keys()),
+                            help="Compress the .json results files with gzip or zstd (requires the zstandard "
+                                 "package). The transcripts are not compressed. Readers (score, transcribe and "
+                                 "evaluation) detect compressed files automatically. Default: None (uncompressed).")
+    run_parser.add_argument("--verbosity", type=str, choices=list(clemgame.VERBOSITY_LEVELS.keys()),
+                            help="'events' logs a line for each event and score of the episodes to clembench.log, "
+                                 "'throughput' only the episodes (and warnings), which is faster for large runs. "
+                                 "Default: the level of the clemgame.events logger in logging.yaml (events).")
+    run_parser.add_argument("--trace", type=str,
+                            help="Write the timing spans of the game loop (setup, prompts, backend calls, parsing, "
+                                 "records, scoring, transcripts) to this file as Chrome trace-event JSON (see "
+                                 "ui.perfetto.dev) and print a summary of the spans per game and model.")
+    run_parser.add_argument("--metrics_port", type=int,
+                            help="Serve live metrics of the run (episodes, calls in flight, latency percentiles, "
+                                 "retries, HTTP 429 errors and tokens per backend and model) in the Prometheus text "
+                                 "format at http://127.0.0.1:<port>/metrics. Default: None (not served).")
+    run_parser.add_argument("--metrics_file", type=str,
+                            help="Rewrite the live metrics (see --metrics_port) periodically to this file, e.g. for "
+                                 "the textfile collector of the Prometheus node exporter. Default: None (no file).")
+    run_parser.add_argument("--metrics_interval", type=float, default=15.0,
+                            help="The seconds between the writes of the --metrics_file. Default: 15")
 
     score_parser = sub_parsers.add_parser("score")
     score_parser.add_argument("-e", "--experiment_name", type=str,
@@ -112,7 +196,15 @@ if __name__ == "__main__":
     score_parser.add_argument("-r", "--results_dir", type=str, default="results",
                               help="A relative or absolute path to the results root directory. "
                                    "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
-                                   "When not specified, then the results will be located in './results'")
+                                   "When not specified, then the results will be located in './results'. "
+                                   "A path ending with .sqlite or .db refers to a single-file SQLite run archive "
+                                   "(see scripts/export_results.py).")
+    score_parser.add_argument("--compression", type=str, choices=list(file_utils.COMPRESSION_SUFFIXES.keys()),
+                              help="Compress the scores.json files with gzip or zstd. Default: None (uncompressed).")
+    score_parser.add_argument("--trace", type=str,
+                              help="Write the timing spans of the game loop (setup, prompts, backend calls, parsing, "
+                                   "records, scoring, transcripts) to this file as Chrome trace-event JSON (see "
+                                   "ui.perfetto.dev) and print a summary of the spans per game and model.")
 
     transcribe_parser = sub_parsers.add_parser("transcribe")
     transcribe_parser.add_argument("-e", "--experiment_name", type=str,
@@ -122,6 +214,12 @@ if __name__ == "__main__":
     transcribe_parser.add_argument("-r", "--results_dir", type=str, default="results",
                                    help="A relative or absolute path to the results root directory. "
                                         "For example '-r results/v1.5/de‘ or '-r /absolute/path/for/results'. "
-                                        "When not specified, then the results will be located in './results'")
+                                        "When not specified, then the results will be located in './results'. "
+                                        "A path ending with .sqlite or .db refers to a single-file SQLite run archive "
+                                        "(see scripts/export_results.py).")
+    transcribe_parser.add_argument("--trace", type=str,
+                                   help="Write the timing spans of the game loop (setup, prompts, backend calls, "
+                                        "parsing, records, scoring, transcripts) to this file as Chrome trace-event "
+                                        "JSON (see ui.perfetto.dev) and print a summary per game and model.")
 
     main(parser.parse_args())
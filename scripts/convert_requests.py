@@ -0,0 +1,61 @@
+import argparse
+import json
+import os
+
+from clemgame import file_utils
+
+"""
+    Convert the requests.json files of an existing results tree to delta encoded prompts (or back to full prompts).
+
+    To delta encode all requests.json files in ./results:
+    $> python3 scripts/convert_requests.py -r results
+
+    To expand them to the full prompts again:
+    $> python3 scripts/convert_requests.py -r results --expand
+
+    Compressed requests files (requests.json.gz or requests.json.zst) are converted and stay compressed.
+"""
+
+REQUESTS_FILE_NAMES = ["requests.json"] + ["requests.json" + suffix
+                                            for suffix in file_utils.COMPRESSION_SUFFIXES.values()]
+
+
+def convert_file(file_path: str, expand: bool) -> (int, int):
+    """
+    :return: the file size before and after the conversion
+    """
+    size_before = os.path.getsize(file_path)
+    with file_utils.open_file(file_path) as f:
+        requests = json.load(f)
+    if expand:
+        converted = file_utils.expand_requests(requests)
+    else:
+        converted = file_utils.delta_encode_requests(file_utils.expand_requests(requests))
+    # write to a temporary file first, so that an interrupted conversion does not destroy the results
+    tmp_path = os.path.join(os.path.dirname(file_path), "tmp_" + os.path.basename(file_path))  # keeps the suffix
+    with file_utils.open_file(tmp_path, "w") as f:
+        json.dump(converted, f, ensure_ascii=False)
+    os.replace(tmp_path, file_path)
+    return size_before, os.path.getsize(file_path)
+
+
+def main(args: argparse.Namespace):
+    total_before, total_after, num_files = 0, 0, 0
+    for dir_path, _, file_names in os.walk(file_utils.results_root(args.results_dir)):
+        for file_name in file_names:
+            if file_name not in REQUESTS_FILE_NAMES:
+                continue
+            size_before, size_after = convert_file(os.path.join(dir_path, file_name), args.expand)
+            total_before += size_before
+            total_after += size_after
+            num_files += 1
+    print(f"Converted {num_files} requests.json files: {total_before / 1e6:.2f} MB -> {total_after / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--results_dir", type=str, default="results",
+                        help="A relative or absolute path to the results root directory. Default: results")
+    parser.add_argument("--expand", action="store_true",
+                        help="Expand delta encoded prompts to the full prompts instead.")
+    main(parser.parse_args())
@@ -0,0 +1,53 @@
+import argparse
+import os
+
+from clemgame import file_utils, results_store
+
+"""
+    Export the results of an SQLite run archive to the usual results directory layout (one file per artifact).
+
+    To export results/run.sqlite to ./results:
+    $> python3 scripts/export_results.py -i results/run.sqlite -o results
+
+    The .json files can be compressed with --compression gzip (or zstd).
+"""
+
+
+def export(store: results_store.SQLiteStore, output_dir: str) -> int:
+    """
+    :return: the number of exported files
+    """
+    num_files = 0
+    for rel_path, data in store.iter_artifacts():
+        rel_dir, file_name = os.path.split(rel_path)
+        dir_path = os.path.join(output_dir, *rel_dir.split("/"))
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        # the stored text is written as is (without loading the json)
+        with file_utils.open_file(os.path.join(dir_path, file_utils.compressed_file_name(file_name)), "w") as f:
+            f.write(data)
+        num_files += 1
+    return num_files
+
+
+def main(args: argparse.Namespace):
+    if not results_store.is_sqlite_store(args.input):
+        raise ValueError(f"Not an SQLite run archive (ending with {' or '.join(results_store.SQLITE_SUFFIXES)}): "
+                         f"{args.input}")
+    if not os.path.exists(file_utils.results_root(args.input)):
+        raise FileNotFoundError(args.input)
+    file_utils.set_results_compression(args.compression)
+    store = results_store.open_store(args.input)
+    num_files = export(store, file_utils.results_root(args.output))
+    print(f"Exported {num_files} files to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, required=True,
+                        help="A relative or absolute path to the SQLite run archive, as given to the run command.")
+    parser.add_argument("-o", "--output", type=str, default="results",
+                        help="A relative or absolute path to the results root directory to export to. Default: results")
+    parser.add_argument("--compression", type=str, choices=list(file_utils.COMPRESSION_SUFFIXES.keys()),
+                        help="Compress the exported .json files with gzip or zstd. Default: None (uncompressed).")
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import backends
+
+try:
+    import torch
+    import transformers
+    from backends import huggingface_local_api
+    from backends.huggingface_local_api import ForwardCounter, HuggingfaceLocalModel
+except ImportError:  # the local backends are optional (see requirements_hf.txt)
+    torch = None
+
+
+def tiny_model(seed: int):
+    """ a randomly initialized tiny GPT-2 (no download needed) """
+    torch.manual_seed(seed)
+    config = transformers.GPT2Config(vocab_size=64, n_positions=64, n_embd=32, n_layer=2, n_head=2,
+                                     bos_token_id=0, eos_token_id=63, pad_token_id=63)
+    return transformers.GPT2LMHeadModel(config).eval()
+
+
+@unittest.skipUnless(torch is not None, "requires torch and transformers")
+class AssistedGenerationTestCase(unittest.TestCase):
+
+    def test_assisted_generation_gives_the_same_greedy_output(self):
+        model, draft_model = tiny_model(seed=0), tiny_model(seed=1)
+        prompt_ids = torch.tensor([[1, 2, 3, 4, 5]])
+        with torch.no_grad():
+            expected = model.generate(prompt_ids, max_new_tokens=12, do_sample=False)
+            model_counter, draft_counter = ForwardCounter(model), ForwardCounter(draft_model)
+            assisted = model.generate(prompt_ids, max_new_tokens=12, do_sample=False, assistant_model=draft_model)
+        self.assertEqual(assisted.tolist(), expected.tolist())
+        self.assertGreater(model_counter.num_calls, 0)
+        self.assertGreater(draft_counter.num_calls, 0)
+
+    def test_acceptance_stats_are_reported(self):
+        model_with_counters = SimpleNamespace(model_spec=backends.ModelSpec(draft_model="draft"),
+                                              model_forward_counter=SimpleNamespace(num_calls=4),
+                                              draft_forward_counter=SimpleNamespace(num_calls=10))
+        stats = HuggingfaceLocalModel._assisted_decoding_stats(model_with_counters, num_new_tokens=12,
+                                                               generation_time=2.0)
+        self.assertEqual(stats["draft_model"], "draft")
+        self.assertEqual(stats["accepted_tokens"], 8)  # each of the 4 forward passes adds one token of its own
+        self.assertEqual(stats["acceptance_rate"], 0.8)
+        self.assertEqual(stats["estimated_speedup"], 3.0)
+        self.assertEqual(stats["tokens_per_second"], 6.0)
+
+    def test_draft_model_must_share_the_vocabulary(self):
+        model_spec = backends.ModelSpec(model_name="main", draft_model="draft")
+        draft_spec = backends.ModelSpec(model_name="draft", backend="huggingface_local")
+        tokenizer = mock.Mock(get_vocab=lambda: {"a": 0})
+        draft_tokenizer = mock.Mock(get_vocab=lambda: {"b": 0})
+        with mock.patch.object(backends, "lookup_model_spec", return_value=draft_spec), \
+                mock.patch.object(huggingface_local_api, "load_config_and_tokenizer",
+                                  return_value=(draft_tokenizer, None, None)):
+            with self.assertRaises(ValueError):
+                huggingface_local_api.load_draft_model(model_spec, tokenizer)
+
+
+if __name__ == '__main__':
+    unittest.main()
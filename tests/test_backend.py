@@ -1,11 +1,32 @@
+import os
 import unittest
+import threading
 
-from backends import get_model_for, load_model_registry
-from backends.utils import ensure_alternating_roles
+from backends import get_model_for, load_model_registry, lookup_model_spec, ModelSpec, Model, ModelProxy
+from backends.utils import ensure_alternating_roles, AlternatingMessages, trimmed_response, optional_gen_args, \
+    truncate_at_stop, log_load_time
 
 
 class UtilsTestCase(unittest.TestCase):
 
+    def test_trimmed_response_refers_to_the_prompt(self):
+        response = trimmed_response(" Turn 1</s>", "<s>[INST] Initial Prompt [/INST]", prompt_tokens=8,
+                                    completion_tokens=3, finish_reason="stop")
+        self.assertEqual(response["continuation"], " Turn 1</s>")
+        self.assertEqual(response["completion_tokens"], 3)
+        self.assertEqual(response["finish_reason"], "stop")
+        self.assertNotIn("Initial Prompt", str(response))
+        self.assertEqual(response["prompt_sha1"],
+                         trimmed_response("", "<s>[INST] Initial Prompt [/INST]", 8, 0)["prompt_sha1"])
+
+    def test_truncate_at_stop_cuts_at_first_stop_sequence(self):
+        self.assertEqual(truncate_at_stop("GUESS: cat\nEXPLANATION: END", ["END", "\n"]), "GUESS: cat")
+        self.assertEqual(truncate_at_stop("GUESS: cat", None), "GUESS: cat")
+
+    def test_log_load_time_reports_throughput(self):
+        report = log_load_time("model_a", load_duration=2.0, num_bytes=4_000_000_000)
+        self.assertEqual(report, {"load_duration": 2.0, "weights_bytes": 4_000_000_000, "throughput": 2e9})
+
     def test_ensure_alternating_roles_with_empty_system_removed_if_empty(self):
         messages = [
             {"role": "system", "content": ""},
@@ -98,6 +119,71 @@ class UtilsTestCase(unittest.TestCase):
                          )
 
 
+class AlternatingMessagesTestCase(unittest.TestCase):
+
+    def test_update_only_merges_appended_messages(self):
+        history = [
+            {"role": "user", "content": "Initial Prompt"},
+            {"role": "assistant", "content": "Turn 1"},
+        ]
+        view = AlternatingMessages()
+        first_messages = list(view.update(history))
+        history.append({"role": "user", "content": "Turn 2a"})
+        history.append({"role": "user", "content": "Turn 2b"})
+        view.update(history)
+        self.assertEqual(view, [
+            {"role": "user", "content": "Initial Prompt"},
+            {"role": "assistant", "content": "Turn 1"},
+            {"role": "user", "content": "Turn 2a\n\nTurn 2b"}
+        ])
+        self.assertIs(view[0], first_messages[0])  # the prefix is not rebuilt
+        self.assertEqual(history[2], {"role": "user", "content": "Turn 2a"})  # the history is not modified
+
+    def test_update_merges_into_new_message(self):
+        history = [{"role": "user", "content": "Initial Prompt"}]
+        view = AlternatingMessages()
+        merged_before = view.update(history)[-1]
+        history.append({"role": "user", "content": "Turn 1"})
+        view.update(history)
+        self.assertEqual(merged_before, {"role": "user", "content": "Initial Prompt"})
+        self.assertEqual(view[-1], {"role": "user", "content": "Initial Prompt\n\nTurn 1"})
+
+    def test_update_rebuilds_on_changed_latest_message(self):
+        history = [{"role": "user", "content": "Initial Prompt"}]
+        view = AlternatingMessages()
+        view.update(history)
+        history[-1]["content"] = "Changed Prompt"
+        self.assertEqual(view.update(history), [{"role": "user", "content": "Changed Prompt"}])
+
+    def test_update_rebuilds_on_changed_earlier_message(self):
+        history = [{"role": "user", "content": "Initial Prompt"}, {"role": "assistant", "content": "Turn 1"}]
+        view = AlternatingMessages()
+        view.update(history)
+        history[0]["content"] = "Changed Prompt"
+        history.append({"role": "user", "content": "Turn 2"})
+        self.assertEqual(view.update(history), [{"role": "user", "content": "Changed Prompt"},
+                                                {"role": "assistant", "content": "Turn 1"},
+                                                {"role": "user", "content": "Turn 2"}])
+
+    def test_update_rebuilds_on_replaced_earlier_message(self):
+        history = [{"role": "user", "content": "Initial Prompt"}, {"role": "user", "content": "Turn 1"}]
+        view = AlternatingMessages()
+        view.update(history)
+        history[1] = {"role": "assistant", "content": "Turn 1"}
+        self.assertEqual(view.update(history), [{"role": "user", "content": "Initial Prompt"},
+                                                {"role": "assistant", "content": "Turn 1"}])
+
+    def test_update_rebuilds_on_other_history(self):
+        view = AlternatingMessages()
+        view.update([{"role": "user", "content": "Initial Prompt"}])
+        self.assertEqual(view.update([{"role": "user", "content": "Other Prompt"}]),
+                         [{"role": "user", "content": "Other Prompt"}])
+
+    def test_ensure_alternating_roles_returns_view_as_is(self):
+        view = AlternatingMessages().update([{"role": "user", "content": "Initial Prompt"}])
+        self.assertIs(ensure_alternating_roles(view), view)
+
+
 class ModelTestCase(unittest.TestCase):
     def test_get_backend_for_model1(self):
         load_model_registry("test-registry.json")
@@ -115,5 +201,99 @@ class ModelTestCase(unittest.TestCase):
         assert model.model_spec.backend == "openai"
 
 
+class GenArgsModel(Model):
+    """ Returns its generation arguments as response """
+
+    def generate_response(self, messages):
+        return messages, None, str(sorted(self.get_gen_args().items()))
+
+
+class ModelProxyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.model = GenArgsModel(ModelSpec(model_name="gen_args"))
+        self.model.set_gen_args(temperature=0.0, max_tokens=100)
+
+    def test_proxy_calls_model_with_own_gen_args(self):
+        proxy = ModelProxy(self.model, dict(max_tokens=20, stop="\n"))
+        _, _, response_text = proxy.generate_response([])
+        self.assertEqual(response_text, str([("max_tokens", 20), ("stop", "\n"), ("temperature", 0.0)]))
+        self.assertEqual(proxy.get_stop(), ["\n"])
+        self.assertEqual(self.model.get_gen_args(), dict(temperature=0.0, max_tokens=100))
+        self.assertIsNone(self.model.get_stop())
+
+    def test_proxies_of_same_model_are_independent(self):
+        proxies = [ModelProxy(self.model, dict(max_tokens=20)), ModelProxy(self.model, dict(top_p=0.9))]
+        self.assertEqual([proxy.generate_responses([], 1)[0][2] for proxy in proxies],
+                         [str([("max_tokens", 20), ("temperature", 0.0)]),
+                          str([("max_tokens", 100), ("temperature", 0.0), ("top_p", 0.9)])])
+        self.assertEqual(proxies[0].get_name(), "gen_args")
+
+    def test_proxies_do_not_change_the_shared_model(self):
+        started, answered, results = threading.Barrier(2), threading.Barrier(2), {}
+
+        class WaitingModel(GenArgsModel):
+            def generate_response(self, messages):
+                started.wait(timeout=5)  # both calls are in progress now
+                response = super().generate_response(messages)
+                answered.wait(timeout=5)
+                return response
+
+        model = WaitingModel(ModelSpec(model_name="gen_args"))
+        model.set_gen_args(temperature=0.0, max_tokens=100)
+        proxies = [ModelProxy(model, dict(temperature=0.7)), ModelProxy(model, dict(temperature=0.1))]
+        threads = [threading.Thread(target=lambda idx=idx: results.update({idx: proxies[idx].generate_response([])[2]}))
+                   for idx in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {0: str([("max_tokens", 100), ("temperature", 0.7)]),
+                                   1: str([("max_tokens", 100), ("temperature", 0.1)])})
+        self.assertEqual(model.get_gen_args(), dict(temperature=0.0, max_tokens=100))
+
+    def test_optional_gen_args_uses_api_names(self):
+        self.model.set_gen_args(temperature=0.0, max_tokens=100, stop=["\n"], top_p=0.9)
+        self.assertEqual(optional_gen_args(self.model, stop="stop_sequences", top_p="p"),
+                         {"stop_sequences": ["\n"], "p": 0.9})
+        self.assertEqual(optional_gen_args(self.model, stop=None), {"top_p": 0.9})
+
+
+class RegistryLookupTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        load_model_registry(os.path.join(os.path.dirname(__file__), "test-registry.json"))
+
+    def test_lookup_by_name_returns_first_entry(self):
+        model_spec = lookup_model_spec(ModelSpec.from_name("model1"))
+        self.assertEqual(model_spec.backend, "huggingface_local")
+        self.assertEqual(model_spec.model_id, "model_id1")
+
+    def test_lookup_with_backend_skips_non_unifying_entries(self):
+        model_spec = lookup_model_spec(ModelSpec(model_name="model1", backend="openai"))
+        self.assertEqual(model_spec.model_id, "model_id3")
+
+    def test_lookup_with_extra_attribute_unifies_to_union(self):
+        model_spec = lookup_model_spec(ModelSpec(model_name="model2", quantization="8bit"))
+        self.assertEqual(model_spec.model_id, "model_id2")
+        self.assertEqual(model_spec.quantization, "8bit")
+
+    def test_lookup_of_unknown_name_returns_query(self):
+        model_spec = lookup_model_spec(ModelSpec.from_name("unknown"))
+        self.assertFalse(model_spec.has_backend())
+
+    def test_failed_lookup_is_not_memoized(self):
+        query = ModelSpec.from_name("unknown")
+        self.assertIs(lookup_model_spec(query), query)
+        other_query = ModelSpec.from_name("unknown")
+        self.assertIs(lookup_model_spec(other_query), other_query)
+
+    def test_lookup_is_memoized(self):
+        first = lookup_model_spec(ModelSpec(model_name="model2", quantization="8bit"))
+        second = lookup_model_spec(ModelSpec(model_name="model2", quantization="8bit"))
+        self.assertIs(first, second)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+from unittest import mock
+
+from backends import ModelSpec, Model, ContextExceededError, token_counting, utils
+from backends.context_management import ContextWindow, DropOldestTurns, KeepLastTurns, SummarizeOldestTurns, \
+    strategy_from_spec, context_size_from_spec, api_context_window, ensure_context_limit, EstimatedContextWindow
+
+MESSAGES = [
+    {"role": "system", "content": "System"},
+    {"role": "user", "content": "Initial Prompt with many words in it"},
+    {"role": "assistant", "content": "Turn 1"},
+    {"role": "user", "content": "Prompt 2"},
+    {"role": "assistant", "content": "Turn 2"},
+    {"role": "user", "content": "Prompt 3"},
+]
+
+
+def count_words(messages):
+    return sum(len(message["content"].split()) for message in messages)
+
+
+class CountingApiModel(Model):
+    """ Counts the requests that would be sent """
+
+    def __init__(self, context_window: ContextWindow):
+        super().__init__(ModelSpec(model_name="api_model"))
+        self.set_gen_args(temperature=0.0, max_tokens=2)
+        self.context_window = context_window
+        self.num_requests = 0
+
+    @ensure_context_limit
+    @utils.retry(tries=3, delay=0)
+    def generate_response(self, messages):
+        self.num_requests += 1
+        return messages, None, "response"
+
+
+class BadRequestError(Exception):
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RejectingApiModel(Model):
+    """ Counts the requests sent to an API that rejects them """
+
+    def __init__(self, error: Exception):
+        super().__init__(ModelSpec(model_name="api_model"))
+        self.error = error
+        self.num_requests = 0
+
+    @utils.retry(tries=3, delay=0)
+    def generate_response(self, messages):
+        self.num_requests += 1
+        raise self.error
+
+
+class ContextWindowTestCase(unittest.TestCase):
+
+    def test_fitting_messages_are_returned_as_is(self):
+        context_window = ContextWindow("model_a", 100, count_words, strategy=DropOldestTurns())
+        self.assertIs(context_window.fit(MESSAGES, max_new_tokens=10), MESSAGES)
+
+    def test_no_strategy_returns_messages_as_is(self):
+        context_window = ContextWindow("model_a", 1, count_words)
+        self.assertIs(context_window.fit(MESSAGES, max_new_tokens=10), MESSAGES)
+
+    def test_drop_oldest_turns_keeps_system_and_drops_as_few_as_possible(self):
+        context_window = ContextWindow("model_a", 9, count_words, strategy=DropOldestTurns())
+        self.assertEqual(context_window.fit(MESSAGES, max_new_tokens=2), [MESSAGES[0]] + MESSAGES[3:])
+        self.assertEqual(len(MESSAGES), 6)
+
+    def test_drop_oldest_turns_keeps_latest_turn_if_nothing_fits(self):
+        context_window = ContextWindow("model_a", 1, count_words, strategy=DropOldestTurns())
+        self.assertEqual(context_window.fit(MESSAGES, max_new_tokens=2), [MESSAGES[0], MESSAGES[-1]])
+
+    def test_keep_last_turns(self):
+        context_window = ContextWindow("model_a", 7, count_words, strategy=KeepLastTurns(turns=1))
+        self.assertEqual(context_window.fit(MESSAGES, max_new_tokens=2), [MESSAGES[0], MESSAGES[-1]])
+
+    def test_summarize_oldest_turns_prepends_summary_to_first_kept_user_message(self):
+        strategy = SummarizeOldestTurns(max_chars=5, header="Summary:")
+        context_window = ContextWindow("model_a", 15, count_words, strategy=strategy)
+        fitted = context_window.fit(MESSAGES, max_new_tokens=2)
+        self.assertEqual(fitted[0], MESSAGES[0])
+        self.assertEqual(fitted[1], {"role": "user",
+                                     "content": "Summary:\nuser: Initi...\nassistant: Turn ...\n\nPrompt 2"})
+        self.assertEqual(fitted[2:], MESSAGES[4:])
+
+    def test_strategy_from_spec(self):
+        self.assertIsNone(strategy_from_spec(ModelSpec(model_name="model_a")))
+        strategy = strategy_from_spec(ModelSpec(model_name="model_a", context_strategy="drop_oldest_turns"))
+        self.assertIsInstance(strategy, DropOldestTurns)
+        strategy = strategy_from_spec(ModelSpec(model_name="model_a",
+                                                context_strategy={"name": "keep_last_turns", "turns": 3}))
+        self.assertEqual(strategy.turns, 3)
+        with self.assertRaises(ValueError):
+            strategy_from_spec(ModelSpec(model_name="model_a", context_strategy="unknown"))
+
+    def test_context_size_from_spec(self):
+        self.assertEqual(context_size_from_spec(ModelSpec(model_name="model_a"), default=256), 256)
+        self.assertEqual(context_size_from_spec(ModelSpec(model_name="model_a", context_size=1024), default=256), 1024)
+
+    def test_check_raises_context_exceeded_error(self):
+        context_window = ContextWindow("model_a", 18, count_words)
+        context_window.check(MESSAGES, max_new_tokens=2)
+        with self.assertRaises(ContextExceededError) as context:
+            context_window.check(MESSAGES, max_new_tokens=3)
+        self.assertEqual(context.exception.tokens_used, 19)
+
+    def test_api_context_window_requires_context_size(self):
+        self.assertIsNone(api_context_window(ModelSpec(model_name="model_a", model_id="model_a")))
+
+    def test_api_context_window_is_exact_only_for_openai_models(self):
+        model_spec = ModelSpec(model_name="model_a", model_id="model_a", context_size=1024)
+        self.assertIs(type(api_context_window(model_spec, exact=True)), ContextWindow)
+        self.assertIs(type(api_context_window(model_spec)), EstimatedContextWindow)
+
+    def test_tiktoken_encoding_is_loaded_on_first_count(self):
+        with mock.patch.object(token_counting, "tiktoken_encoding") as tiktoken_encoding:
+            api_context_window(ModelSpec(model_name="lazy", model_id="lazy-model", context_size=1024))
+            tiktoken_encoding.assert_not_called()
+
+    def test_estimated_context_window_keeps_margin_and_only_warns(self):
+        model = CountingApiModel(EstimatedContextWindow("api_model", 17, count_words))
+        with self.assertLogs("backends.context_management", level="WARNING"):
+            prompt, _, _ = model.generate_response(MESSAGES)  # 18 tokens exceed 17 by less than the margin
+        self.assertEqual(prompt, MESSAGES)
+        self.assertEqual(model.num_requests, 1)
+        model = CountingApiModel(EstimatedContextWindow("api_model", 19, count_words, strategy=DropOldestTurns()))
+        prompt, _, _ = model.generate_response(MESSAGES)
+        self.assertEqual(prompt, [MESSAGES[0]] + MESSAGES[3:])  # the 18 tokens fit into 19, but not into 90% of 19
+
+    def test_estimated_context_window_rejects_beyond_margin(self):
+        model = CountingApiModel(EstimatedContextWindow("api_model", 10, count_words))
+        with self.assertRaises(ContextExceededError):
+            model.generate_response(MESSAGES)
+        self.assertEqual(model.num_requests, 0)
+
+    def test_context_length_errors_of_the_api_are_not_retried(self):
+        model = RejectingApiModel(BadRequestError(400, "This model's maximum context length is 8192 tokens"))
+        with self.assertRaises(BadRequestError):
+            model.generate_response(MESSAGES)
+        self.assertEqual(model.num_requests, 1)
+        model = RejectingApiModel(BadRequestError(400, "Invalid value for temperature"))
+        with self.assertRaises(BadRequestError):
+            model.generate_response(MESSAGES)
+        self.assertEqual(model.num_requests, 3)
+
+    def test_ensure_context_limit_rejects_before_sending_without_retries(self):
+        model = CountingApiModel(ContextWindow("api_model", 10, count_words))
+        with self.assertRaises(ContextExceededError):
+            model.generate_response(MESSAGES)
+        self.assertEqual(model.num_requests, 0)
+
+    def test_ensure_context_limit_applies_strategy(self):
+        model = CountingApiModel(ContextWindow("api_model", 10, count_words, strategy=DropOldestTurns()))
+        prompt, _, _ = model.generate_response(MESSAGES)
+        self.assertEqual(prompt, [MESSAGES[0]] + MESSAGES[3:])
+        self.assertEqual(model.num_requests, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
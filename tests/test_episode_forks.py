@@ -0,0 +1,101 @@
+import unittest
+
+from backends import ModelSpec, Model, CustomResponseModel
+from clemgame.clemgame import Player
+from clemgame.episode_forks import EpisodeFork
+
+
+class CountingModel(Model):
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="counting"))
+        self.calls = []
+
+    def generate_response(self, messages):
+        self.calls.append(1)
+        return messages, {"text": f"call {len(self.calls)}"}, f"call {len(self.calls)}"
+
+    def generate_responses(self, messages, n):
+        self.calls.append(n)
+        return [(messages, {"text": f"sample {idx}"}, f"sample {idx}") for idx in range(n)]
+
+
+class FailingModel(CountingModel):
+
+    def generate_responses(self, messages, n):
+        raise ConnectionError("the first call failed")
+
+
+class ModelPlayer(Player):
+
+    def _custom_response(self, messages, turn_idx) -> str:
+        raise NotImplementedError()
+
+
+class EpisodeForkTestCase(unittest.TestCase):
+
+    def play(self, fork: EpisodeFork, model: Model, sample_idx: int):
+        fork.start_sample(sample_idx)
+        forked_model, = fork.fork_models([model])
+        messages = [{"role": "user", "content": "Initial Prompt"}]
+        _, response, first = forked_model.generate_response(messages)
+        messages += [{"role": "assistant", "content": first}, {"role": "user", "content": "Turn 2"}]
+        _, _, second = forked_model.generate_response(messages)
+        return first, second, response
+
+    def test_first_call_is_shared_by_all_samples(self):
+        model = CountingModel()
+        fork = EpisodeFork(num_samples=3)
+        results = [self.play(fork, model, sample_idx) for sample_idx in range(3)]
+        self.assertEqual([first for first, _, _ in results], ["sample 0", "sample 1", "sample 2"])
+        self.assertEqual(model.calls, [3, 1, 1, 1])  # one call with n=3, then one call per sample
+        self.assertEqual(results[2][2]["episode_fork"], {"sample": 2, "num_samples": 3})
+
+    def test_different_first_calls_are_not_shared(self):
+        model = CountingModel()
+        fork = EpisodeFork(num_samples=2)
+        fork.start_sample(0)
+        fork.fork_models([model])[0].generate_response([{"role": "user", "content": "Prompt A"}])
+        fork.start_sample(1)
+        _, _, response_text = fork.fork_models([model])[0].generate_response([{"role": "user", "content": "Prompt B"}])
+        self.assertEqual(response_text, "call 2")
+
+    def test_players_log_the_prompt_of_their_sample(self):
+        model = CountingModel()
+        fork = EpisodeFork(num_samples=2)
+        first_prompts = []
+        for sample_idx in range(2):
+            fork.start_sample(sample_idx)
+            player = ModelPlayer(fork.fork_models([model])[0])
+            messages = [{"role": "user", "content": "Initial Prompt"}]
+            prompt, _, response_text = player(messages, 0)
+            first_prompts.append(list(prompt))
+            messages += [{"role": "assistant", "content": response_text}, {"role": "user", "content": "Turn 2"}]
+            player(messages, 1)
+        self.assertEqual(first_prompts, [[{"role": "user", "content": "Initial Prompt"}]] * 2)
+
+    def test_failed_first_call_is_not_shared(self):
+        model = FailingModel()
+        fork = EpisodeFork(num_samples=2)
+        fork.start_sample(0)
+        with self.assertRaises(ConnectionError):
+            fork.fork_models([model])[0].generate_response([{"role": "user", "content": "Prompt"}])
+        fork.start_sample(1)
+        _, _, response_text = fork.fork_models([model])[0].generate_response([{"role": "user", "content": "Prompt"}])
+        self.assertEqual(response_text, "call 1")
+
+    def test_programmatic_players_are_not_forked(self):
+        model = CustomResponseModel()
+        fork = EpisodeFork(num_samples=2)
+        self.assertIs(fork.fork_models([model])[0], model)
+
+    def test_forked_model_keeps_gen_args(self):
+        model = CountingModel()
+        model.set_gen_args(temperature=0.7, max_tokens=10)
+        forked_model = EpisodeFork(num_samples=2).fork_models([model])[0]
+        self.assertEqual(forked_model.get_temperature(), 0.7)
+        self.assertEqual(forked_model.get_name(), "counting")
+
+
+if __name__ == '__main__':
+    unittest.main()
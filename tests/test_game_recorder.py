@@ -0,0 +1,206 @@
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+
+from clemgame import file_utils
+from clemgame.call_snapshots import CallSnapshots
+from clemgame.clemgame import GameRecorder
+
+
+def play(recorder: GameRecorder, history: list):
+    recorder.log_players({"GM": "Game master", "Player 1": "mock"})
+    recorder.log_next_turn()
+    history.append({"role": "user", "content": "Question?"})
+    recorder.log_event("GM", "Player 1", {"type": "send message", "content": "Question?"})
+    recorder.log_event("Player 1", "GM", {"type": "get message", "content": "Answer."}, call=(history, {"n": 1}))
+    history.append({"role": "assistant", "content": "Answer."})  # the logged prompt must not change
+    recorder.log_next_turn()
+    recorder.log_key("Played turns", 2)
+
+
+class StreamingGameRecorderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+
+    def load(self, file_name: str):
+        return file_utils.load_results_json(f"episode_0/{file_name}", self.results_dir, "pair", "game")
+
+    def test_streamed_episode_is_finalized_into_json_files(self):
+        recorder = GameRecorder("game")
+        recorder.stream_records(self.results_dir, "pair", "episode_0")
+        play(recorder, [])
+        recorder.store_records(self.results_dir, "pair", "episode_0")
+
+        episode_dir = os.path.join(self.results_dir, "pair", "game", "episode_0")
+        self.assertEqual(sorted(os.listdir(episode_dir)), ["interactions.json", "requests.json"])
+        interactions = self.load("interactions")
+        self.assertEqual(interactions["Played turns"], 2)
+        self.assertEqual(len(interactions["turns"]), 2)
+        requests = self.load("requests")
+        self.assertEqual(requests[0]["manipulated_prompt_obj"], [{"role": "user", "content": "Question?"}])
+        self.assertEqual(requests[0]["raw_response_obj"], {"n": 1})
+
+    def test_crashed_episode_is_read_from_jsonl_files(self):
+        recorder = GameRecorder("game")
+        recorder.stream_records(self.results_dir, "pair", "episode_0")
+        play(recorder, [])
+        recorder.close_records()  # no store_records, e.g. after an exception
+
+        interactions = self.load("interactions")
+        self.assertEqual(interactions["players"], {"GM": "Game master", "Player 1": "mock"})
+        self.assertEqual([len(turn) for turn in interactions["turns"]], [2, 0])
+        self.assertEqual(len(self.load("requests")), 1)
+
+    def test_rerun_of_crashed_episode_replaces_its_records(self):
+        for _ in range(2):  # the first run crashes
+            recorder = GameRecorder("game")
+            recorder.stream_records(self.results_dir, "pair", "episode_0")
+            play(recorder, [])
+            recorder.close_records()
+        self.assertEqual(len(self.load("requests")), 1)
+        self.assertEqual([len(turn) for turn in self.load("interactions")["turns"]], [2, 0])
+
+    def test_incomplete_last_line_is_ignored(self):
+        file_path = os.path.join(self.results_dir, "records.jsonl")
+        with open(file_path, "w") as f:
+            f.write(json.dumps({"a": 1}) + "\n" + '{"a": ')
+        self.assertEqual(file_utils.load_jsonl(file_path), [{"a": 1}])
+
+
+class CallSnapshotsTestCase(unittest.TestCase):
+
+    def test_snapshot_shares_earlier_messages(self):
+        snapshots = CallSnapshots()
+        history = [{"role": "user", "content": "Question?"}]
+        first = snapshots.snapshot(history)
+        history.extend([{"role": "assistant", "content": "Answer."}, {"role": "user", "content": "Next?"}])
+        second = snapshots.snapshot(history)
+        self.assertIs(second.prefix, first)
+        self.assertEqual(second.messages, tuple(history[1:]))
+        self.assertEqual(second.to_list(), history)
+
+    def test_snapshot_is_not_changed_by_later_changes(self):
+        snapshots = CallSnapshots()
+        history = [{"role": "user", "content": "Question?"}]
+        first = snapshots.snapshot(history)
+        history[-1]["content"] = "Changed question?"
+        second = snapshots.snapshot(history)
+        self.assertEqual(first.to_list(), [{"role": "user", "content": "Question?"}])
+        self.assertIsNone(second.prefix)  # the latest message has changed
+        self.assertEqual(second.to_list(), [{"role": "user", "content": "Changed question?"}])
+
+    def test_snapshot_detects_changes_of_earlier_messages(self):
+        snapshots = CallSnapshots()
+        history = [{"role": "user", "content": "Question?"}, {"role": "assistant", "content": "Answer."}]
+        snapshots.snapshot(history)
+        history[0]["content"] = "Changed question?"
+        history.append({"role": "user", "content": "Next?"})
+        second = snapshots.snapshot(history)
+        self.assertIsNone(second.prefix)
+        self.assertEqual(second.to_list(), history)
+        history[1] = {"role": "assistant", "content": "Other answer."}  # replaced
+        self.assertEqual(snapshots.snapshot(history).to_list(), history)
+
+    def test_other_prompts_are_copied(self):
+        snapshots = CallSnapshots()
+        prompt = {"inputs": "Question?", "max_new_tokens": 100}
+        self.assertEqual(snapshots.snapshot(prompt), prompt)
+        self.assertIsNot(snapshots.snapshot(prompt), prompt)
+        self.assertEqual(snapshots.snapshot("Question?"), "Question?")
+
+    def test_recorder_stores_snapshots_as_lists(self):
+        results_dir = tempfile.mkdtemp()
+        recorder = GameRecorder("game")
+        history = []
+        play(recorder, history)
+        recorder.store_records(results_dir, "pair", "episode_0")
+        requests = file_utils.load_results_json("episode_0/requests", results_dir, "pair", "game")
+        self.assertEqual(requests[0]["manipulated_prompt_obj"], [{"role": "user", "content": "Question?"}])
+
+
+class DeltaRequestsTestCase(unittest.TestCase):
+
+    def test_prompts_refer_to_earlier_prompts(self):
+        question = {"role": "user", "content": "Question?"}
+        answer = {"role": "assistant", "content": "Answer."}
+        requests = [{"manipulated_prompt_obj": [question], "raw_response_obj": {}},
+                    {"manipulated_prompt_obj": {"inputs": "Question?"}, "raw_response_obj": {}},
+                    {"manipulated_prompt_obj": [question, answer, question], "raw_response_obj": {}}]
+        encoded = file_utils.delta_encode_requests(requests)
+        self.assertEqual(encoded[:2], requests[:2])
+        self.assertEqual(encoded[2]["manipulated_prompt_obj"],
+                         {file_utils.DELTA_KEY: {"base": 0, "keep": 1, "append": [answer, question]}})
+        self.assertTrue(file_utils.is_delta_encoded(encoded))
+        self.assertEqual(file_utils.expand_requests(encoded), requests)
+
+    def test_prompts_refer_to_the_previous_prompt_of_the_same_player(self):
+        player_1 = [{"role": "user", "content": "You are player 1."}]
+        player_2 = [{"role": "user", "content": "You are player 2."}]
+        requests = []
+        for turn in range(2):
+            for history in [player_1, player_2]:
+                history.extend([{"role": "assistant", "content": f"Answer {turn}."},
+                                {"role": "user", "content": f"Turn {turn + 1}"}])
+                requests.append({"manipulated_prompt_obj": list(history), "raw_response_obj": {}})
+        encoded = file_utils.delta_encode_requests(requests)
+        self.assertEqual(encoded[:2], requests[:2])
+        self.assertEqual([call["manipulated_prompt_obj"][file_utils.DELTA_KEY]["base"] for call in encoded[2:]], [0, 1])
+        self.assertEqual(encoded[3]["manipulated_prompt_obj"][file_utils.DELTA_KEY]["keep"], 3)
+        self.assertEqual(file_utils.expand_requests(encoded), requests)
+
+    def test_recorder_stores_delta_encoded_requests_loaded_as_full_prompts(self):
+        results_dir = tempfile.mkdtemp()
+        recorder = GameRecorder("game")
+        recorder.delta_requests = True
+        history = []
+        play(recorder, history)
+        recorder.log_event("Player 1", "GM", {"type": "get message", "content": "Answer."}, call=(history, {}))
+        recorder.store_records(results_dir, "pair", "episode_0")
+        requests = file_utils.load_results_json("episode_0/requests", results_dir, "pair", "game")
+        self.assertEqual(requests[1]["manipulated_prompt_obj"], history)
+
+
+class CompressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        file_utils.set_results_compression("gzip")
+
+    def tearDown(self):
+        file_utils.set_results_compression(None)
+
+    def test_compressed_results_are_found_and_read(self):
+        recorder = GameRecorder("game")
+        play(recorder, [])
+        recorder.store_records(self.results_dir, "pair", "episode_0")
+        recorder.store_results_file("<html/>", "transcript.html", "pair", sub_dir="episode_0",
+                                    root_dir=self.results_dir)
+        episode_dir = os.path.join(self.results_dir, "pair", "game", "episode_0")
+        self.assertEqual(sorted(os.listdir(episode_dir)),
+                         ["interactions.json.gz", "requests.json.gz", "transcript.html"])
+        interactions = file_utils.load_results_json("episode_0/interactions", self.results_dir, "pair", "game")
+        self.assertEqual(interactions["Played turns"], 2)
+
+    def test_stored_file_replaces_other_compression(self):
+        file_utils.store_file({"a": 1}, "scores.json", self.results_dir)
+        fp = file_utils.store_file({"a": 2}, file_utils.compressed_file_name("scores.json"), self.results_dir)
+        self.assertEqual(os.listdir(self.results_dir), ["scores.json.gz"])
+        self.assertEqual(file_utils.find_file(os.path.join(self.results_dir, "scores.json")), fp)
+        with file_utils.open_file(fp) as f:
+            self.assertEqual(json.load(f), {"a": 2})
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            file_utils.set_results_compression("rar")
+
+    @unittest.skipIf(importlib.util.find_spec("zstandard") is not None, "zstandard is installed")
+    def test_zstd_compression_requires_zstandard(self):
+        with self.assertRaises(ValueError):
+            file_utils.set_results_compression("zstd")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
 import unittest
+from unittest import mock
+
+import torch
 
 import backends
-from backends.huggingface_local_api import check_messages, check_context_limit
+from backends.huggingface_local_api import check_messages, check_context_limit, StopSequencesCriteria
 
 MODEL_SPEC = backends.ModelSpec(**{
     "model_name": "Mistral-7B-Instruct-v0.1",
@@ -96,5 +99,31 @@ class HuggingfaceLocalTestCase(unittest.TestCase):
         when the full set of clemgames is run by others."""
 
 
+
+class StopSequencesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # each token id is decoded to a letter: 0 -> 'a', 1 -> 'b', ...
+        self.tokenizer = mock.Mock(decode=lambda ids: "".join(chr(ord("a") + int(token_id)) for token_id in ids))
+
+    def test_generation_stops_after_stop_sequence(self):
+        criteria = StopSequencesCriteria(self.tokenizer, ["cd"], prompt_length=2)
+        self.assertFalse(criteria(torch.tensor([[0, 1, 2]]), None))
+        self.assertTrue(criteria(torch.tensor([[0, 1, 2, 3]]), None))
+
+    def test_stop_sequence_in_prompt_is_ignored(self):
+        criteria = StopSequencesCriteria(self.tokenizer, ["cd"], prompt_length=4)
+        self.assertFalse(criteria(torch.tensor([[2, 3, 0, 0, 0]]), None))
+
+    def test_stop_sequence_within_several_new_tokens(self):  # e.g. with assisted generation
+        criteria = StopSequencesCriteria(self.tokenizer, ["cd"], prompt_length=1)
+        self.assertTrue(criteria(torch.tensor([[0, 2, 3, 0, 0, 0]]), None))
+
+    def test_all_sequences_have_to_stop(self):
+        criteria = StopSequencesCriteria(self.tokenizer, ["cd"], prompt_length=1)
+        self.assertFalse(criteria(torch.tensor([[0, 2, 3], [0, 0, 0]]), None))
+        self.assertTrue(criteria(torch.tensor([[0, 2, 3, 0], [0, 0, 2, 3]]), None))
+
+
 if __name__ == '__main__':
     unittest.main()
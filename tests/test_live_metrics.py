@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+import urllib.request
+
+from backends import ModelSpec, Model
+from backends.utils import retry, normalized_usage
+from clemgame import live_metrics
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FlakyModel(Model):
+
+    def __init__(self, failures: int):
+        super().__init__(ModelSpec(model_name="flaky", backend="openai"))
+        self.failures = failures
+
+    @retry(tries=3, delay=0)
+    def generate_response(self, messages):
+        if self.failures > 0:
+            self.failures -= 1
+            raise RateLimitError("Too Many Requests")
+        return messages, {}, "answer"
+
+
+class LiveMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        live_metrics.reset()
+        live_metrics.enable()
+
+    def tearDown(self):
+        live_metrics.disable()
+        live_metrics.reset()
+
+    def test_retries_and_rate_limits_are_counted(self):
+        model = FlakyModel(failures=2)
+        with live_metrics.model_call(model):
+            self.assertEqual(model.generate_response([])[2], "answer")
+        model = FlakyModel(failures=3)
+        with self.assertRaises(RateLimitError):
+            model.generate_response([])
+        text = live_metrics.to_prometheus_text()
+        self.assertIn('clem_call_retries_total{backend="openai",model="flaky"} 4', text)
+        self.assertIn('clem_rate_limited_total{backend="openai",model="flaky"} 5', text)
+        self.assertIn('clem_calls_in_flight{backend="openai",model="flaky"} 0', text)
+        self.assertIn('clem_call_latency_seconds_count{backend="openai",model="flaky"} 1', text)
+
+    def test_episodes_latency_percentiles_and_tokens(self):
+        model = FlakyModel(failures=0)
+        for _ in range(10):
+            with live_metrics.model_call(model):
+                pass
+            live_metrics.record_usage(model, normalized_usage(100, 20, cached_tokens=50))
+        live_metrics.episode_finished("taboo")
+        live_metrics.episode_finished("taboo", failed=True)
+        text = live_metrics.to_prometheus_text()
+        self.assertIn('clem_episodes_total{game="taboo",status="completed"} 1', text)
+        self.assertIn('clem_episodes_total{game="taboo",status="failed"} 1', text)
+        self.assertIn('clem_call_latency_seconds{backend="openai",model="flaky",quantile="0.99"}', text)
+        self.assertIn('clem_tokens_total{backend="openai",model="flaky",kind="completion"} 200', text)
+        self.assertIn('clem_tokens_total{backend="openai",model="flaky",kind="cached"} 500', text)
+        self.assertIn("# TYPE clem_call_latency_seconds summary", text)
+
+    def test_disabled_metrics_are_not_recorded(self):
+        live_metrics.disable()
+        live_metrics.episode_finished("taboo")
+        with self.assertRaises(RateLimitError):
+            FlakyModel(failures=3).generate_response([])
+        self.assertNotIn("clem_episodes_total{", live_metrics.to_prometheus_text())
+        self.assertNotIn("clem_rate_limited_total{", live_metrics.to_prometheus_text())
+
+    def test_http_server_and_file(self):
+        live_metrics.episode_finished("taboo")
+        server = live_metrics.start_http_server(0)
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+                self.assertIn("text/plain", response.headers["Content-Type"])
+                self.assertIn('clem_episodes_total{game="taboo",status="completed"} 1', response.read().decode())
+        finally:
+            server.shutdown()
+            server.server_close()
+        file_path = os.path.join(tempfile.mkdtemp(), "clembench.prom")
+        live_metrics.start_file_writer(file_path, interval=3600).set()
+        with open(file_path) as f:
+            self.assertIn('clem_episodes_total{game="taboo",status="completed"} 1', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
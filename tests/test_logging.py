@@ -1,5 +1,8 @@
+import logging
+import logging.handlers
 import unittest
 
+import clemgame
 from backends import get_model_for, load_model_registry
 
 
@@ -9,3 +12,25 @@ class TabooTestCase(unittest.TestCase):
         load_model_registry()
         model = get_model_for("vicuna-7b-v1.5")
         assert model is not None
+
+
+class LoggingTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        clemgame.set_verbosity("events")
+
+    def test_handlers_are_behind_queues(self):
+        for logger in [logging.getLogger(), logging.getLogger("benchmark.run")]:
+            self.assertTrue(any(isinstance(handler, logging.handlers.QueueHandler) for handler in logger.handlers))
+            self.assertFalse(any(type(handler) in (logging.FileHandler, logging.StreamHandler)
+                                 for handler in logger.handlers))
+
+    def test_throughput_verbosity_disables_event_records(self):
+        events_logger = logging.getLogger(clemgame.EVENTS_LOGGER)
+        clemgame.set_verbosity("throughput")
+        self.assertFalse(events_logger.isEnabledFor(logging.INFO))
+        self.assertTrue(events_logger.isEnabledFor(logging.WARNING))
+        clemgame.set_verbosity("events")
+        self.assertTrue(events_logger.isEnabledFor(logging.INFO))
+        with self.assertRaises(ValueError):
+            clemgame.set_verbosity("all")
@@ -0,0 +1,41 @@
+import importlib.util
+import unittest
+
+import backends
+
+# the onnxruntime backend is optional (see requirements_hf.txt):
+HAS_ONNXRUNTIME = all(importlib.util.find_spec(package) is not None for package in ["onnxruntime", "optimum", "torch"])
+
+MODEL_SPEC = backends.ModelSpec(**{
+    "model_name": "tiny-random-gpt2-onnx",
+    "backend": "onnxruntime",
+    "huggingface_id": "hf-internal-testing/tiny-random-gpt2",
+    "export": True,
+    "premade_chat_template": False,
+    "custom_chat_template": "{% for message in messages %}{{ message['content'] }}\n{% endfor %}",
+    "eos_to_cull": "<|endoftext|>"
+})
+
+
+@unittest.skipUnless(HAS_ONNXRUNTIME, "requires onnxruntime, optimum and torch")
+class OnnxRuntimeTestCase(unittest.TestCase):
+
+    def test_session_options(self):
+        from backends.onnxruntime_api import get_session_options
+        session_options = get_session_options(backends.ModelSpec(model_name="model", intra_op_threads=2))
+        self.assertEqual(session_options.intra_op_num_threads, 2)
+
+    def test_load_and_generate(self):
+        from backends.onnxruntime_api import OnnxRuntime
+        model = OnnxRuntime().get_model_for(MODEL_SPEC)
+        self.assertFalse(model.model.use_io_binding)  # not on the CPU
+        model.set_gen_args(temperature=0.0, max_tokens=5)
+        prompt, response, response_text = model.generate_response([{"role": "user", "content": "Hello there!"}])
+        self.assertEqual(prompt["max_new_tokens"], 5)
+        self.assertIsInstance(response_text, str)
+        # greedy decoding is deterministic:
+        self.assertEqual(model.generate_response([{"role": "user", "content": "Hello there!"}])[2], response_text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import pickle
+import threading
+import unittest
+
+from backends import ModelSpec, Model, ContextExceededError
+from backends.replicas import parse_cpu_list, split_cores, core_groups_from_spec, available_cores, ReplicatedModel
+from backends.utils import AlternatingMessages
+
+
+class RecordingReplica:
+    """ stands in for a worker process """
+
+    def __init__(self):
+        self.pending_calls = 0
+        self.calls = []
+
+    def call(self, messages, gen_args):
+        self.calls.append((messages, gen_args))
+        return messages, {}, "answer"
+
+
+class ReplicasTestCase(unittest.TestCase):
+
+    def test_parse_cpu_list(self):
+        self.assertEqual(parse_cpu_list("0-3,8-9\n"), [0, 1, 2, 3, 8, 9])
+        self.assertEqual(parse_cpu_list("5"), [5])
+
+    def test_split_cores(self):
+        self.assertEqual(split_cores([0, 1, 2, 3, 4], 2), [[0, 1, 2], [3, 4]])
+        with self.assertRaises(ValueError):
+            split_cores([0, 1], 3)
+
+    def test_core_groups_from_spec(self):
+        spec = ModelSpec(model_name="model", replicas=[[0, 1], [2, 3]])
+        self.assertEqual(core_groups_from_spec(spec), [[0, 1], [2, 3]])
+        spec = ModelSpec(model_name="model", replicas=1)
+        self.assertEqual(core_groups_from_spec(spec), [available_cores()])
+        numa_groups = core_groups_from_spec(ModelSpec(model_name="model", replicas="numa"))
+        self.assertEqual(sorted(core for group in numa_groups for core in group), available_cores())
+        with self.assertRaises(ValueError):
+            core_groups_from_spec(ModelSpec(model_name="model", replicas="many"))
+
+    def test_context_exceeded_error_survives_the_worker_process(self):
+        error = pickle.loads(pickle.dumps(ContextExceededError("Exceeded", tokens_used=10, tokens_left=-2,
+                                                               context_size=8)))
+        self.assertEqual(error.tokens_used, 10)
+        self.assertEqual(error.context_size, 8)
+        self.assertEqual(str(error), "Exceeded 10/8")
+
+    def test_messages_are_sent_as_plain_list(self):
+        model = ReplicatedModel.__new__(ReplicatedModel)  # without starting worker processes
+        Model.__init__(model, ModelSpec(model_name="model"))
+        model.replicas, model._dispatch_lock = [RecordingReplica()], threading.Lock()
+        messages = AlternatingMessages().update([{"role": "user", "content": "Hello"}])
+        model.generate_response(messages)
+        sent_messages, _ = model.replicas[0].calls[0]
+        self.assertIs(type(sent_messages), list)
+        self.assertEqual(sent_messages, [{"role": "user", "content": "Hello"}])
+        self.assertEqual(model.replicas[0].pending_calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import unittest
+
+from backends import ModelSpec, Model, residency
+from backends.residency import ResidencyManager, ResidentModel, parse_memory_size, weight_files_bytes
+
+
+class FakeResidentModel(Model, ResidentModel):
+
+    def __init__(self, model_name: str, footprint: int):
+        super().__init__(ModelSpec(model_name=model_name))
+        self.footprint = footprint
+        self.location = "gpu"
+        self.reloads = 0
+
+    @residency.keep_resident
+    def generate_response(self, messages):
+        return messages, {}, "answer"
+
+    def memory_footprint(self) -> int:
+        return self.footprint
+
+    def is_resident(self) -> bool:
+        return self.location == "gpu"
+
+    def evict(self, offload: str):
+        self.location = offload
+
+    def reload(self):
+        self.location = "gpu"
+        self.reloads += 1
+
+
+class ResidencyManagerTestCase(unittest.TestCase):
+
+    def test_parse_memory_size(self):
+        self.assertEqual(parse_memory_size("512MB"), 512 * 1024 ** 2)
+        self.assertEqual(parse_memory_size("1.5gb"), int(1.5 * 1024 ** 3))
+        self.assertEqual(parse_memory_size(100), 100)
+        with self.assertRaises(ValueError):
+            parse_memory_size("many")
+
+    def test_least_recently_used_model_is_evicted(self):
+        manager = ResidencyManager(budget=10, offload="cpu")
+        model_a, model_b, model_c = FakeResidentModel("a", 4), FakeResidentModel("b", 4), FakeResidentModel("c", 4)
+        manager.register(model_a)
+        manager.register(model_b)
+        manager.acquire(model_a)  # b is now the least recently used
+        manager.register(model_c)
+        self.assertTrue(model_a.is_resident())
+        self.assertEqual(model_b.location, "cpu")
+        self.assertTrue(model_c.is_resident())
+        self.assertEqual(manager.resident_bytes(), 8)
+
+    def test_evicted_model_is_reloaded_on_demand(self):
+        manager = ResidencyManager(budget=5)
+        model_a, model_b = FakeResidentModel("a", 4), FakeResidentModel("b", 4)
+        manager.register(model_a)
+        manager.register(model_b)
+        self.assertEqual(model_a.location, "disk")
+        manager.acquire(model_a)
+        self.assertTrue(model_a.is_resident())
+        self.assertEqual(model_a.reloads, 1)
+        self.assertEqual(model_b.location, "disk")
+
+    def test_room_is_made_before_loading(self):
+        manager = ResidencyManager(budget=10)
+        model_a, model_b = FakeResidentModel("a", 4), FakeResidentModel("b", 4)
+        manager.register(model_a)
+        manager.register(model_b)
+        manager.prepare_load("c", footprint=4)  # the weights of c are not loaded yet
+        self.assertEqual(model_a.location, "disk")
+        self.assertTrue(model_b.is_resident())
+
+    def test_weight_files_bytes(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            for file_name, size in [("model-1.safetensors", 3), ("model-2.safetensors", 4), ("pytorch_model.bin", 7),
+                                    ("config.json", 1)]:
+                with open(os.path.join(model_dir, file_name), "wb") as f:
+                    f.write(b"0" * size)
+            self.assertEqual(weight_files_bytes(model_dir, ["*.safetensors", "*.bin"]), 7)
+            self.assertEqual(weight_files_bytes(model_dir, ["*.gguf"]), 0)
+
+    def test_models_in_use_are_not_evicted(self):
+        manager = ResidencyManager(budget=5)
+        model_a, model_b = FakeResidentModel("a", 4), FakeResidentModel("b", 4)
+        manager.acquire(model_a)  # e.g. generating in another thread
+        manager.register(model_b)
+        self.assertTrue(model_a.is_resident())
+        self.assertTrue(manager.is_in_use(model_a))
+        manager.release(model_a)
+        self.assertFalse(manager.is_in_use(model_a))
+        manager.acquire(model_b)
+        self.assertEqual(model_a.location, "disk")
+        self.assertTrue(model_b.is_resident())
+
+    def test_model_is_released_after_generation(self):
+        residency.configure("6B")
+        try:
+            model_a = FakeResidentModel("a", 4)
+            model_a.generate_response([])
+            self.assertFalse(residency.get_residency_manager().is_in_use(model_a))
+        finally:
+            residency.configure(None)
+
+    def test_unused_models_are_not_kept_alive(self):
+        manager = ResidencyManager(budget=10)
+        manager.register(FakeResidentModel("a", 4))
+        self.assertEqual(manager.resident_bytes(), 0)
+
+    def test_no_eviction_without_budget(self):
+        residency.configure(None)
+        model_a, model_b = FakeResidentModel("a", 4), FakeResidentModel("b", 4)
+        model_a.generate_response([])
+        model_b.generate_response([])
+        self.assertTrue(model_a.is_resident() and model_b.is_resident())
+
+    def test_configured_budget_applies_on_generation(self):
+        residency.configure("6B")
+        try:
+            model_a, model_b = FakeResidentModel("a", 4), FakeResidentModel("b", 4)
+            model_a.generate_response([])
+            model_b.generate_response([])
+            self.assertFalse(model_a.is_resident())
+            model_a.generate_response([])
+            self.assertTrue(model_a.is_resident())
+            self.assertFalse(model_b.is_resident())
+        finally:
+            residency.configure(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
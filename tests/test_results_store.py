@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+from clemgame import results_store
+from clemgame.clemgame import GameRecorder
+from clemgame.results_store import SQLiteStore, DirectoryStore
+
+
+def play(recorder: GameRecorder):
+    recorder.log_players({"GM": "Game master", "Player 1": "mock"})
+    recorder.log_next_turn()
+    recorder.log_event("Player 1", "GM", {"type": "get message", "content": "Answer."},
+                       call=([{"role": "user", "content": "Question?"}], {"n": 1}))
+
+
+class ResultsStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        results_store.close_stores()
+
+    def test_open_store_by_results_dir(self):
+        self.assertIsInstance(results_store.open_store(self.tmp_dir), DirectoryStore)
+        store = results_store.open_store(os.path.join(self.tmp_dir, "run.sqlite"))
+        self.assertIsInstance(store, SQLiteStore)
+        self.assertIs(results_store.open_store(os.path.join(self.tmp_dir, "run.sqlite")), store)
+
+    def test_sqlite_store_lists_and_finds_artifacts(self):
+        store = results_store.open_store(os.path.join(self.tmp_dir, "run.sqlite"))
+        store.store_results_file({"name": "exp"}, "experiment_exp.json", "pair", "game", sub_dir="0_exp")
+        for episode_dir in ["episode_0", "episode_1"]:
+            store.store_results_file({"episode scores": {}}, "scores.json", "pair", "game",
+                                     sub_dir=f"0_exp/{episode_dir}")
+        store.store_results_file("<html/>", "transcript.html", "pair", "game", sub_dir="0_exp/episode_0")
+        self.assertEqual(store.list_dirs(), ["pair"])
+        self.assertEqual(store.list_dirs("pair/game"), ["0_exp"])
+        self.assertEqual(store.list_dirs("pair/game/0_exp"), ["episode_0", "episode_1"])
+        self.assertEqual(store.find_files("scores.json"), ["pair/game/0_exp/episode_0/scores.json",
+                                                           "pair/game/0_exp/episode_1/scores.json"])
+        self.assertEqual(store.load_results_json("0_exp/experiment_exp", "pair", "game"), {"name": "exp"})
+        self.assertEqual(store.load_text("pair/game/0_exp/episode_0/transcript.html"), "<html/>")
+        with self.assertRaises(FileNotFoundError):
+            store.load_results_json("0_exp/episode_2/scores", "pair", "game")
+
+    def test_sqlite_store_lists_dirs_of_all_levels(self):
+        store = results_store.open_store(os.path.join(self.tmp_dir, "run.sqlite"))
+        store.store_file("model,score", "results.csv")  # a file in the results root is no dir
+        store.store_file({}, "pair_a/usage.json")
+        store.store_file({}, "pair_b/game/0_exp/episode_0/images/image.json")
+        self.assertEqual(store.list_dirs(), ["pair_a", "pair_b"])
+        self.assertEqual(store.list_dirs("pair_a"), [])
+        self.assertEqual(store.list_dirs("pair_b"), ["game"])
+        self.assertEqual(store.list_dirs("pair_b/game/0_exp/episode_0"), ["images"])
+        self.assertEqual(store.list_dirs("pair_c"), [])
+
+    def test_directory_store_finds_artifacts(self):
+        store = results_store.open_store(self.tmp_dir)
+        store.store_results_file({"episode scores": {}}, "scores.json", "pair", "game", sub_dir="0_exp/episode_0")
+        self.assertEqual(store.list_dirs("pair/game/0_exp"), ["episode_0"])
+        self.assertEqual(store.find_files("scores.json"), ["pair/game/0_exp/episode_0/scores.json"])
+
+    def test_recorder_streams_into_sqlite_store(self):
+        results_root = os.path.join(self.tmp_dir, "run.sqlite")
+        recorder = GameRecorder("game")
+        recorder.stream_records(results_root, "pair", "0_exp/episode_0")
+        play(recorder)
+        recorder.store_records(results_root, "pair", "0_exp/episode_0")
+        self.assertEqual(os.listdir(self.tmp_dir), ["run.sqlite"])  # the stream files are removed
+        requests = recorder.load_results_json("0_exp/episode_0/requests", results_root, "pair")
+        self.assertEqual(requests[0]["raw_response_obj"], {"n": 1})
+        interactions = recorder.load_results_json("0_exp/episode_0/interactions", results_root, "pair")
+        self.assertEqual(len(interactions["turns"]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
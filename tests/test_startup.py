@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import unittest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loaded_modules_after(code: str):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PROJECT_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    output = subprocess.run([sys.executable, "-c", code + "; import sys; print('\\n'.join(sys.modules))"],
+                            cwd=PROJECT_ROOT, env=env, check=True, capture_output=True, text=True).stdout
+    return set(output.splitlines())
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_import_does_not_load_games(self):
+        modules = loaded_modules_after("import clemgame, backends")
+        self.assertFalse([module for module in modules if module.startswith("games.")])
+        self.assertNotIn("nltk", modules)
+
+    def test_list_games_does_not_load_registered_games(self):
+        modules = loaded_modules_after("from clemgame import benchmark; benchmark.list_games()")
+        self.assertFalse([module for module in modules if module.startswith("games.")])
+
+    def test_find_benchmark_only_loads_requested_game(self):
+        modules = loaded_modules_after("from clemgame.clemgame import find_benchmark; find_benchmark('hellogame')")
+        self.assertIn("games.hellogame.master", modules)
+        self.assertNotIn("games.taboo.master", modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
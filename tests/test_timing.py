@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from backends import ModelSpec, Model
+from clemgame import timing
+from clemgame.clemgame import Player
+
+
+class NamedModel(Model):
+    """ Counts the lookups of its name """
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="named"))
+        self.name_lookups = 0
+
+    def get_name(self) -> str:
+        self.name_lookups += 1
+        return super().get_name()
+
+    def generate_response(self, messages):
+        return messages, {}, "answer"
+
+
+class TimingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        timing.reset()
+        timing.enable()
+
+    def tearDown(self):
+        timing.disable()
+        timing.reset()
+
+    def test_disabled_spans_are_not_recorded(self):
+        timing.disable()
+        with timing.span("episode", game="taboo"):
+            pass
+        self.assertEqual(timing.get_spans(), [])
+
+    def test_nested_spans_inherit_attributes_and_self_duration(self):
+        with timing.span("episode", game="taboo", model="mock"):
+            with timing.span("backend_call", model="other"):
+                time.sleep(0.01)
+            with timing.span("parse"):
+                pass
+        call, episode, parse = sorted(timing.get_spans(), key=lambda s: s.name)
+        self.assertEqual(call.attributes, {"game": "taboo", "model": "other"})
+        self.assertEqual(parse.attributes, {"game": "taboo", "model": "mock"})
+        self.assertEqual((episode.depth, call.depth), (0, 1))
+        self.assertAlmostEqual(episode.children_duration, call.duration + parse.duration)
+        self.assertLess(episode.self_duration, episode.duration)
+        self.assertGreaterEqual(call.duration, 0.01)
+
+    def test_chrome_trace(self):
+        with timing.span("episode", game="taboo"):
+            with timing.span("prompt"):
+                pass
+        trace_file = os.path.join(tempfile.mkdtemp(), "trace.json")
+        timing.write_chrome_trace(trace_file)
+        with open(trace_file) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual([e["name"] for e in events], ["episode", "prompt"])
+        self.assertEqual(events[0]["ts"], 0.0)
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[1]["args"], {"game": "taboo"})
+        self.assertGreaterEqual(events[0]["dur"], events[1]["dur"])
+
+    def test_summarize_by_game_and_model(self):
+        for model in ["a", "a", "b"]:
+            with timing.span("episode", game="taboo", model=model):
+                with timing.span("backend_call"):
+                    pass
+        rows = timing.summarize(group_by=("game", "model"))
+        counts = {(row["model"], row["span"]): row["count"] for row in rows}
+        self.assertEqual(counts, {("a", "episode"): 2, ("a", "backend_call"): 2,
+                                  ("b", "episode"): 1, ("b", "backend_call"): 1})
+        self.assertAlmostEqual(sum(row["share"] for row in rows), 1.0)
+        self.assertIn("backend_call", timing.summary_table())
+
+    def test_backend_call_names_the_player_model(self):
+        player = Player(NamedModel())
+        with timing.span("episode", game="taboo", model="named--other"):
+            player([{"role": "user", "content": "Question?"}], 0)
+        call = next(s for s in timing.get_spans() if s.name == "backend_call")
+        self.assertEqual(call.attributes, {"game": "taboo", "model": "named--other", "backend_model": "named"})
+
+    def test_disabled_backend_call_does_not_look_up_the_model_name(self):
+        timing.disable()
+        model = NamedModel()
+        player = Player(model)
+        model.name_lookups = 0
+        player([{"role": "user", "content": "Question?"}], 0)
+        self.assertEqual(model.name_lookups, 1)  # only for the model_name of the call record
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from backends.token_counting import TokenCounter, for_encoder
+
+
+def apply_template(messages):
+    """ A fake chat template: one token per message role marker plus two tokens for the generation prompt """
+    tokens = []
+    for message in messages:
+        tokens.append(f"<{message['role']}>")
+        tokens.extend(message["content"].split())
+    return tokens + ["<assistant>", ":"]
+
+
+class TokenCounterTestCase(unittest.TestCase):
+
+    def test_only_new_messages_are_tokenized(self):
+        counter = for_encoder(str.split)
+        history = [{"role": "user", "content": "Initial Prompt"}]
+        self.assertEqual(counter.count_messages(history), 2)
+        history.append({"role": "assistant", "content": "Turn 1 response"})
+        self.assertEqual(counter.count_messages(history), 5)
+        self.assertEqual(counter.cache_misses, 2)
+        self.assertEqual(counter.cache_hits, 1)
+
+    def test_changed_message_is_tokenized_again(self):
+        counter = for_encoder(str.split)
+        message = {"role": "user", "content": "Initial Prompt"}
+        counter.count_messages([message])
+        message["content"] = "Changed"
+        self.assertEqual(counter.count_messages([message]), 1)
+
+    def test_messages_with_unhashable_values_are_cached(self):
+        counter = for_encoder(str.split)
+        message = {"role": "user", "content": "Describe the image", "image": ["images/cat.png"]}
+        self.assertEqual(counter.count_messages([message]), 3)
+        self.assertEqual(counter.count_messages([dict(message)]), 3)
+        self.assertEqual(counter.cache_hits, 1)
+
+    def test_overheads_are_added(self):
+        counter = TokenCounter(lambda message: len(message["content"].split()),
+                               per_message_overhead=4, per_prompt_overhead=2)
+        messages = [{"role": "user", "content": "Initial Prompt"}, {"role": "assistant", "content": "Turn 1"}]
+        self.assertEqual(counter.count_messages(messages), 4 + 2 * 4 + 2)
+
+    def test_calibrate_chat_template_gives_exact_counts(self):
+        counter = for_encoder(str.split)
+        counter.calibrate_chat_template(lambda messages: len(apply_template(messages)))
+        messages = [
+            {"role": "user", "content": "Initial Prompt"},
+            {"role": "assistant", "content": "Turn 1"},
+            {"role": "user", "content": "Prompt 2 is longer"},
+        ]
+        self.assertEqual(counter.count_messages(messages), len(apply_template(messages)))
+
+    def test_calibrate_does_not_underestimate(self):
+        counter = for_encoder(str.split)
+        messages = [{"role": "user", "content": "Initial Prompt"}]
+        counter.calibrate(messages, len(apply_template(messages)))
+        self.assertGreaterEqual(counter.count_messages(messages), len(apply_template(messages)))
+
+    def test_cache_is_bounded(self):
+        counter = TokenCounter(lambda message: 1, max_cached_messages=2)
+        for idx in range(3):
+            counter.count_message({"role": "user", "content": str(idx)})
+        counter.count_message({"role": "user", "content": "0"})
+        self.assertEqual(counter.cache_misses, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from backends import ModelSpec, Model
+from backends.utils import USAGE_KEY, normalized_usage, openai_usage, with_choice_usage, trimmed_response
+from clemgame.clemgame import Player, GameRecorder
+from clemgame.token_usage import UsageByModel
+
+
+class UsageModel(Model):
+
+    def __init__(self, model_name: str = "usage"):
+        super().__init__(ModelSpec(model_name=model_name))
+
+    def generate_response(self, messages):
+        usage = normalized_usage(prompt_tokens=10 * len(messages), completion_tokens=5, cached_tokens=2)
+        return messages, {"text": "answer", USAGE_KEY: usage}, "answer"
+
+
+class UsagePlayer(Player):
+    pass
+
+
+class BackendUsageTestCase(unittest.TestCase):
+
+    def test_openai_usage(self):
+        usage = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120,
+                 "prompt_tokens_details": {"cached_tokens": 64}}
+        self.assertEqual(openai_usage(usage), {"prompt_tokens": 100, "completion_tokens": 20, "cached_tokens": 64})
+        self.assertEqual(openai_usage(None), {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+
+    def test_request_usage_is_assigned_to_the_first_choice(self):
+        response = {"choices": [], USAGE_KEY: normalized_usage(100, 40)}
+        self.assertEqual(with_choice_usage(response, 0)[USAGE_KEY], normalized_usage(100, 40))
+        self.assertEqual(with_choice_usage(response, 1)[USAGE_KEY], normalized_usage(0, 0))
+        self.assertEqual(response[USAGE_KEY], normalized_usage(100, 40))
+
+    def test_local_responses_have_usage(self):
+        response = trimmed_response("answer", "prompt", prompt_tokens=7, completion_tokens=3)
+        self.assertEqual(response[USAGE_KEY], normalized_usage(7, 3))
+
+
+class UsageAggregationTestCase(unittest.TestCase):
+
+    def test_player_aggregates_usage(self):
+        player = UsagePlayer(UsageModel())
+        messages = [{"role": "user", "content": "Question?"}]
+        player(messages, 0)
+        messages += [{"role": "assistant", "content": "answer"}, {"role": "user", "content": "Another question?"}]
+        _, response, _ = player(messages, 1)
+        usage = response["clem_player"]["usage"]
+        self.assertEqual(usage["calls"], 2)
+        self.assertEqual((usage["prompt_tokens"], usage["completion_tokens"], usage["cached_tokens"]), (40, 10, 4))
+        self.assertEqual(usage["total_tokens"], 50)
+
+    def test_recorder_sums_up_usage_per_model(self):
+        recorder = GameRecorder("game")
+        recorder.log_next_turn()
+        for player in [UsagePlayer(UsageModel("a")), UsagePlayer(UsageModel("b")), UsagePlayer(UsageModel("b"))]:
+            prompt, response, response_text = player([{"role": "user", "content": "Question?"}], 0)
+            recorder.log_event("Player 1", "GM", {"type": "get message", "content": response_text},
+                               call=(prompt, response))
+        recorder.log_event("GM", "GM", {"type": "metadata", "content": "no call"})
+        usage = recorder.usage.to_dict()
+        self.assertEqual(usage["total"]["calls"], 3)
+        self.assertEqual(usage["total"]["prompt_tokens"], 30)
+        self.assertEqual(usage["models"]["b"]["completion_tokens"], 10)
+
+    def test_programmatic_responses_have_no_usage(self):
+        usage = UsageByModel()
+        self.assertFalse(usage.add_response({"clem_player": {"model_name": "mock", "call_seconds": 0.0}}))
+        self.assertFalse(usage)
+
+    def test_call_seconds_are_summed_up(self):
+        usage = UsageByModel()
+        for call_seconds in [1.25, 0.75]:
+            usage.add_response({"clem_player": {"model_name": "a", "call_seconds": call_seconds},
+                                USAGE_KEY: normalized_usage(10, 5)})
+        totals = usage.to_dict()["models"]["a"]
+        self.assertEqual(totals["duration"], 2.0)
+        self.assertEqual(totals["tokens_per_sec"], 15.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
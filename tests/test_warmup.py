@@ -0,0 +1,62 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from backends import ModelSpec, Model, CustomResponseModel, load_model_registry, residency, warmup
+from backends.warmup import warm_up, probe, WarmUpError
+
+
+class RecordingModel(Model):
+
+    def __init__(self):
+        super().__init__(ModelSpec(model_name="recording"))
+        self.set_gen_args(temperature=0.7, max_tokens=100)
+        self.calls = []
+
+    def generate_response(self, messages):
+        self.calls.append(self.get_gen_args())
+        return messages, None, "Hi"
+
+
+class WarmUpTestCase(unittest.TestCase):
+
+    def setUp(self):
+        load_model_registry()
+
+    def test_probe_requests_a_single_token(self):
+        model = RecordingModel()
+        self.assertGreaterEqual(probe(model), 0.0)
+        self.assertEqual(model.calls, [dict(temperature=0.0, max_tokens=1)])
+        self.assertEqual(model.get_gen_args(), dict(temperature=0.7, max_tokens=100))
+
+    def test_warm_up_returns_models_in_order_with_reports(self):
+        models, reports = warm_up([ModelSpec(model_name="mock"), ModelSpec(model_name="dry_run")])
+        self.assertEqual([model.get_name() for model in models], ["mock", "dry_run"])
+        self.assertIsInstance(models[0], CustomResponseModel)
+        self.assertEqual(reports[0]["first_response_duration"], 0.0)
+
+    def test_warm_up_fails_for_unknown_model(self):
+        with self.assertRaises(WarmUpError) as context:
+            warm_up([ModelSpec(model_name="mock"), ModelSpec(model_name="unknown_model")])
+        self.assertEqual([model_name for model_name, _ in context.exception.failures], ["unknown_model"])
+
+    def test_warm_up_reports_the_weights_throughput_of_local_models(self):
+        model = RecordingModel()
+        model.load_report = {"load_duration": 2.0, "weights_bytes": 4_000_000_000, "throughput": 2e9}
+        with mock.patch("backends.get_model_for", return_value=model):
+            _, reports = warm_up([ModelSpec(model_name="recording")])
+        self.assertEqual(reports[0]["weights_throughput"], 2e9)
+
+    def test_warm_up_loads_one_model_at_a_time_with_memory_budget(self):
+        residency.configure("24GB")
+        try:
+            with mock.patch.object(warmup, "ThreadPoolExecutor", wraps=ThreadPoolExecutor) as executor:
+                models, _ = warm_up([ModelSpec(model_name="mock"), ModelSpec(model_name="dry_run")])
+            executor.assert_called_once_with(max_workers=1)
+            self.assertEqual(len(models), 2)
+        finally:
+            residency.configure(None)
+
+
+if __name__ == '__main__':
+    unittest.main()